@@ -0,0 +1,181 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+CONTROL_CHANNEL = "BBG_API:control"
+TARGET_ALL = "all"
+ROLE_SENDER = "sender"
+ROLE_POLLER = "poller"
+
+
+class BloombergControlListener:
+    """
+    Listens on the redis pub/sub control channel on its own thread so EXIT / PAUSE / RESUME
+    and friends reach a worker straight away instead of waiting their turn in the work queue.
+
+    A message is json {"cmd": ..., "target": all | sender | poller | worker name, "reply_to": key}.
+    The handler for cmd runs on the listener thread - it should only flip state and wake the
+    main loop.  Whatever it returns is pushed onto reply_to if the sender asked for a reply.
+    A listener the command is not for still replies with handled false, so the sender knows
+    when every subscriber has answered without waiting out its timeout.
+    """
+    REPLY_TTL_SEC = 60
+    RECONNECT_WAIT_SEC = 5
+
+    def __init__(self, redis_client, role: str, handlers: dict[str, Callable[[dict[str, Any]], Any]],
+                 channel: str = CONTROL_CHANNEL, name: str = None):
+        """
+        Args:
+            redis_client: client of the worker's BloombergRedis
+            role: sender or poller, matched against the target of a message
+            handlers: command (upper case) -> handler(message)
+            channel: pub/sub channel
+            name: this worker, host:pid by default
+        """
+        self.redis_client = redis_client
+        self.role = role
+        self.handlers = handlers
+        self.channel = channel
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"bbg_control_{self.role}", daemon=True)
+        self._thread.start()
+        logger.info(f"Listening for {self.role} commands on {self.channel} as {self.name}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message.get("type") == "message":
+                        self._handle(message["data"])
+            except Exception as e:
+                logger.error(f"Control channel {self.channel} error, resubscribing: {e}")
+                self._stop_event.wait(BloombergControlListener.RECONNECT_WAIT_SEC)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _handle(self, data) -> None:
+        try:
+            message: dict[str, Any] = orjson.loads(data)
+        except Exception as e:
+            logger.warning(f"Bad control message {data}: {e}")
+            return
+
+        target = message.get("target") or TARGET_ALL
+        cmd = (message.get("cmd") or "").upper()
+        reply_to = message.get("reply_to")
+        if target not in (TARGET_ALL, self.role, self.name):
+            self._reply(reply_to, cmd, None, handled=False)
+            return
+        handler = self.handlers.get(cmd)
+        if handler is None:
+            logger.info(f"No {self.role} handler for control command {cmd}")
+            self._reply(reply_to, cmd, None, handled=False)
+            return
+
+        logger.info(f"Control command {cmd} for {target}")
+        try:
+            result = handler(message)
+        except Exception as e:
+            logger.error(f"Control command {cmd} failed: {e}")
+            result = {"error": str(e)}
+        self._reply(reply_to, cmd, result, handled=True)
+
+    def _reply(self, reply_to: Optional[str], cmd: str, result: Any, handled: bool) -> None:
+        if not reply_to:
+            return
+        try:
+            reply = orjson.dumps({"worker": self.name, "role": self.role, "cmd": cmd, "handled": handled,
+                                  "result": result}, default=str)
+            pipe = self.redis_client.pipeline()
+            pipe.lpush(reply_to, reply)
+            pipe.expire(reply_to, BloombergControlListener.REPLY_TTL_SEC)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Unable to reply to {cmd} on {reply_to}: {e}")
+
+
+def send_control(redis_client, cmd: str, target: str = TARGET_ALL, reply_wait_sec: float = 0,
+                 channel: str = CONTROL_CHANNEL, **fields) -> list[dict[str, Any]]:
+    """
+    Publish a control command.
+    Args:
+        redis_client: any redis client
+        cmd: EXIT, PAUSE, RESUME, CLR_QUEUES, RELOAD_DEFS, STATUS
+        target: all, sender, poller or one worker name
+        reply_wait_sec: wait up to this long for every subscriber to answer
+        fields: anything else the handler should see
+    Returns:
+        replies of the workers that ran the command, empty when not waiting
+    Raises:
+        RuntimeError: nobody was subscribed so the command went nowhere
+    """
+    message: dict[str, Any] = dict(fields, cmd=cmd, target=target)
+    reply_to = None
+    if reply_wait_sec > 0:
+        reply_to = f"{channel}:reply:{uuid.uuid4().hex}"
+        message["reply_to"] = reply_to
+
+    try:
+        receivers = redis_client.publish(channel, orjson.dumps(message))
+    except Exception as e:
+        logger.error(f"Error publishing {cmd} on {channel}: {e}")
+        raise
+    if not receivers:
+        # pub/sub keeps nothing - a worker that is down or resubscribing never sees it
+        logger.error(f"No listeners on {channel} - {cmd} for {target} was not delivered")
+        raise RuntimeError(f"{cmd} not delivered, nothing listening on {channel}")
+    logger.info(f"{cmd} for {target} sent to {receivers} listeners")
+
+    # every subscriber answers, the ones the command was not for with handled false
+    replies: list[dict[str, Any]] = []
+    answered = 0
+    deadline = time.time() + reply_wait_sec
+    while reply_to and answered < receivers:
+        wait_sec = deadline - time.time()
+        if wait_sec <= 0:
+            break
+        # blpop timeout is whole seconds
+        item = redis_client.blpop(reply_to, timeout=max(1, int(wait_sec)))
+        if item is None:
+            break
+        answered += 1
+        reply = orjson.loads(item[1])
+        if reply.get("handled", True):
+            replies.append(reply)
+    if reply_to and answered < receivers:
+        logger.warning(f"{answered} of {receivers} listeners answered {cmd} within {reply_wait_sec}s")
+    return replies
+
+
+def control_listener_from_env(redis_client, role: str,
+                              handlers: dict[str, Callable[[dict[str, Any]], Any]]) -> Optional[BloombergControlListener]:
+    """BBG_CONTROL_CHANNEL names the channel, blank leaves commands to the work queue only"""
+    channel = os.environ.get("BBG_CONTROL_CHANNEL", CONTROL_CHANNEL)
+    if not channel:
+        return None
+    return BloombergControlListener(redis_client, role, handlers, channel=channel)
@@ -1,24 +1,86 @@
 import datetime
 from datetime import timedelta
+import io
 import json  # for storing in db
 import os
 import re
+import tempfile
+import threading
+import time
 import logging
-from typing import Any, Optional, Tuple
+from collections import Counter
+from typing import Any, IO, Optional, Tuple
 import uuid
 from ASL.utils.asql import SQLObject
 # from ASL import SQLObject
 from bbg_request import BloombergRequest
+from bbg_response_store import response_store_from_env
 
 logger = logging.getLogger(__name__)
 ## may need to rename this.
 
 ## TO DO - make status constants...
 
+class BloombergStatusBatch:
+    """
+    Status writes collected over a cycle instead of 1 statement + commit each.  Only the last
+    status per request / process type is kept since that is all the tables end up with.
+    Thread safe so pool threads can add to the same batch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_count = 0
+        self.request_status: dict[str, tuple[str, set[str]]] = {}
+        self.poll_counts: Counter = Counter()
+        self.process_status: dict[tuple[str, str], tuple] = {}
+        self.data_status: dict[str, str] = {}
+
+    def add_request_status(self, request_id: str, status: str, time_update: str) -> None:
+        with self.lock:
+            self.write_count += 1
+            _, time_updates = self.request_status.get(request_id, (None, set()))
+            if time_update:
+                time_updates.add(time_update)  # submitted_at and completed_at both stick
+            self.request_status[request_id] = (status, time_updates)
+
+    def add_polls(self, request_ids: list[str]) -> None:
+        with self.lock:
+            self.write_count += len(request_ids)
+            self.poll_counts.update(request_ids)
+
+    def add_process_status(self, request_id: str, identifier: str, request_name: str,
+                           process_type: str, process_status: str, process_error: str) -> None:
+        with self.lock:
+            self.write_count += 1
+            self.process_status[(request_id, process_type)] = (request_id, identifier, request_name,
+                                                               process_type, process_status, process_error)
+
+    def add_data_status(self, request_id: str, status: str) -> None:
+        with self.lock:
+            self.write_count += 1
+            self.data_status[request_id] = status
+
+    def is_empty(self) -> bool:
+        return self.write_count == 0
+
+
 class BloombergDatabase:
     DotRegEx = re.compile(r'\.')
     CommaRegEx = re.compile(r',')
     MAX_SAVE_SIZE = 4000
+    # SQL Server limits - 2100 params per statement and 1000 rows per VALUES list
+    MAX_SQL_PARAMS = 2000
+    MAX_INSERT_ROWS = 1000
+    STORE_CHUNK_CHARS = 512 * 1024  # characters per append when streaming a file into data_content
+    DELETE_CSV_QUERY = "DELETE FROM bloomberg_data WHERE request_id = ? and data_type = 'csv'"
+
+    # how write_db_table style loads go in, set by BBG_DB_LOAD_MODE
+    LOAD_MODE_ROW = "row"                     # old way 1 insert + commit per row
+    LOAD_MODE_BATCH = "batch"                 # multi row VALUES inserts, 1 commit
+    LOAD_MODE_EXECUTEMANY = "executemany"     # pyodbc fast_executemany, 1 commit
+    DEFAULT_ODBC_DRIVER = "ODBC Driver 17 for SQL Server"
+    LOAD_MODES = (LOAD_MODE_ROW, LOAD_MODE_BATCH, LOAD_MODE_EXECUTEMANY)
 
     def __init__(
         self,
@@ -41,7 +103,16 @@ class BloombergDatabase:
         self.port = port or os.environ.get("BBG_SQL_PORT", "")
         self.database = database or os.environ.get("BBG_DATABASE", "")
         self.username = username
-
+        self.load_mode = os.environ.get("BBG_DB_LOAD_MODE", BloombergDatabase.LOAD_MODE_BATCH).lower()
+        if self.load_mode not in BloombergDatabase.LOAD_MODES:
+            logger.warning(f"Unknown BBG_DB_LOAD_MODE {self.load_mode} using {BloombergDatabase.LOAD_MODE_BATCH}")
+            self.load_mode = BloombergDatabase.LOAD_MODE_BATCH
+        # csv responses go to disk with just a reference in bloomberg_data when this is set
+        self.response_store = response_store_from_env()
+        # status writes are queued here between begin_status_batch and flush_status_batch
+        self.status_batch: Optional[BloombergStatusBatch] = None
+        # own pyodbc connection for executemany loads, opened the first time one runs
+        self._odbc_connection = None
 
         if not all([self.server, self.port, self.database]):
             raise ValueError(
@@ -55,8 +126,148 @@ class BloombergDatabase:
         )
 
     def close(self):
+        if self._odbc_connection is not None:
+            self._odbc_connection.close()
+            self._odbc_connection = None
         self.db_connection.close()
 
+    def _odbc_connection_string(self) -> str:
+        driver = os.environ.get("BBG_SQL_ODBC_DRIVER", BloombergDatabase.DEFAULT_ODBC_DRIVER)
+        conn_str = f"DRIVER={{{driver}}};SERVER={self.server},{self.port};DATABASE={self.database};"
+        if os.environ.get("SQL_USE_WINDOWS_AUTH", "true").lower() == "true":
+            return conn_str + "Trusted_Connection=yes;"
+        username = self.username or os.environ.get("SQL_USERNAME", "")
+        return conn_str + f"UID={username};PWD={os.environ.get('SQL_PASSWORD', '')};"
+
+    def _get_odbc_connection(self) -> Any:
+        """
+        pyodbc connection of our own for executemany - SQLObject does not hand its one out.
+        Raises:
+            ValueError: pyodbc is not installed or the connection could not be opened
+        """
+        if self._odbc_connection is None:
+            try:
+                import pyodbc  # only the executemany load mode needs it
+                self._odbc_connection = pyodbc.connect(self._odbc_connection_string(), autocommit=False)
+            except Exception as e:
+                logger.error(f"Unable to open a pyodbc connection to {self.server} {self.database}: {e}")
+                raise ValueError(f"no pyodbc connection: {e}") from e
+        return self._odbc_connection
+
+    def _drop_odbc_connection(self) -> None:
+        """Forget a connection that failed a statement - the next load opens a fresh one"""
+        conn, self._odbc_connection = self._odbc_connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.debug(f"Error closing pyodbc connection {e}")
+
+    def _rollback(self) -> None:
+        try:
+            self.db_connection.execute_query(query="IF @@TRANCOUNT > 0 ROLLBACK", commit=True)
+        except Exception as e:
+            logger.error(f"Error rolling back bulk load: {e}")
+
+    def _insert_rows_executemany(self, insert_str: str, rows: list[tuple], pre_query: str) -> None:
+        conn = self._get_odbc_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.fast_executemany = True
+            if pre_query:
+                cursor.execute(pre_query)
+            cursor.executemany(insert_str, rows)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"executemany load failed, dropping the pyodbc connection: {e}")
+            try:
+                conn.rollback()
+            except Exception as rollback_e:
+                logger.error(f"Error rolling back executemany load: {rollback_e}")
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            cursor = None
+            self._drop_odbc_connection()
+            raise
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    def _insert_rows_batch(self, table: str, col_names: list[str], rows: list[tuple], pre_query: str) -> None:
+        col_str = ",".join(col_names)
+        row_marks = "(" + ",".join(["?"] * len(col_names)) + ")"
+        batch_size = max(1, min(BloombergDatabase.MAX_INSERT_ROWS,
+                                BloombergDatabase.MAX_SQL_PARAMS // max(1, len(col_names))))
+        try:
+            if pre_query:
+                self.db_connection.execute_query(query=pre_query, commit=False)
+
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                query = f"insert into {table} ({col_str}) VALUES " + ",".join([row_marks] * len(batch))
+                params = tuple(val for row in batch for val in row)
+                is_last = (start + batch_size) >= len(rows)
+                self.db_connection.execute_param_query(query=query, params=params, commit=is_last)
+
+            if not rows:
+                self.db_connection.execute_query(query="IF @@TRANCOUNT > 0 COMMIT", commit=True)
+        except Exception:
+            self._rollback()
+            raise
+
+    def _insert_rows_single(self, insert_str: str, rows: list[tuple], pre_query: str) -> None:
+        if pre_query:
+            self.db_connection.execute_query(query=pre_query, commit=True)
+
+        for params in rows:
+            logger.debug(params)
+            self.db_connection.execute_param_query(query=insert_str, params=params, commit=True)
+
+    def bulk_insert(self, table: str, col_names: list[str], rows: list[tuple],
+                    pre_query: str = None, load_mode: str = None) -> int:
+        """
+        Insert a whole response worth of rows into table in one transaction.
+
+        Args:
+            table: table to load
+            col_names: db column names, rows must line up with these
+            rows: list of param tuples
+            pre_query: optional statement run in the same transaction first (delete todays rows)
+            load_mode: row, batch or executemany - defaults to BBG_DB_LOAD_MODE
+
+        Returns:
+            number of rows inserted
+        """
+        load_mode = load_mode or self.load_mode
+        insert_str = f"insert into {table} (" + ",".join(col_names) + ") VALUES (" + ",".join(["?"] * len(col_names)) + ")"
+        logger.info(f"{load_mode} load into {table}: {insert_str}")
+        if pre_query:
+            logger.info(pre_query)
+
+        start_time = time.perf_counter()
+        if load_mode == BloombergDatabase.LOAD_MODE_EXECUTEMANY:
+            try:
+                # only getting the connection falls back - once statements have run a failure is a failure
+                self._get_odbc_connection()
+            except ValueError as e:
+                logger.warning(f"executemany not available {e} falling back to {BloombergDatabase.LOAD_MODE_BATCH}")
+                load_mode = BloombergDatabase.LOAD_MODE_BATCH
+            if load_mode == BloombergDatabase.LOAD_MODE_EXECUTEMANY:
+                self._insert_rows_executemany(insert_str, rows, pre_query)
+            else:
+                self._insert_rows_batch(table, col_names, rows, pre_query)
+        elif load_mode == BloombergDatabase.LOAD_MODE_ROW:
+            self._insert_rows_single(insert_str, rows, pre_query)
+        else:
+            self._insert_rows_batch(table, col_names, rows, pre_query)
+
+        elapsed = time.perf_counter() - start_time
+        rows_per_sec = len(rows) / elapsed if elapsed > 0 else float(len(rows))
+        logger.info(f"Loaded {len(rows)} rows into {table} in {elapsed:.3f}s ({rows_per_sec:.0f} rows/sec) mode {load_mode}")
+        return len(rows)
+
     def save_bbg_request(
         self, request: BloombergRequest, title: str, status : str ='pending'
     ):
@@ -64,12 +275,14 @@ class BloombergDatabase:
         try:
             query: str = """
                     if exists(select 1 from bloomberg_requests where request_id = ?)
-                        update bloomberg_requests set identifier = ?, name = ?, title = ?, payload = ?, priority = ?, status = ?
+                        update bloomberg_requests set identifier = ?, name = ?, title = ?, payload = ?, priority = ?, status = ?,
+                            parent_request_id = ?, chunk_index = ?, chunk_count = ?, universe_size = ?
                             where request_id = ?
                     else
                       INSERT INTO bloomberg_requests 
-                       (request_id, identifier, name, title, payload, priority, status)
-                      VALUES (?, ?, ?, ?, ?, ?, ?)
+                       (request_id, identifier, name, title, payload, priority, status,
+                        parent_request_id, chunk_index, chunk_count, universe_size)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """
             request_payload = json.dumps(request.request_payload)
             payload_size = len(request_payload)
@@ -78,6 +291,7 @@ class BloombergDatabase:
                 logger.warning(f"request_payload size {payload_size} is larger than database column size of {BloombergDatabase.MAX_SAVE_SIZE} trimming")
                 request_payload = request_payload[:BloombergDatabase.MAX_SAVE_SIZE]
 
+            universe_size = BloombergDatabase.get_universe_size(request.request_payload)
             params : tuple = (
                 request.request_id,
                 request.identifier,
@@ -86,6 +300,10 @@ class BloombergDatabase:
                 request_payload,
                 request.priority,
                 status,
+                request.parent_request_id,
+                request.chunk_index,
+                request.chunk_count,
+                universe_size,
                 request.request_id,
                 request.request_id,
                 request.identifier,
@@ -94,6 +312,10 @@ class BloombergDatabase:
                 request_payload,
                 request.priority,
                 status,
+                request.parent_request_id,
+                request.chunk_index,
+                request.chunk_count,
+                universe_size,
             )
             logger.info(query)
             self.db_connection.execute_param_query(
@@ -104,8 +326,19 @@ class BloombergDatabase:
             logger.error(f"Error storing request in database: {e}")
             raise
 
+    @staticmethod
+    def get_universe_size(request_payload: Any) -> Optional[int]:
+        try:
+            return len(request_payload["universe"]["contains"])
+        except (KeyError, TypeError):
+            return None
+
     def update_request_status(self, request_id: str, status: str, time_update : str = ""):
         """Update request status in database"""
+        if self.status_batch is not None:
+            self.status_batch.add_request_status(request_id, status, time_update)
+            return
+
         try:
             query: str = " ".join(
                 ["UPDATE bloomberg_requests SET status = ?, updated_at = GETDATE()",
@@ -113,7 +346,7 @@ class BloombergDatabase:
                 "WHERE request_id = ?"]
             )
             params = (status, request_id)
-            logger.info(query)
+            logger.debug(query)
             self.db_connection.execute_param_query(
                 query=query, params=params, commit=True
             )
@@ -123,7 +356,23 @@ class BloombergDatabase:
             raise
 
     def set_request_failed(self, request_id : str):
-        self.update_request_status(request_id, 'failed')
+        # 'error' - bbg_requests_status_check has no 'failed'
+        self.update_request_status(request_id, 'error')
+
+    def set_request_retry(self, request_id : str, retry_count : int):
+        """Back to pending with the retry count bumped - it is waiting on the retry queue"""
+        try:
+            query: str = """UPDATE bloomberg_requests SET status = 'pending', request_retry_count = ?,
+                updated_at = GETDATE() WHERE request_id = ?"""
+            params = (retry_count, request_id)
+            logger.info(query)
+            self.db_connection.execute_param_query(
+                query=query, params=params, commit=True
+            )
+
+        except Exception as e:
+            logger.error(f"Error updating request retry: {e}")
+            raise
 
 
     def update_submitted_timestamp(self, request_id: str):
@@ -144,12 +393,16 @@ class BloombergDatabase:
 
     def update_response_poll(self, request_id: str):
         """Update response poll and timer in database"""
+        if self.status_batch is not None:
+            self.status_batch.add_polls([request_id])
+            return
+
         try:
             query: str = (
                 "UPDATE bloomberg_requests SET response_poll_count = response_poll_count + 1, last_poll_at = GETDATE() WHERE request_id = ?"
             )
             params = request_id
-            logger.info(query + " " + request_id)
+            logger.debug(query + " " + request_id)
             self.db_connection.execute_param_query(
                 query=query, params=params, commit=True
             )
@@ -159,6 +412,31 @@ class BloombergDatabase:
             raise
 
 
+    def update_response_polls(self, request_ids: list[str]):
+        """update_response_poll for a whole poll cycle in 1 statement"""
+        if not request_ids:
+            return
+        if self.status_batch is not None:
+            self.status_batch.add_polls(request_ids)
+            return
+
+        try:
+            for start in range(0, len(request_ids), BloombergDatabase.MAX_SQL_PARAMS):
+                batch = request_ids[start:start + BloombergDatabase.MAX_SQL_PARAMS]
+                query: str = (
+                    "UPDATE bloomberg_requests SET response_poll_count = response_poll_count + 1, last_poll_at = GETDATE() "
+                    "WHERE request_id in (" + ",".join(["?"] * len(batch)) + ")"
+                )
+                logger.debug(query)
+                self.db_connection.execute_param_query(
+                    query=query, params=tuple(batch), commit=True
+                )
+            logger.info(f"Updated response poll for {len(request_ids)} requests")
+
+        except Exception as e:
+            logger.error(f"Error updating response polls: {e}")
+            raise
+
     def set_request_submitted(self, request_id):
         self.update_request_status(request_id, 'submitted', time_update=",submitted_at = GETDATE()")
 
@@ -248,16 +526,22 @@ class BloombergDatabase:
             logger.error(f"Error getting active polling requests: {e}")
             return []
         
-    def get_requests_ready_to_output(self) -> list[dict[str, Any]]:
+    def get_requests_ready_to_output(self, request_id: str = None) -> list[dict[str, Any]]:
         try:
             ## we need a way to only do 1 or 2 not all 3 all the time
             query: str = """
                 SELECT br.request_id, bot.output_type,  br.identifier, br.name
                 FROM bloomberg_requests br, bloomberg_output_types bot, bloomberg_data brd
-                WHERE br.status = 'completed' and br.request_id = brd.request_id and brd.status != 'completed' and
+                WHERE br.status = 'completed' and br.parent_request_id is null
+                and br.request_id = brd.request_id and brd.status != 'completed' and
                 not exists(select 1 from bloomberg_process_status bps where bps.processed_status = 'processed' 
                 and br.request_id = bps.request_id and bot.output_type = bps.process_type )
             """
+            if request_id is not None:
+                query = query + " and br.request_id = ?"
+                logger.info(query)
+                return self.db_connection.fetch(query, "DICT", params=(request_id,))
+
             logger.info(query)
             return self.db_connection.fetch(query, "DICT")
 
@@ -265,17 +549,28 @@ class BloombergDatabase:
             logger.error(f"Error getting active polling requests: {e}")
             return []
 
-    def get_sumbitted_requests(self) -> list[dict[str, Any]]:
+    def get_sumbitted_requests(self, poll_owner: str = None) -> list[dict[str, Any]]:
         """Retrieves all requests from the 'bloomberg_requests' table that have a status of 'submitted'.
+        Args:
+            poll_owner: only the requests this poller holds the lease on, None for all
         Returns:
             list[dict[str, Any]]: A list of dictionaries, each containing the 'request_id' and 'identifier'
             of a submitted request. Returns an empty list if an error occurs during the database query."""
         try:
             query: str = """
-                SELECT request_id, identifier, name as request_name
-                FROM bloomberg_requests 
-                WHERE status = 'submitted'
+                SELECT br.request_id, br.identifier, br.name as request_name, br.parent_request_id,
+                    br.response_poll_count, br.universe_size,
+                    datediff(second, br.submitted_at, GETDATE()) as submitted_sec,
+                    coalesce(d.response_poll_wait_sec, br.response_poll_wait_sec) as response_poll_wait_sec,
+                    coalesce(d.max_response_polls, br.max_response_polls) as max_response_polls
+                FROM bloomberg_requests br
+                LEFT JOIN bloomberg_requests_def d on d.request_name = br.name
+                WHERE br.status = 'submitted'
             """
+            if poll_owner is not None:
+                query += " and br.poll_owner = ?"
+                logger.info(query)
+                return self.db_connection.fetch(query, "DICT", params=(poll_owner,))
             logger.info(query)
             return self.db_connection.fetch(query, "DICT")
 
@@ -283,6 +578,184 @@ class BloombergDatabase:
             logger.error(f"Error getting active polling requests: {e}")
             return []
 
+    def get_seconds_per_security(self, request_name: str, history: int = 20) -> Optional[float]:
+        """Average submit to complete seconds per universe member over the last few runs"""
+        try:
+            query: str = f"""
+                select avg(cast(datediff(second, submitted_at, completed_at) as float) / universe_size) as sec_per_item
+                from (select top {int(history)} submitted_at, completed_at, universe_size
+                      from bloomberg_requests
+                      where name = ? and status = 'completed' and universe_size > 0
+                      and submitted_at is not null and completed_at is not null
+                      order by completed_at desc) r
+            """
+            logger.info(query)
+            rows = self.db_connection.fetch(query, "DICT", params=(request_name,))
+            if rows and rows[0]['sec_per_item'] is not None:
+                return float(rows[0]['sec_per_item'])
+            return None
+        except Exception as e:
+            logger.error(f"Error getting turnaround for {request_name}: {e}")
+            return None
+
+    def get_turnaround_seconds(self, history: int = 20) -> dict[str, float]:
+        """request_name -> average submit to complete seconds over the last few completed runs"""
+        try:
+            query: str = f"""
+                select request_name, avg(turnaround_sec) as turnaround_sec
+                from (select name as request_name,
+                        cast(datediff(second, submitted_at, completed_at) as float) as turnaround_sec,
+                        row_number() over (partition by name order by completed_at desc) as rn
+                      from bloomberg_requests
+                      where status = 'completed' and parent_request_id is null
+                      and submitted_at is not null and completed_at is not null) r
+                where rn <= {int(history)}
+                group by request_name
+            """
+            logger.info(query)
+            rows = self.db_connection.fetch(query, "DICT")
+            return {row['request_name']: float(row['turnaround_sec']) for row in rows if row['turnaround_sec'] is not None}
+        except Exception as e:
+            logger.error(f"Error getting request turnaround: {e}")
+            return {}
+
+    def claim_poll_requests(self, poll_owner: str, lease_sec: int, max_new: int):
+        """
+        Renew this poller's leases then take up to max_new more submitted requests (and chunked
+        parents) that nobody holds or whose holder let the lease run out.  UPDLOCK / READPAST
+        means 2 pollers claiming at once never get the same row.
+        """
+        try:
+            poll_work = "(status = 'submitted' or (status = 'processing' and chunk_count > 0))"
+            renew_query: str = (
+                "UPDATE bloomberg_requests SET poll_lease_until = DATEADD(second, ?, GETDATE()) "
+                f"WHERE poll_owner = ? and {poll_work}"
+            )
+            claim_query: str = (
+                f"UPDATE TOP ({int(max_new)}) bloomberg_requests WITH (UPDLOCK, READPAST, ROWLOCK) "
+                "SET poll_owner = ?, poll_lease_until = DATEADD(second, ?, GETDATE()) "
+                f"WHERE {poll_work} and (poll_owner is null or poll_lease_until < GETDATE())"
+            )
+            logger.debug(renew_query)
+            logger.debug(claim_query)
+            self.db_connection.execute_param_query(
+                query=renew_query, params=(int(lease_sec), poll_owner), commit=True
+            )
+            self.db_connection.execute_param_query(
+                query=claim_query, params=(poll_owner, int(lease_sec)), commit=True
+            )
+
+        except Exception as e:
+            logger.error(f"Error claiming poll requests for {poll_owner}: {e}")
+            raise
+
+    def release_poll_requests(self, poll_owner: str):
+        """Hand back this poller's leases on the way out so the others pick them up straight away"""
+        try:
+            query: str = "UPDATE bloomberg_requests SET poll_owner = null, poll_lease_until = null WHERE poll_owner = ?"
+            logger.info(query + " " + poll_owner)
+            self.db_connection.execute_param_query(
+                query=query, params=(poll_owner,), commit=True
+            )
+
+        except Exception as e:
+            logger.error(f"Error releasing poll requests for {poll_owner}: {e}")
+
+    def set_requests_expired(self, request_ids: list[str]):
+        """Submitted requests that ran out of response polls - errored out in 1 statement"""
+        if not request_ids:
+            return
+
+        try:
+            for start in range(0, len(request_ids), BloombergDatabase.MAX_SQL_PARAMS):
+                batch = request_ids[start:start + BloombergDatabase.MAX_SQL_PARAMS]
+                query: str = (
+                    "UPDATE bloomberg_requests SET status = 'error', request_error = 'max_response_polls reached', "
+                    "updated_at = GETDATE() WHERE status = 'submitted' and request_id in (" + ",".join(["?"] * len(batch)) + ")"
+                )
+                logger.debug(query)
+                self.db_connection.execute_param_query(
+                    query=query, params=tuple(batch), commit=True
+                )
+            logger.warning(f"Expired {len(request_ids)} requests past max_response_polls")
+
+        except Exception as e:
+            logger.error(f"Error expiring requests: {e}")
+            raise
+
+    def get_chunked_parents(self, poll_owner: str = None) -> list[dict[str, Any]]:
+        """
+        Parents still waiting on chunks, with how many chunks are saved / done / dead and how long
+        since the parent was last touched - only poll_owner's if given.  Left join so a parent
+        whose chunks never got saved still shows up and can time out.
+        """
+        try:
+            owner_filter = " and p.poll_owner = ?" if poll_owner is not None else ""
+            query: str = f"""
+                SELECT p.request_id, p.identifier, p.name as request_name, p.chunk_count,
+                    count(c.request_id) as saved_count,
+                    sum(case when c.status = 'completed' then 1 else 0 end) as completed_count,
+                    sum(case when c.status = 'error' then 1 else 0 end) as failed_count,
+                    datediff(second, p.updated_at, GETDATE()) as idle_sec
+                FROM bloomberg_requests p
+                LEFT JOIN bloomberg_requests c on c.parent_request_id = p.request_id
+                WHERE p.status = 'processing' and p.chunk_count > 0{owner_filter}
+                GROUP BY p.request_id, p.identifier, p.name, p.chunk_count, p.updated_at
+            """
+            logger.info(query)
+            if poll_owner is not None:
+                return self.db_connection.fetch(query, "DICT", params=(poll_owner,))
+            return self.db_connection.fetch(query, "DICT")
+
+        except Exception as e:
+            logger.error(f"Error getting chunked parent requests: {e}")
+            return []
+
+    def merge_chunk_data(self, parent_request_id: str, identifier: str, request_name: str, chunk_count: int) -> bool:
+        """
+        Stitch the csv of every chunk into one bloomberg_data row for the parent - header kept
+        from the first chunk only.  The chunk rows are marked completed so the outputter skips them.
+        Returns:
+            False if some chunk has no data
+        """
+        query: str = """
+            SELECT d.data_content, d.content_path
+            FROM bloomberg_data d
+            JOIN bloomberg_requests r on r.request_id = d.request_id
+            WHERE r.parent_request_id = ? and d.data_type = 'csv'
+            ORDER BY r.chunk_index
+        """
+        logger.info(query + " " + parent_request_id)
+        rows = self.db_connection.fetch(query, "DICT", params=(parent_request_id,))
+        if len(rows) < chunk_count:
+            logger.error(f"Only {len(rows)} of {chunk_count} chunks have data for {parent_request_id}")
+            return False
+
+        fd, merged_path = tempfile.mkstemp(suffix=".csv")
+        try:
+            with open(fd, "w", encoding="utf-8", newline="") as merged:
+                for idx, row in enumerate(rows):
+                    with self._open_content(row) as content:
+                        if idx > 0:
+                            content.readline()  # drop the header line on every chunk after the first
+                        last_char = ""
+                        for part in iter(lambda: content.read(BloombergDatabase.STORE_CHUNK_CHARS), ""):
+                            merged.write(part)
+                            last_char = part[-1]
+                        if last_char and last_char != "\n":
+                            merged.write("\n")
+
+            self.store_csv_file(request_id=parent_request_id, identifier=identifier,
+                                request_name=request_name, csv_path=merged_path)
+        finally:
+            os.remove(merged_path)
+
+        update_query: str = """update bloomberg_data set status = 'completed'
+            where request_id in (select request_id from bloomberg_requests where parent_request_id = ?)"""
+        logger.info(update_query + " " + parent_request_id)
+        self.db_connection.execute_param_query(query=update_query, params=(parent_request_id,), commit=True)
+        return True
+
     def store_csv_data(self, request_id: str, identifier: str, request_name:str, csv_data: str):
         """Stores CSV data into the 'bloomberg_data' table in the database.
         Args:
@@ -312,6 +785,83 @@ class BloombergDatabase:
             logger.error(f"Error storing CSV data: {e}")
             raise
 
+    def store_csv_file(self, request_id: str, identifier: str, request_name: str, csv_path: str,
+                       chunk_chars: int = None, content_hash: str = None):
+        """Same as store_csv_data but feeds the file in chunk_chars pieces so the whole file
+        is never in memory.  One commit once the last piece is in.
+        With a response store the file goes there and only the reference is saved."""
+        if self.response_store is not None:
+            stored = self.response_store.put_file(csv_path, content_hash=content_hash)
+            self.store_csv_ref(request_id, identifier, request_name, stored["hash"], stored["size"], stored["path"])
+            return
+
+        chunk_chars = chunk_chars or BloombergDatabase.STORE_CHUNK_CHARS
+        try:
+            insert_query: str = """
+                    INSERT INTO bloomberg_data (request_id, identifier, request_name, data_type, data_content, ts)
+                    VALUES (?, ?, ?, 'csv', '', GETDATE())
+                """
+            append_query: str = """
+                    UPDATE bloomberg_data SET data_content.WRITE(?, NULL, NULL)
+                    WHERE request_id = ? and data_type = 'csv'
+                """
+            logger.info(insert_query + " " + request_id)
+            # a re-poll after a crash before the completed status went in replaces the earlier copy
+            self.db_connection.execute_param_query(
+                query=BloombergDatabase.DELETE_CSV_QUERY, params=(request_id,), commit=False
+            )
+            self.db_connection.execute_param_query(
+                query=insert_query, params=(request_id, identifier, request_name), commit=False
+            )
+
+            with open(csv_path, "r", encoding="utf-8", newline="") as f:
+                while True:
+                    chunk = f.read(chunk_chars)
+                    if not chunk:
+                        break
+                    self.db_connection.execute_param_query(
+                        query=append_query, params=(chunk, request_id), commit=False
+                    )
+
+            self.db_connection.execute_query(query="IF @@TRANCOUNT > 0 COMMIT", commit=True)
+
+        except Exception as e:
+            logger.error(f"Error storing CSV file: {e}")
+            self._rollback()
+            raise
+
+    def store_csv_ref(self, request_id: str, identifier: str, request_name: str,
+                      content_hash: str, content_size: int, content_path: str):
+        """bloomberg_data row pointing at a csv in the response store"""
+        try:
+            query: str = """
+                    INSERT INTO bloomberg_data (request_id, identifier, request_name, data_type,
+                        content_hash, content_size, content_path, ts)
+                    VALUES (?, ?, ?, 'csv', ?, ?, ?, GETDATE())
+                """
+            params: tuple = (request_id, identifier, request_name, content_hash, content_size, content_path)
+            logger.info(query + " " + request_id)
+            self.db_connection.execute_param_query(
+                query=BloombergDatabase.DELETE_CSV_QUERY, params=(request_id,), commit=False
+            )
+            self.db_connection.execute_param_query(
+                query=query, params=params, commit=True
+            )
+
+        except Exception as e:
+            logger.error(f"Error storing CSV reference: {e}")
+            self._rollback()
+            raise
+
+    def _open_content(self, row: dict[str, Any]) -> IO[str]:
+        """Text stream of a bloomberg_data row - streamed from the response store if that is where it went"""
+        if row.get('content_path'):
+            if self.response_store is None:
+                raise ValueError(f"{row['content_path']} is in the response store but BBG_RESPONSE_STORE_DIR is not set")
+            return self.response_store.open_text(row['content_path'])
+        # old rows have it in data_content, already in memory by now
+        return io.StringIO(row['data_content'] or "")
+
     def store_json_data(self, request_id: str, identifier: str, request_name : str, json_data: dict[str, Any]):
         """Store JSON data in database"""
         try:
@@ -359,6 +909,10 @@ class BloombergDatabase:
             raise
 
     def update_data_status(self, request_id, status):
+        if self.status_batch is not None:
+            self.status_batch.add_data_status(request_id, status)
+            return
+
         try:
              # what to do if that row is already there. ???  delete it?  
             query: str = "update bloomberg_data set status = ? where request_id = ?"
@@ -409,6 +963,11 @@ class BloombergDatabase:
             raise
 
     def update_process_status(self, request_id : str, identifier: str, request_name :str, process_type : str, process_status : str ="pending", process_error : str = "") -> None:
+        if self.status_batch is not None:
+            self.status_batch.add_process_status(request_id, identifier, request_name,
+                                                 process_type, process_status, process_error)
+            return
+
         query : str = """if exists(select 1 from bloomberg_process_status where request_id = ? and process_type = ?)
             update bloomberg_process_status set processed_status = ? where request_id = ? and process_type = ?
         else
@@ -418,10 +977,87 @@ class BloombergDatabase:
         params : tuple = (request_id, process_type,
                           process_status, request_id, process_type,
                           request_id, identifier, request_name, process_type, process_status, process_error)
-        logger.info(query)
-        logger.info(params)
+        logger.debug(query)
+        logger.debug(params)
         self.db_connection.execute_param_query(query, params, commit=True)
 
+    def begin_status_batch(self) -> None:
+        """Queue status writes from here on until flush_status_batch"""
+        if self.status_batch is None:
+            self.status_batch = BloombergStatusBatch()
+
+    def _execute_in_lists(self, query_head: str, lead_params: tuple, ids: list[str]) -> int:
+        """query_head + ' in (?, ...)' over ids in MAX_SQL_PARAMS sized pieces, no commit"""
+        statements = 0
+        for start in range(0, len(ids), BloombergDatabase.MAX_SQL_PARAMS):
+            batch = ids[start:start + BloombergDatabase.MAX_SQL_PARAMS]
+            query = query_head + " in (" + ",".join(["?"] * len(batch)) + ")"
+            self.db_connection.execute_param_query(query=query, params=lead_params + tuple(batch), commit=False)
+            statements += 1
+        return statements
+
+    def flush_status_batch(self) -> int:
+        """
+        Write everything queued since begin_status_batch as set based statements in 1 transaction
+        and go back to writing straight through.
+        Returns:
+            number of statements run
+        """
+        batch, self.status_batch = self.status_batch, None
+        if batch is None or batch.is_empty():
+            return 0
+
+        start_time = time.perf_counter()
+        statements = 0
+        try:
+            by_increment: dict[int, list[str]] = {}
+            for request_id, count in batch.poll_counts.items():
+                by_increment.setdefault(count, []).append(request_id)
+            for count, request_ids in by_increment.items():
+                statements += self._execute_in_lists(
+                    "UPDATE bloomberg_requests SET response_poll_count = response_poll_count + ?, "
+                    "last_poll_at = GETDATE() WHERE request_id", (count,), request_ids)
+
+            by_status: dict[tuple[str, str], list[str]] = {}
+            for request_id, (status, time_updates) in batch.request_status.items():
+                by_status.setdefault((status, "".join(sorted(time_updates))), []).append(request_id)
+            for (status, time_update), request_ids in by_status.items():
+                statements += self._execute_in_lists(
+                    f"UPDATE bloomberg_requests SET status = ?, updated_at = GETDATE() {time_update} WHERE request_id",
+                    (status,), request_ids)
+
+            process_rows = list(batch.process_status.values())
+            rows_per_statement = BloombergDatabase.MAX_SQL_PARAMS // 6
+            for start in range(0, len(process_rows), rows_per_statement):
+                rows = process_rows[start:start + rows_per_statement]
+                query = (
+                    "MERGE bloomberg_process_status AS t USING (VALUES " + ",".join(["(?, ?, ?, ?, ?, ?)"] * len(rows)) + ") "
+                    "AS s (request_id, identifier, name, process_type, processed_status, process_error) "
+                    "ON t.request_id = s.request_id and t.process_type = s.process_type "
+                    "WHEN MATCHED THEN UPDATE SET processed_status = s.processed_status "
+                    "WHEN NOT MATCHED THEN INSERT (request_id, identifier, name, process_type, processed_status, process_error) "
+                    "VALUES (s.request_id, s.identifier, s.name, s.process_type, s.processed_status, s.process_error);"
+                )
+                self.db_connection.execute_param_query(query=query, params=tuple(val for row in rows for val in row), commit=False)
+                statements += 1
+
+            by_data_status: dict[str, list[str]] = {}
+            for request_id, status in batch.data_status.items():
+                by_data_status.setdefault(status, []).append(request_id)
+            for status, request_ids in by_data_status.items():
+                statements += self._execute_in_lists(
+                    "update bloomberg_data set status = ? where request_id", (status,), request_ids)
+
+            self.db_connection.execute_query(query="IF @@TRANCOUNT > 0 COMMIT", commit=True)
+        except Exception as e:
+            logger.error(f"Error flushing {batch.write_count} status writes: {e}")
+            self._rollback()
+            raise
+
+        logger.info(f"Flushed {batch.write_count} status writes in {statements} statements "
+                    f"{time.perf_counter() - start_time:.3f}s")
+        return statements
+
 
     def get_request_definitions(self) -> dict[str, dict[str, Any]]:
         try:
@@ -465,15 +1101,19 @@ class BloombergDatabase:
            logger.error(f"Error getting last date for request: {e}")
            raise
     
-    def get_data_content(self, request_id: str) -> Tuple[str, str]:
-        query = f"select data_type, data_content from bloomberg_data where request_id = '{request_id}'"
+    def open_data_content(self, request_id: str) -> Tuple[Optional[str], Optional[IO[str]]]:
+        """
+        Data type and a text stream of the response for request_id, (None, None) if there is none.
+        The caller closes the stream.
+        """
+        query = "select data_type, data_content, content_path from bloomberg_data where request_id = ?"
 
-        logger.info(query)
+        logger.info(f"{query} {request_id}")
         try:
-            rows : list[dict[str, Any]] = self.db_connection.fetch(query=query, out_type='DICT')
+            rows : list[dict[str, Any]] = self.db_connection.fetch(query, "DICT", params=(request_id,))
             if (rows and len(rows) > 0):
                 row = rows[0]
-                return (row['data_type'], row['data_content'])  # this is a whole file might be an issue.
+                return (row['data_type'], self._open_content(row))
             else:
                 return (None, None)
         except Exception as e:
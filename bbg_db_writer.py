@@ -0,0 +1,58 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any
+
+from bbg_database import BloombergDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class BloombergDBWriter:
+    """
+    The db stage of the concurrent poller - one thread with its own connection runs every
+    database call in order.  Download workers use it like a BloombergDatabase, each call is
+    queued to the writer thread and the worker waits on the result.
+    """
+
+    def __init__(self, server: str = None, port: str = None, database: str = None, name: str = "bbg_db_writer"):
+        self.db_connection = BloombergDatabase(server=server, port=port, database=database)
+        self.write_count = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, method_name, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(getattr(self.db_connection, method_name)(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            self.write_count += 1
+
+    def submit(self, method_name: str, *args, **kwargs) -> Future:
+        """Queue BloombergDatabase.method_name(*args, **kwargs) on the writer thread"""
+        future: Future = Future()
+        self._queue.put((future, method_name, args, kwargs))
+        return future
+
+    def __getattr__(self, name: str) -> Any:
+        if not callable(getattr(BloombergDatabase, name, None)):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self.submit(name, *args, **kwargs).result()
+        return call
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self.db_connection.close()
+        logger.info(f"DB writer done after {self.write_count} calls")
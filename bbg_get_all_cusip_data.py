@@ -1,14 +1,15 @@
 
 import logging
 from uuid import UUID
-from typing import Any
+from typing import Any, IO
 import csv
-import io
+import shutil
 from datetime import datetime
 
 from ASL import ASL_Logging
 
 from bbg_redis import BloombergRedis
+from bbg_redis_streams import redis_queue_from_env
 from bbg_database import BloombergDatabase
 from bloomberg_data_def import BloombergDataDef
 
@@ -25,9 +26,8 @@ logger = logging.getLogger(__name__)
 def setup_logging():
     logger = ASL_Logging(log_file="bbg_get_all_cusips", log_path="./output", use_log_header=True, useBusinessDateRollHandler=True)
 
-def _convert_csv_to_dict(in_data_content : str) -> list[dict[str, Any]]:
-    csv_imitation_file = io.StringIO(in_data_content)
-    reader = csv.DictReader(csv_imitation_file)
+def _convert_csv_to_dict(in_data : IO[str]) -> list[dict[str, Any]]:
+    reader = csv.DictReader(in_data)
     return list(reader)
 
 def _get_db_params(row : dict[str, Any], today_str : str, data_type_list : list[dict[str, Any]]) -> tuple[Any]:
@@ -84,8 +84,8 @@ def _get_output_fields(row : dict[str, Any], today_str : str, data_type_list : l
 
 def write_db_table(bbgdb, request_def : dict[str, Any], 
                    bbgDataDef : BloombergDataDef,  # columne
-                   in_data_type, in_data_content) -> None:
-    csv_data = _convert_csv_to_dict(in_data_content)
+                   in_data_type, in_data) -> None:
+    csv_data = _convert_csv_to_dict(in_data)
     table = request_def['save_table']
     insert_str = f"insert into {table} ("
     # these are sorted in the class so they should align.  We can do this in 1 go if too slow - get_data_to_request
@@ -112,8 +112,8 @@ def write_db_table(bbgdb, request_def : dict[str, Any],
 
 def write_csv(request_def : dict[str, Any], 
              bbgDataDef : BloombergDataDef,  # columne
-            in_data_type, in_data_content) -> None:
-    csv_data = _convert_csv_to_dict(in_data_content)
+            in_data_type, in_data) -> None:
+    csv_data = _convert_csv_to_dict(in_data)
     save_file = request_def['save_file']
     # these are sorted in the class so they should align.  We can do this in 1 go if too slow - get_data_to_request
     data_type_list : list[dict[str, Any]] = bbgDataDef.get_data_to_request(request_def['request_name'], incl_static_data=True, include_id=True)
@@ -132,19 +132,21 @@ def write_csv(request_def : dict[str, Any],
        
        # params = tuple(map(lambda key: row.get(key, None), col_name_list))
 def write_raw(request_def : dict[str, Any], 
-             in_data_content) -> None:
+             in_data) -> None:
     raw_file = request_def['raw_file']
     # these are sorted in the class so they should align.  We can do this in 1 go if too slow - get_data_to_request
 
     with open(raw_file, "w") as f:
-        f.write(in_data_content)
+        shutil.copyfileobj(in_data, f)
 
 def write_data(bbgdb : BloombergDatabase, request_def : dict[str, Any], 
                bbgDataDef : BloombergDataDef, request_status : dict[str, Any]) -> None:
-    data_type, data_content  = bbgdb.get_data_content(request_status['request_id'])
-    # write_db_table(bbgdb, request_def, bbgDataDef, data_type, data_content)
-    write_csv(request_def, bbgDataDef, data_type, data_content)
-    write_raw(request_def, data_content)
+    data_type, data_stream = bbgdb.open_data_content(request_status['request_id'])
+    with data_stream:
+        # write_db_table(bbgdb, request_def, bbgDataDef, data_type, data_stream)
+        write_csv(request_def, bbgDataDef, data_type, data_stream)
+        data_stream.seek(0)
+        write_raw(request_def, data_stream)
 
 
 def output_request(bbgdb : BloombergDatabase,
@@ -170,7 +172,7 @@ def process_request_ids(request_ids : list[UUID]):
 
 def main():
     setup_logging()
-    redis_que = BloombergRedis()
+    redis_que = redis_queue_from_env()
     
     logger.info("Bloomberg CMD Sender Starting")
 
@@ -0,0 +1,156 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EndpointStats:
+    calls: int = 0
+    retries: int = 0
+    errors: int = 0
+    total_sec: float = 0.0
+    max_sec: float = 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "errors": self.errors,
+            "avg_sec": round(self.total_sec / self.calls, 4) if self.calls else 0.0,
+            "max_sec": round(self.max_sec, 4),
+        }
+
+
+class BloombergTransport:
+    """
+    Pooled, retrying HTTP calls for the REST connection.  The session keeps its OAuth2 handling,
+    this mounts a sized connection pool on it and wraps each call with timeouts, jittered
+    backoff on 429/502/503 (honoring Retry-After) and per endpoint latency counters.
+    A POST (submit) may already have been processed, so it only retries the statuses that say it was not:
+    429, and 503 with a Retry-After.
+    """
+    RETRY_STATUSES = frozenset({429, 502, 503})
+    IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_CONNECT_TIMEOUT = 10
+    DEFAULT_READ_TIMEOUT = 120
+    DEFAULT_MAX_RETRIES = 4
+    DEFAULT_BACKOFF_SEC = 1.0
+    DEFAULT_MAX_BACKOFF_SEC = 60.0
+
+    def __init__(self):
+        self.pool_size = int(os.environ.get("BBG_HTTP_POOL_SIZE", BloombergTransport.DEFAULT_POOL_SIZE))
+        self.connect_timeout = float(os.environ.get("BBG_HTTP_CONNECT_TIMEOUT", BloombergTransport.DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = float(os.environ.get("BBG_HTTP_READ_TIMEOUT", BloombergTransport.DEFAULT_READ_TIMEOUT))
+        self.max_retries = int(os.environ.get("BBG_HTTP_MAX_RETRIES", BloombergTransport.DEFAULT_MAX_RETRIES))
+        self.backoff_sec = float(os.environ.get("BBG_HTTP_BACKOFF_SEC", BloombergTransport.DEFAULT_BACKOFF_SEC))
+        self.max_backoff_sec = float(os.environ.get("BBG_HTTP_MAX_BACKOFF_SEC", BloombergTransport.DEFAULT_MAX_BACKOFF_SEC))
+        self.stats: dict[str, EndpointStats] = {}
+        self.stats_lock = threading.Lock()
+
+    def mount(self, session: requests.Session) -> None:
+        """Size the keep alive pool so concurrent submits / downloads reuse sockets instead of queuing"""
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                              max_retries=0, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        logger.info(f"HTTP transport pool {self.pool_size} timeouts {self.connect_timeout}/{self.read_timeout}s "
+                    f"retries {self.max_retries}")
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Retry-After if the server sent one, otherwise full jitter exponential backoff"""
+        if response is not None:
+            retry_after = BloombergTransport._parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff_sec)
+        return random.uniform(0, min(self.max_backoff_sec, self.backoff_sec * (2 ** attempt)))
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _is_retry_status(response: requests.Response, idempotent: bool) -> bool:
+        if response.status_code not in BloombergTransport.RETRY_STATUSES:
+            return False
+        if idempotent or response.status_code == 429:
+            return True
+        # a 502 from a POST is returned like a dropped connection is raised - it may have gone through
+        return response.status_code == 503 and bool(response.headers.get("Retry-After"))
+
+    def _record(self, endpoint: str, elapsed: float, retries: int, error: bool) -> None:
+        with self.stats_lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.calls += 1
+            stats.retries += retries
+            stats.errors += int(error)
+            stats.total_sec += elapsed
+            stats.max_sec = max(stats.max_sec, elapsed)
+
+    def request(self, session: requests.Session, method: str, url: str, endpoint: str, **kwargs) -> requests.Response:
+        """
+        Args:
+            session: the OAuth2 session to send on
+            method: GET / POST ...
+            url: full url
+            endpoint: name the latency counters are kept under e.g. submit, poll, download
+            kwargs: passed to session.request - timeout defaults to the configured connect / read timeouts
+        Returns:
+            the last response - a retry status is only returned once the retries are used up
+        """
+        method = method.upper()
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        idempotent = method in BloombergTransport.IDEMPOTENT_METHODS
+        start_time = time.perf_counter()
+        attempt = 0
+
+        while True:
+            response = None
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # a POST may have landed before the connection dropped - only retry it if it never connected
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    self._record(endpoint, time.perf_counter() - start_time, attempt, True)
+                    raise
+                logger.warning(f"{endpoint} {method} {url} failed {e} - retry {attempt + 1}/{self.max_retries}")
+            else:
+                if not BloombergTransport._is_retry_status(response, idempotent) or attempt >= self.max_retries:
+                    self._record(endpoint, time.perf_counter() - start_time, attempt, response.status_code >= 400)
+                    return response
+                logger.warning(f"{endpoint} {method} {url} HTTP {response.status_code} - retry {attempt + 1}/{self.max_retries}")
+
+            wait_sec = self._backoff(attempt, response)
+            if response is not None:
+                response.close()  # give the socket back to the pool
+            time.sleep(wait_sec)
+            attempt += 1
+
+    def get_stats(self) -> dict[str, dict[str, Any]]:
+        with self.stats_lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in self.stats.items()}
+
+    def log_stats(self) -> None:
+        for endpoint, stats in sorted(self.get_stats().items()):
+            logger.info(f"HTTP {endpoint}: {stats}")
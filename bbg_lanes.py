@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class BloombergLaneScheduler:
+    """
+    Picks which request_name lane the next claimed requests come from.
+
+    The best priority at the head of any lane always goes first (commands, then aged or high
+    priority requests).  Lanes whose heads tie on priority share by weight - start time fair
+    queueing, each lane's virtual start moves on 1/weight per request served - so a flood of
+    one request name cannot hold up another at the same priority.  A lane with no free
+    concurrency is skipped rather than claimed and left waiting on a pool thread.
+    """
+    DEFAULT_LANE = "default"  # the queue zset itself - commands and anything without a lane
+
+    def __init__(self, weights: dict[str, float] = None, default_weight: float = 1.0):
+        """
+        Args:
+            weights: request_name -> share weight
+            default_weight: weight of any lane not in weights
+        """
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.virtual_time = 0.0
+        self.lane_finish: dict[str, float] = {}
+        self.served: Counter = Counter()
+        self.wait_total: dict[str, float] = defaultdict(float)
+        self.wait_max: dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def weight(self, lane: str) -> float:
+        return max(0.001, float(self.weights.get(lane, self.default_weight)))
+
+    def plan(self, heads: dict[str, list[float]], free: dict[str, int], max_items: int) -> dict[str, int]:
+        """
+        How many to claim from each lane.
+        Args:
+            heads: lane -> scores of the first requests in it, best first
+            free: lane -> free concurrency, lanes not in it are uncapped
+            max_items: most to claim in total
+        Returns:
+            lane -> count
+        """
+        counts: Counter = Counter()
+        with self._lock:
+            for _ in range(max_items):
+                eligible = [lane for lane, scores in heads.items()
+                            if counts[lane] < len(scores) and counts[lane] < free.get(lane, max_items)]
+                if not eligible:
+                    break
+                best_priority = min(int(heads[lane][counts[lane]]) for lane in eligible)
+                contenders = [lane for lane in eligible if int(heads[lane][counts[lane]]) == best_priority]
+                # earliest virtual start wins, ties to the heavier lane
+                lane = min(contenders, key=lambda name: (max(self.virtual_time, self.lane_finish.get(name, 0.0)),
+                                                         -self.weight(name)))
+                start = max(self.virtual_time, self.lane_finish.get(lane, 0.0))
+                self.lane_finish[lane] = start + 1.0 / self.weight(lane)
+                self.virtual_time = start
+                counts[lane] += 1
+        return dict(counts)
+
+    def record_waits(self, lane: str, wait_secs: list[float]) -> None:
+        """Queue waits of the requests just claimed from lane"""
+        with self._lock:
+            self.served[lane] += len(wait_secs)
+            for wait_sec in wait_secs:
+                self.wait_total[lane] += wait_sec
+                self.wait_max[lane] = max(self.wait_max[lane], wait_sec)
+
+    def stats(self, depths: dict[str, int], head_waits: dict[str, float]) -> dict[str, dict[str, Any]]:
+        """Depth and wait per lane - depths / head_waits from redis, the rest since start up"""
+        with self._lock:
+            lanes = set(depths) | set(self.served)
+            return {lane: {
+                "weight": self.weight(lane),
+                "depth": depths.get(lane, 0),
+                "head_wait_sec": round(head_waits.get(lane, 0.0), 3),
+                "served": self.served[lane],
+                "avg_wait_sec": round(self.wait_total[lane] / self.served[lane], 3) if self.served[lane] else 0.0,
+                "max_wait_sec": round(self.wait_max[lane], 3),
+            } for lane in sorted(lanes)}
+
+
+def lane_scheduler_from_env() -> BloombergLaneScheduler:
+    """BBG_LANE_WEIGHTS='TsyBondInfo=8,MBSBondInfo=4,default=16', BBG_LANE_DEFAULT_WEIGHT for the rest"""
+    weights: dict[str, float] = {}
+    for item in os.environ.get("BBG_LANE_WEIGHTS", "").split(","):
+        if "=" not in item:
+            continue
+        name, weight = item.split("=", 1)
+        try:
+            weights[name.strip()] = float(weight)
+        except ValueError:
+            logger.warning(f"Bad BBG_LANE_WEIGHTS entry {item}")
+    return BloombergLaneScheduler(weights, default_weight=float(os.environ.get("BBG_LANE_DEFAULT_WEIGHT", 1)))
@@ -1,11 +1,19 @@
 import logging
 from uuid import UUID
-from typing import Any
+from typing import Any, IO
 import csv
-import io
+import os
 import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+
 try:
     from ASL.utils.asl_logging import ASL_Logging
 except ImportError:
@@ -36,6 +44,13 @@ class BloombergOutputter:
     DateRegex = re.compile(r'%D%')
     TimeRegex = re.compile(r'%T%')
     FuturesCleaner = re.compile(r' Comdty')
+    # per request name cleaners run over whole columns in columnar mode
+    ColumnCleaners = {'FuturesInfo': FuturesCleaner}
+
+    TRANSFORM_COLUMNAR = "columnar"  # parse the response once into typed columns
+    TRANSFORM_ROW = "row"            # old row by row DictReader path
+    DEFAULT_SWEEP_SEC = 300          # daemon mode full sweep when no completion events come in
+    ERROR_WAIT_SEC = 5               # daemon mode first back off after an error, doubles up to sweep_sec
 
     
     def __init__(
@@ -43,6 +58,15 @@ class BloombergOutputter:
             bbgdb : BloombergDatabase
     ):
         self.bbgdb = bbgdb
+        self.transform_mode = os.environ.get("BBG_TRANSFORM_MODE", BloombergOutputter.TRANSFORM_COLUMNAR).lower()
+
+        # database / csv / raw sinks for a response run side by side, each on its own db connection
+        sink_workers = int(os.environ.get("BBG_OUTPUT_WORKERS", 3))
+        self.sink_pool = ThreadPoolExecutor(max_workers=sink_workers, thread_name_prefix="bbg_sink") \
+            if sink_workers > 1 else None
+        self._thread_local = threading.local()
+        self._sink_db_connections: list[BloombergDatabase] = []
+        self._sink_db_lock = threading.Lock()
        
         self.bbgDataDef = BloombergDataDef(bbgdb)
         self.requestDefinitions: dict[str, dict[str, any]] = self.bbgdb.get_request_definitions()
@@ -60,16 +84,15 @@ class BloombergOutputter:
 
         return returnStr
     
-    def _convert_csv_to_dict(self, in_data_content: str) -> list[dict[str, Any]]:
-        csv_imitation_file = io.StringIO(in_data_content)
-        reader = csv.DictReader(csv_imitation_file)
+    def _convert_csv_to_dict(self, in_data: IO[str]) -> list[dict[str, Any]]:
+        reader = csv.DictReader(in_data)
         return list(reader)
 
     def _futures_cleaner(self, val : str) -> str:
         return re.sub(BloombergOutputter.FuturesCleaner, '', val)
 
     def _clean(self, request_name : str, val : str):
-        if (request_name == 'FuturesInfo'):
+        if (request_name == 'FuturesInfo') and isinstance(val, str):
           return(self._futures_cleaner(val))
         else:
          return(val)
@@ -152,19 +175,129 @@ class BloombergOutputter:
         return returnList
 
 
+    def _convert_csv_to_frame(self, in_data: IO[str]) -> pd.DataFrame:
+        # all text - one frame feeds the csv and database sinks, typing is done per column from the data defs
+        return pd.read_csv(in_data, dtype=str, keep_default_na=False, na_filter=False)
+
+    def _clean_column(self, request_name: str, col: pd.Series) -> pd.Series:
+        cleaner = BloombergOutputter.ColumnCleaners.get(request_name)
+        if cleaner is None or not pd.api.types.is_string_dtype(col):
+            return col
+        return col.str.replace(cleaner, '', regex=True)
+
+    def _clean_values(self, request_name: str, values: np.ndarray) -> np.ndarray:
+        """_clean over a typed db column - only the values left as text, like the row path"""
+        cleaner = BloombergOutputter.ColumnCleaners.get(request_name)
+        if cleaner is None:
+            return values
+        is_str = np.fromiter((isinstance(val, str) for val in values), dtype=bool, count=len(values))
+        if is_str.any():
+            values = values.copy()
+            values[is_str] = pd.Series(values[is_str], dtype=object).str.replace(cleaner, '', regex=True).to_numpy(dtype=object)
+        return values
+
+    def _expand_column(self, colName, frame: pd.DataFrame) -> pd.Series:
+        if isinstance(colName, dict):
+            # the | split merge is per cell anyway so do it row wise on just these columns
+            merge_cols = [frame[key + "." + col] for key in colName for col in colName[key]]
+            merged = [
+                "".join(['"(', ",".join(f"[{x},{y}]" for x, y in zip(a.split('|'), b.split('|'))), ')"'])
+                for a, b in zip(merge_cols[0], merge_cols[1])
+            ]
+            return pd.Series(merged, index=frame.index, dtype=object)
+        else:
+            return frame[colName]
+
+    def _type_column(self, col: pd.Series, data_type: str) -> np.ndarray:
+        """Same rules as _get_db_params but for a whole column.  Values that will not convert
+        are left as the text like the row path does, DATE stays text as it does there."""
+        raw = col.to_numpy(dtype=object)
+        values = raw
+
+        if data_type == "FLOAT":
+            numbers = pd.to_numeric(col.mask(col == "", "0"), errors="coerce").to_numpy(dtype=float)
+            good = ~np.isnan(numbers)
+            values = np.where(good, numbers.astype(object), raw)
+        elif data_type == "BOOLEAN":
+            values = np.where(raw == "false", 0, 1).astype(object)
+
+        # true / false wins whatever the type
+        is_bool = (raw == "true") | (raw == "false")
+        if is_bool.any():
+            values = np.where(is_bool, np.where(raw == "true", 1, 0).astype(object), values)
+        return values
+
+    def _get_db_columns(self, request_name: str, frame: pd.DataFrame, data_type_list: list[dict[str, Any]]) -> list[np.ndarray]:
+        columns = []
+        for data_type_item in data_type_list:
+            if data_type_item[BloombergDataDef.DATABASE_COL_NAME] == "":
+                continue
+
+            colName = data_type_item[BloombergDataDef.REPLY_COL_NAME]
+            try:
+                # typed before cleaning, same order as _get_db_params
+                values = self._type_column(self._expand_column(colName, frame), data_type_item[BloombergDataDef.DATA_TYPE_COL])
+                columns.append(self._clean_values(request_name, values))
+            except Exception as e:
+                # a missing / bad column fails the load rather than writing blanks over good data
+                logger.error(f"db col error {colName} {e}")
+                raise
+        return columns
+
+    def _get_output_columns(self, request_name: str, frame: pd.DataFrame, data_type_list: list[dict[str, Any]]) -> list[list[str]]:
+        columns = []
+        for data_type_item in data_type_list:
+            if data_type_item[BloombergDataDef.OUTPUT_COL_NAME] == "":
+                continue
+
+            colName = data_type_item[BloombergDataDef.REPLY_COL_NAME]
+            try:
+                columns.append(self._clean_column(request_name, self._expand_column(colName, frame)).tolist())
+            except Exception as e:
+                logger.error(f"Error getting {colName} does it exist?")
+        return columns
+
+    def _build_db_rows(self, request_name: str, in_data: IO[str], today_str: str,
+                       data_type_list: list[dict[str, Any]], frame: pd.DataFrame = None) -> list[tuple]:
+        """Response text stream (or an already parsed text frame) to bulk insert ready row tuples"""
+        if self.transform_mode == BloombergOutputter.TRANSFORM_ROW:
+            csv_data = self._convert_csv_to_dict(in_data)
+            return [self._get_db_params(request_name, row, today_str, data_type_list) for row in csv_data]
+
+        if frame is None:
+            frame = self._convert_csv_to_frame(in_data)
+        columns = [np.full(len(frame), today_str, dtype=object)]
+        columns.extend(self._get_db_columns(request_name, frame, data_type_list))
+        return list(zip(*[col.tolist() for col in columns]))
+
+    def _build_output_rows(self, request_name: str, in_data: IO[str], today_str: str,
+                           data_type_list: list[dict[str, Any]], frame: pd.DataFrame = None) -> list[list[str]]:
+        """Response text stream (or an already parsed text frame) to csv output rows"""
+        if self.transform_mode == BloombergOutputter.TRANSFORM_ROW:
+            csv_data = self._convert_csv_to_dict(in_data)
+            return [self._get_output_fields(request_name, row, today_str, data_type_list) for row in csv_data]
+
+        if frame is None:
+            frame = self._convert_csv_to_frame(in_data)
+        columns = self._get_output_columns(request_name, frame, data_type_list)
+        if today_str is not None:
+            columns.insert(0, [today_str] * len(frame))
+        return [list(row) for row in zip(*columns)]
+
     def write_db_table(
         self,
         request_status : dict[str, Any],
         request_def: dict[str, Any],
         in_data_type : str,
-        in_data_content,
-        delete_today : bool = True
+        in_data : IO[str],
+        delete_today : bool = True,
+        frame : pd.DataFrame = None,
+        bbgdb : BloombergDatabase = None
     ) -> None:
+        bbgdb = bbgdb or self.bbgdb
         today = datetime.now()
         todayStr = today.strftime(BloombergOutputter.DateFmt)
-        csv_data = self._convert_csv_to_dict(in_data_content)
         table = request_def["save_table"]
-        insert_str = f"insert into {table} ("
         delete_str = f"delete from {table} where business_date >= '{todayStr}'"
 
         # these are sorted in the class so they should align.  We can do this in 1 go if too slow - get_data_to_request
@@ -186,30 +319,14 @@ class BloombergOutputter:
                 )
             )
         )
-        question_list = ["?"] * len(db_col_name_list)
-
-        col_names = ",".join(db_col_name_list)
-        questions = ",".join(question_list)
-
-        if (delete_today):
-             logger.info(delete_str)
-             self.bbgdb.db_connection.execute_query(
-                    query=delete_str, commit=True
-                )
-             
-        insert_str = insert_str + col_names + ") VALUES (" + questions + ")"
-        logger.info(insert_str)  # debug???
-
         try:
-            for row in csv_data:
-                params = self._get_db_params(request_status['name'], row, todayStr, data_type_list)
-                logger.info(params)
-                self.bbgdb.db_connection.execute_param_query(
-                    query=insert_str, params=params, commit=True
-                )
+            db_rows = self._build_db_rows(request_status['name'], in_data, todayStr, data_type_list, frame)
+            # delete and insert go in together so we get 1 commit per response
+            bbgdb.bulk_insert(table, db_col_name_list, db_rows,
+                                   pre_query=delete_str if delete_today else None)
         
             try:
-                self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+                bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                                  request_status['name'], 'database', 'processed')
             except Exception as save_e:
                 logger.error(f"Error updating process status DB {save_e}")
@@ -217,12 +334,12 @@ class BloombergOutputter:
 
         except OSError as oserror:
             logger.error(f"Error saving data to DB.. {oserror}") # what if these fail hmmm
-            self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+            bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                          request_status['name'], 'database', 'error', f'{oserror}')
             raise
         except Exception as e:
             logger.error(f"Error saving data to DB.. {e}")
-            self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+            bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                          request_status['name'], 'database', 'error', f'{e}')
             raise
             
@@ -232,10 +349,12 @@ class BloombergOutputter:
             request_status,
         request_def: dict[str, Any],
         in_data_type,
-        in_data_content,
-        include_busday : bool = False
+        in_data : IO[str],
+        include_busday : bool = False,
+        frame : pd.DataFrame = None,
+        bbgdb : BloombergDatabase = None
     ) -> None:
-        csv_data = self._convert_csv_to_dict(in_data_content)
+        bbgdb = bbgdb or self.bbgdb
         save_file = BloombergOutputter.expand_file_name(request_def["save_file"])
 
         # these are sorted in the class so they should align.  We can do this in 1 go if too slow - get_data_to_request
@@ -267,13 +386,11 @@ class BloombergOutputter:
         try:
             with open(save_file, "w+") as f:
                 f.write(",".join(file_col_name_list) + "\n")
-                for row in csv_data:
-                    out_cols = self._get_output_fields(request_status['name'], row, today_str, data_type_list)
-                    #for col in out_cols:
+                for out_cols in self._build_output_rows(request_status['name'], in_data, today_str, data_type_list, frame):
                     f.write(",".join(out_cols) + "\n")
         
             try:
-                self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+                bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                                  request_status['name'], 'csv', 'processed')
             except Exception as save_e:
                 logger.error(f"Error updating process status CSV {save_e}")
@@ -281,27 +398,29 @@ class BloombergOutputter:
 
         except OSError as oserror:
             logger.error(f"Error saving data to CSV.. {oserror}") # what if these fail hmmm
-            self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+            bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                          request_status['name'], 'csv', 'error', f'{oserror}')
             raise
         except Exception as e:
             logger.error(f"Error saving data to CSV.. {e}") # what if these fail hmmm
-            self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+            bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                          request_status['name'], 'csv', 'error', f'{e}')
             raise
         
 
 
-    def write_raw(self, request_status : dict[str, Any], request_def: dict[str, Any], in_data_content) -> None:
+    def write_raw(self, request_status : dict[str, Any], request_def: dict[str, Any], in_data : IO[str],
+                  bbgdb : BloombergDatabase = None) -> None:
+        bbgdb = bbgdb or self.bbgdb
         raw_file = BloombergOutputter.expand_file_name(request_def["raw_file"])
         # these are sorted in the class so they should align.  We can do this in 1 go if too slow - get_data_to_request
         logger.info(f"RAW MODE - writing to {raw_file}")
         try:
             with open(raw_file, "w+") as f:
-                f.write(in_data_content)
+                shutil.copyfileobj(in_data, f)
 
             try:
-               self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+               bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                                 request_status['name'], 'raw', 'processed')
             except Exception as save_e:
                 logger.error(f"Error updating process status raw {save_e}")
@@ -309,12 +428,12 @@ class BloombergOutputter:
             
         except OSError as oserror:
             logger.error(f"Error saving data to RAW.. {oserror}") # what if these fail hmmm
-            self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+            bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                          request_status['name'], 'raw', 'error', f'{oserror}')
             raise
         except Exception as e:
             logger.error(f"Error saving data to RAW.. {oserror}") # what if these fail hmmm
-            self.bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
+            bbgdb.update_process_status(request_status['request_id'], request_status['identifier'],
                                          request_status['name'], 'raw', 'error', f'{e}')
             raise
         #
@@ -323,48 +442,156 @@ class BloombergOutputter:
             self,
             request_status: dict[str, Any],
             request_def: dict[str, Any],
-            output_type : SyntaxWarning
+            output_type : SyntaxWarning,
+            data_type : str = None,
+            data_stream : IO[str] = None,
+            frame : pd.DataFrame = None,
+            bbgdb : BloombergDatabase = None
     ) -> None:
         
-        data_type, data_content = self.bbgdb.get_data_content(request_status['request_id'])
+        opened = None
+        if data_stream is None and (frame is None or output_type == 'raw'):
+            # each sink reads its own stream, nothing holds the whole response
+            data_type, opened = (bbgdb or self.bbgdb).open_data_content(request_status['request_id'])
+            if opened is None:
+                raise ValueError(f"No data for {request_status['request_id']}")
+            data_stream = opened
         try:
             if (output_type == 'database'):
-                self.write_db_table(request_status, request_def, data_type, data_content)
+                self.write_db_table(request_status, request_def, data_type, data_stream, frame=frame, bbgdb=bbgdb)
             elif (output_type == 'csv'):
-                self.write_csv(request_status, request_def, data_type, data_content)
+                self.write_csv(request_status, request_def, data_type, data_stream, frame=frame, bbgdb=bbgdb)
             elif (output_type == 'raw'):
-                self.write_raw(request_status, request_def, data_content)
+                self.write_raw(request_status, request_def, data_stream, bbgdb=bbgdb)
             else:
                 logger.error(f"What output type {output_type}")
 
         except Exception as e:
             logging.error(f"Unable to process data {e}")
             raise
+        finally:
+            if opened is not None:
+                opened.close()
+
+    def _get_sink_db(self) -> BloombergDatabase:
+        """Db connection for the calling sink thread - pyodbc connections are not shared"""
+        db = getattr(self._thread_local, "bbgdb", None)
+        if db is None:
+            db = BloombergDatabase(server=self.bbgdb.server, port=self.bbgdb.port,
+                                   database=self.bbgdb.database, username=self.bbgdb.username)
+            self._thread_local.bbgdb = db
+            with self._sink_db_lock:
+                self._sink_db_connections.append(db)
+        return db
+
+    def _write_sink(self, request_status, request_def, output_type, data_type, frame) -> None:
+        sink_db = self._get_sink_db()
+        sink_db.status_batch = self.bbgdb.status_batch  # statuses join the request's batch
+        try:
+            self.write_data(request_status, request_def, output_type, data_type, None, frame, sink_db)
+        finally:
+            sink_db.status_batch = None
 
-    def output_request(
+    def output_request_types(
             self,
             request_id : str,
-            output_type : str
+            output_types : list[str]
     ):
+        """Parse the response once then write every output type off it, in parallel - raw output streams its own copy"""
         is_ready, request_status = self.bbgdb.is_request_ready(request_id)
 
         if is_ready:
             request_def: dict[str, Any] = self.requestDefinitions[request_status["name"]]
+            # every status write for the request goes in together once the sinks are done
+            self.bbgdb.begin_status_batch()
             try:
-                self.write_data(request_status, request_def, output_type)
+                data_type = None
+                frame = None
+                if (self.transform_mode == BloombergOutputter.TRANSFORM_COLUMNAR and
+                        ('database' in output_types or 'csv' in output_types)):
+                    data_type, data_stream = self.bbgdb.open_data_content(request_id)
+                    if data_stream is None:
+                        raise ValueError(f"No data for {request_id}")
+                    with data_stream:
+                        frame = self._convert_csv_to_frame(data_stream)
+
+                if self.sink_pool is None or len(output_types) == 1:
+                    for output_type in output_types:
+                        self.write_data(request_status, request_def, output_type, data_type, None, frame)
+                else:
+                    futures = [self.sink_pool.submit(self._write_sink, request_status, request_def, output_type,
+                                                     data_type, frame)
+                               for output_type in output_types]
+                    errors = [f.exception() for f in futures if f.exception() is not None]
+                    if errors:
+                        raise errors[0]
+
                 self.bbgdb.complete_data_process(request_id)
-                logger.info(f"its ready {request_id} for {output_type}")
+                logger.info(f"its ready {request_id} for {output_types}")
             except Exception as e:
                 self.bbgdb.error_data_process(request_id)
                 raise  # is this needed what so we do with it
-           
+            finally:
+                self.bbgdb.flush_status_batch()
 
+    def output_request(
+            self,
+            request_id : str,
+            output_type : str
+    ):
+        self.output_request_types(request_id, [output_type])
 
-    def output_ready_requests(self):
-        data_rows = self.bbgdb.get_requests_ready_to_output()
+    def output_ready_requests(self, request_id : str = None):
+        data_rows = self.bbgdb.get_requests_ready_to_output(request_id)
 
+        # 1 row per (request, output type) - group them so each response is loaded once
+        output_types_by_request: dict[str, list[str]] = {}
         for data_row in data_rows:
-            self.output_request(data_row['request_id'], data_row['output_type'])
+            output_types_by_request.setdefault(data_row['request_id'], []).append(data_row['output_type'])
+
+        for request_id, output_types in output_types_by_request.items():
+            try:
+                self.output_request_types(request_id, output_types)
+            except Exception as e:
+                logger.error(f"Unable to output {request_id} {e}")
+
+    def run_daemon(self, redis_connection : BloombergRedis, sweep_sec : int = DEFAULT_SWEEP_SEC):
+        """
+        Stay up and output each request as soon as the poller says it is completed.
+        Every sweep_sec with nothing heard we sweep for anything missed.
+        An EXIT pushed on the completion queue stops it.
+        """
+        logger.info(f"Outputter daemon starting sweep every {sweep_sec}s")
+        caught_up = False
+        error_wait_sec = BloombergOutputter.ERROR_WAIT_SEC
+
+        while True:
+            try:
+                if not caught_up:
+                    self.output_ready_requests()  # catch up on anything done while we were down
+                    caught_up = True
+                request_id = redis_connection.wait_for_completion(sweep_sec)
+                if request_id is None:
+                    self.output_ready_requests()
+                elif request_id.upper() == EXIT_CMD:
+                    logger.info("Outputter daemon got EXIT")
+                    break
+                else:
+                    logger.info(f"Completion event for {request_id}")
+                    self.output_ready_requests(request_id)
+                error_wait_sec = BloombergOutputter.ERROR_WAIT_SEC
+            except Exception as e:
+                logger.error(f"Error in outputter daemon, retrying in {error_wait_sec}s: {e}")
+                # an event may have been lost with the error - sweep again once we are back
+                caught_up = False
+                time.sleep(error_wait_sec)
+                error_wait_sec = min(error_wait_sec * 2, sweep_sec)
+
+    def close(self):
+        if self.sink_pool is not None:
+            self.sink_pool.shutdown(wait=True)
+        for sink_db in self._sink_db_connections:
+            sink_db.close()
 
 
 
@@ -386,9 +613,21 @@ def main():
     bbgOutputter = BloombergOutputter(
         bbgdb=bbgdb
     )
+    run_daemon = "daemon" in sys.argv[1:]
 
     logger.info("Bloomberg Outputter startimg")
-    bbgOutputter.output_ready_requests()
+    try:
+        if run_daemon:
+            redis_connection = BloombergRedis(redis_host=os.environ.get("REDIS_HOST", ""))
+            sweep_sec = int(os.environ.get("BBG_OUTPUT_SWEEP_SEC", BloombergOutputter.DEFAULT_SWEEP_SEC))
+            try:
+                bbgOutputter.run_daemon(redis_connection, sweep_sec)
+            finally:
+                redis_connection.close()
+        else:
+            bbgOutputter.output_ready_requests()
+    finally:
+        bbgOutputter.close()
 
 
 
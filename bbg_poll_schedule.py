@@ -0,0 +1,110 @@
+import heapq
+import logging
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BloombergPollSchedule:
+    """
+    Next poll time per submitted request, kept in a heap so each cycle only polls what is due.
+
+    The first poll waits for the usual turnaround of the request name (from past submitted_at /
+    completed_at) or response_poll_wait_sec if there is no history.  After that polls back off
+    from response_poll_wait_sec by backoff_factor up to max_interval_sec, and a request that runs
+    past max_response_polls is expired.
+    """
+    DEFAULT_POLL_WAIT_SEC = 30
+    DEFAULT_MAX_POLLS = 120
+    FIRST_POLL_FRACTION = 0.8  # look a little before the usual turnaround
+
+    def __init__(self, backoff_factor: float = 1.5, max_interval_sec: float = 300):
+        self.backoff_factor = backoff_factor
+        self.max_interval_sec = max_interval_sec
+        self.turnaround_sec: dict[str, float] = {}
+        self.requests: dict[str, dict[str, Any]] = {}
+        self.next_poll: dict[str, float] = {}
+        self.late_polls: dict[str, int] = {}
+        self._heap: list[tuple[float, str]] = []
+
+    def set_turnaround(self, turnaround_sec: dict[str, float]) -> None:
+        """request_name -> average submit to complete seconds"""
+        self.turnaround_sec = turnaround_sec
+
+    @staticmethod
+    def _poll_wait_sec(request: dict[str, Any]) -> float:
+        return float(request.get("response_poll_wait_sec") or BloombergPollSchedule.DEFAULT_POLL_WAIT_SEC)
+
+    def _push(self, request_id: str, poll_at: float) -> None:
+        self.next_poll[request_id] = poll_at
+        heapq.heappush(self._heap, (poll_at, request_id))
+
+    def _first_poll_at(self, request: dict[str, Any], now: float) -> float:
+        wait_sec = BloombergPollSchedule._poll_wait_sec(request)
+        expected_sec = self.turnaround_sec.get(request.get("request_name"))
+        if expected_sec is not None:
+            wait_sec = max(wait_sec, expected_sec * BloombergPollSchedule.FIRST_POLL_FRACTION)
+        # picks up where it left off after a restart
+        submitted_sec = float(request.get("submitted_sec") or 0)
+        return now + max(0.0, wait_sec - submitted_sec)
+
+    def sync(self, active_requests: list[dict[str, Any]], now: Optional[float] = None) -> None:
+        """Add newly submitted requests and forget the ones that are no longer submitted"""
+        now = now or time.time()
+        active_ids = set()
+        for request in active_requests:
+            request_id = request["request_id"]
+            active_ids.add(request_id)
+            if request_id not in self.requests:
+                self._push(request_id, self._first_poll_at(request, now))
+                self.late_polls[request_id] = 0
+            self.requests[request_id] = request
+
+        for request_id in list(self.requests):
+            if request_id not in active_ids:
+                self.forget(request_id)
+
+    def forget(self, request_id: str) -> None:
+        self.requests.pop(request_id, None)
+        self.next_poll.pop(request_id, None)
+        self.late_polls.pop(request_id, None)
+
+    def due(self, now: Optional[float] = None) -> list[dict[str, Any]]:
+        """Requests whose poll time has come, in the order they came due"""
+        now = now or time.time()
+        due_requests = []
+        while self._heap and self._heap[0][0] <= now:
+            poll_at, request_id = heapq.heappop(self._heap)
+            if self.next_poll.get(request_id) != poll_at:
+                continue  # stale entry, rescheduled or forgotten
+            del self.next_poll[request_id]
+            due_requests.append(self.requests[request_id])
+        return due_requests
+
+    def expired(self) -> list[dict[str, Any]]:
+        """Requests that have used up max_response_polls"""
+        return [request for request in self.requests.values()
+                if int(request.get("response_poll_count") or 0) >= int(request.get("max_response_polls") or BloombergPollSchedule.DEFAULT_MAX_POLLS)]
+
+    def polled(self, request: dict[str, Any], now: Optional[float] = None) -> None:
+        """Still not done - back off before the next look"""
+        now = now or time.time()
+        request_id = request["request_id"]
+        if request_id not in self.requests:
+            return
+        request["response_poll_count"] = int(request.get("response_poll_count") or 0) + 1
+        late_polls = self.late_polls.get(request_id, 0)
+        interval = min(self.max_interval_sec,
+                       BloombergPollSchedule._poll_wait_sec(request) * (self.backoff_factor ** late_polls))
+        self.late_polls[request_id] = late_polls + 1
+        self._push(request_id, now + interval)
+
+    def next_due_in(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next poll is due, None with nothing scheduled"""
+        now = now or time.time()
+        while self._heap and self.next_poll.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - now)
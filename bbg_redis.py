@@ -1,10 +1,16 @@
 from datetime import datetime
 import orjson
 import logging
+import os
+import time
 import uuid
-from typing import Optional
+import zlib
+from itertools import islice
+from typing import Any, Iterable, Optional
 from ASL.utils.asl_redis import ASLRedis
 from bbg_request import BloombergRequest, HIGH_CMD_PRIORITY, LAST_CMD_PRIORITY, DEFAULT_CMD_PRIORITY, REQUEST_TYPE_CMD
+from bbg_request import HIGH_REQUEST_PRIORITY
+from bbg_lanes import BloombergLaneScheduler, lane_scheduler_from_env
 
 logger = logging.getLogger(__name__)
 ## may need to rename this.
@@ -17,20 +23,152 @@ class BloombergRedis:
     POLLING_QUEUE = "BBG_API:poll_q"
     PROCESSED_RESPONSES = "BBG_API:processed_responses"
     ERROR_QUEUE = "BBG_API:err_q"
+    COMPLETED_QUEUE = "BBG_API:completed_q"  # request ids ready for the outputter
+    DEFAULT_LEASE_SEC = 300
+    DEFAULT_MAX_RECLAIMS = 3  # leases a request may run out before it is dead lettered
+    MAX_SIGNALS = 1000  # cap on pending wake ups nobody has picked up
+    DEFAULT_ENQUEUE_BATCH = 500  # requests per pipeline round trip in queue_requests
+    ENTRY_MODE_REF = "ref"  # zset member is the request id, the json is in its own key
+    ENTRY_MODE_INLINE = "inline"  # zset member is the whole request json (old format)
+    DEFAULT_PAYLOAD_TTL_SEC = 7 * 24 * 3600
+    DEFAULT_PAYLOAD_COMPRESS_BYTES = 4096
+    COMPRESSED_PREFIX = b"z:"
+    DEFAULT_LANE_AGING_SEC = 300  # a queued request moves up 1 priority for every this many seconds waiting
+    AGE_WINDOW = 100  # oldest members per priority level of a lane looked at on each aging pass
+
+    # NOTE the scripts below need a single redis (or sentinel), not redis cluster - RECLAIM and PROMOTE
+    # ZADD to lane keys read out of the lane_of hash at run time, and AGE / CLAIM touch the lane and
+    # the shared hashes in one call, none of which are hash tagged into one slot.
+
+    # pop the lowest scores off the queue and park them in the processing zset
+    # scored by lease expiry - original score kept in a hash so we can put it back
+    CLAIM_SCRIPT = """
+        local items = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+        for i = 1, #items, 2 do
+            redis.call('ZADD', KEYS[2], ARGV[2], items[i])
+            redis.call('HSET', KEYS[3], items[i], items[i + 1])
+        end
+        return items
+    """
+
+    # any lease that ran out goes back on its lane (or the queue) with its original score - one that
+    # has run out more than ARGV[2] times (kills whoever claims it) is parked on the dead zset instead.
+    # returns {reclaimed count, dead members...}
+    RECLAIM_SCRIPT = """
+        local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+        local result = {0}
+        for _, item in ipairs(expired) do
+            local score = redis.call('HGET', KEYS[3], item)
+            if score then
+                if redis.call('HINCRBY', KEYS[5], item, 1) > tonumber(ARGV[2]) then
+                    redis.call('ZADD', KEYS[6], ARGV[1], item)
+                    redis.call('HDEL', KEYS[5], item)
+                    table.insert(result, item)
+                else
+                    redis.call('ZADD', redis.call('HGET', KEYS[4], item) or KEYS[1], score, item)
+                    result[1] = result[1] + 1
+                end
+            end
+            redis.call('ZREM', KEYS[2], item)
+            redis.call('HDEL', KEYS[3], item)
+        end
+        return result
+    """
+
+    # due retries go back on the queue with the priority score they were given
+    PROMOTE_SCRIPT = """
+        local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+        for _, item in ipairs(due) do
+            local score = redis.call('HGET', KEYS[3], item)
+            redis.call('ZADD', redis.call('HGET', KEYS[5], item) or KEYS[1], score or 0, item)
+            redis.call('ZREM', KEYS[2], item)
+            redis.call('HDEL', KEYS[3], item)
+            redis.call('LPUSH', KEYS[4], 'retry')
+        end
+        redis.call('LTRIM', KEYS[4], 0, ARGV[2])
+        return #due
+    """
+
+    # done with a request - the payload and lane info go too unless it was just parked for a retry
+    REMOVE_SCRIPT = """
+        redis.call('ZREM', KEYS[1], ARGV[1])
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        redis.call('HDEL', KEYS[3], ARGV[1])
+        redis.call('HDEL', KEYS[8], ARGV[1])
+        if not redis.call('ZSCORE', KEYS[4], ARGV[1]) then
+            redis.call('HDEL', KEYS[6], ARGV[1])
+            redis.call('HDEL', KEYS[7], ARGV[1])
+            if ARGV[2] == '1' then
+                redis.call('DEL', KEYS[5])
+            end
+        end
+        return 1
+    """
+
+    # priority aging - lane members move up a priority for every ARGV[2] seconds since they were
+    # queued (times hash holds "queued_at:score"), never past ARGV[3].  Only the first ARGV[4] of
+    # each priority level are looked at - the fraction orders a level by queue time so those are
+    # the oldest, and whatever is behind them has waited less
+    AGE_SCRIPT = """
+        local floor = tonumber(ARGV[3])
+        local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+        if #last == 0 then
+            return 0
+        end
+        local aged = 0
+        for level = floor + 1, math.floor(tonumber(last[2])) do
+            local items = redis.call('ZRANGEBYSCORE', KEYS[1], level, '(' .. (level + 1), 'WITHSCORES', 'LIMIT', 0, ARGV[4])
+            for i = 1, #items, 2 do
+                local meta = redis.call('HGET', KEYS[2], items[i])
+                if meta then
+                    local sep = string.find(meta, ':', 1, true)
+                    local queued_at = tonumber(string.sub(meta, 1, sep - 1))
+                    local base = tonumber(string.sub(meta, sep + 1))
+                    local levels = math.floor((tonumber(ARGV[1]) - queued_at) / tonumber(ARGV[2]))
+                    local target = math.max(floor, math.floor(base) - levels) + (base - math.floor(base))
+                    if target < tonumber(items[i + 1]) then
+                        redis.call('ZADD', KEYS[1], target, items[i])
+                        aged = aged + 1
+                    end
+                end
+            end
+        end
+        return aged
+    """
 
     def __init__(
         self,
         redis_host : str ="cacheuat",
         use_async : bool = False,
         user : str  = "readonly",
-        queue : str = REQUEST_QUEUE
+        queue : str = REQUEST_QUEUE,
+        lease_sec : int = DEFAULT_LEASE_SEC
     ):
         """
-        
+        Args:
+            redis_host: redis server
+            use_async: use the async client
+            user: redis user
+            queue: sorted set used as the priority queue
+            lease_sec: how long a claimed request is held before another worker can reclaim it
         """
         self.enqueue_counter = 0
         self.sod_date_time = datetime.now().replace(hour=0, second=0, microsecond=0)
         self.queue = queue
+        self.lease_sec = lease_sec
+        self.max_reclaims = int(os.environ.get("BBG_QUEUE_MAX_RECLAIMS", BloombergRedis.DEFAULT_MAX_RECLAIMS))
+        self.dead_letters: list[str] = []
+        self.enqueue_batch = int(os.environ.get("BBG_ENQUEUE_BATCH", BloombergRedis.DEFAULT_ENQUEUE_BATCH))
+        self.entry_mode = os.environ.get("BBG_QUEUE_ENTRY_MODE", BloombergRedis.ENTRY_MODE_REF).lower()
+        self.payload_ttl_sec = int(os.environ.get("BBG_QUEUE_PAYLOAD_TTL_SEC", BloombergRedis.DEFAULT_PAYLOAD_TTL_SEC))
+        # 0 = never compress
+        self.payload_compress_bytes = int(os.environ.get("BBG_QUEUE_PAYLOAD_COMPRESS_BYTES",
+                                                         BloombergRedis.DEFAULT_PAYLOAD_COMPRESS_BYTES))
+        # per request_name lanes scheduled weighted fair, commands stay on the queue zset itself
+        self.lanes_enabled = os.environ.get("BBG_QUEUE_LANES", "true").lower() == "true"
+        self.lane_aging_sec = float(os.environ.get("BBG_LANE_AGING_SEC", BloombergRedis.DEFAULT_LANE_AGING_SEC))
+        self.lane_scheduler: BloombergLaneScheduler = lane_scheduler_from_env()
+        self.lanes_aged_at = 0.0
     
         self.redis_client = ASLRedis(
             host=redis_host,
@@ -45,8 +183,35 @@ class BloombergRedis:
     def close(self):
         self.redis_client.close()
     
-    def queue_request(self, request: BloombergRequest) -> None:
-        """Add request to Redis priority queue"""
+    def _payload_key(self, request_id) -> str:
+        if isinstance(request_id, bytes):
+            request_id = request_id.decode("utf-8")
+        return f"{self.queue}:payload:{request_id}"
+
+    @staticmethod
+    def _is_inline(member) -> bool:
+        """Old style members are the request json itself"""
+        return member[:1] in (b"{", "{")
+
+    def _encode_payload(self, request_json: bytes) -> bytes:
+        if 0 < self.payload_compress_bytes <= len(request_json):
+            return BloombergRedis.COMPRESSED_PREFIX + zlib.compress(request_json)
+        return request_json
+
+    @staticmethod
+    def _decode_payload(payload) -> dict:
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        if payload.startswith(BloombergRedis.COMPRESSED_PREFIX):
+            payload = zlib.decompress(payload[len(BloombergRedis.COMPRESSED_PREFIX):])
+        return orjson.loads(payload)
+
+    def _request_entry(self, request: BloombergRequest) -> tuple[bytes, Optional[bytes], float]:
+        """
+        Queue member, payload for the payload key (None when inline) and the priority score.
+        In ref mode the member is just the request id so zset ops and remove_request stay small
+        no matter how big the universe is.
+        """
         now = datetime.now()
         delta_time = now - self.sod_date_time
         self.enqueue_counter += 1 # in case we queue 2 quicky...
@@ -60,29 +225,175 @@ class BloombergRedis:
             "priority": request.priority,
             "retry_count": request.retry_count,
             "max_retries": request.max_retries,
+            "parent_request_id": request.parent_request_id,
+            "chunk_index": request.chunk_index,
+            "chunk_count": request.chunk_count,
             "timestamp": now.isoformat(),
         }
+        adjust_time = delta_time.seconds*100000 +  delta_time.microseconds + self.enqueue_counter
+        adjust_time = ((adjust_time / 10000000000.0) % 1.0) 
+        add_priority = request.priority + adjust_time # note sec inday is 86400
+        if self.entry_mode == BloombergRedis.ENTRY_MODE_INLINE:
+            return (orjson.dumps(request_data), None, add_priority)
+        return (request.request_id.encode("utf-8"), self._encode_payload(orjson.dumps(request_data)), add_priority)
+
+    def _lane_keys(self) -> tuple[str, str, str]:
+        """set of lane zsets, member -> "queued_at:score" and member -> lane zset"""
+        lanes = f"{self.queue}:lanes"
+        return (lanes, f"{lanes}:times", f"{lanes}:of")
+
+    def _lane_prefix(self) -> str:
+        return f"{self.queue}:lane:"
+
+    def _lane_key(self, request: BloombergRequest) -> str:
+        if not self.lanes_enabled or request.request_type == REQUEST_TYPE_CMD or not request.request_name:
+            return self.queue
+        return self._lane_prefix() + request.request_name
+
+    def _lane_name(self, lane_key) -> str:
+        lane_key = lane_key.decode("utf-8") if isinstance(lane_key, bytes) else lane_key
+        if lane_key == self.queue:
+            return BloombergLaneScheduler.DEFAULT_LANE
+        return lane_key[len(self._lane_prefix()):]
+
+    def _all_lane_keys(self) -> list[str]:
+        lanes, _, _ = self._lane_keys()
+        members = self.redis_client.smembers(lanes) if self.lanes_enabled else []
+        return [self.queue] + sorted(m.decode("utf-8") if isinstance(m, bytes) else m for m in members)
+
+    def queue_request(self, request: BloombergRequest) -> None:
+        """Add request to Redis priority queue"""
+        self.queue_requests([request])
+
+    def queue_requests(self, requests: Iterable[BloombergRequest], batch_size: int = None,
+                       transaction: bool = False) -> list[tuple[str, float]]:
+        """
+        Bulk queue_request - each batch of requests goes as 1 ZADD per lane plus 1 wake up LPUSH
+        (and a SET per payload in ref mode) in a single pipeline round trip.  In ref mode a
+        request id already on the queue is re-scored rather than queued twice.
+
+        Args:
+            requests: any iterable, consumed batch_size at a time
+            batch_size: requests per round trip, default BBG_ENQUEUE_BATCH
+            transaction: wrap each batch in MULTI / EXEC so workers never see half a batch
+        Returns:
+            (request_id, score) for every request queued, in order
+        """
+        batch_size = batch_size or self.enqueue_batch
+        signal_key = self._signal_key()
+        queued: list[tuple[str, float]] = []
+        request_iter = iter(requests)
+        start_time = time.perf_counter()
+        round_trips = 0
+
+        try:
+            while True:
+                batch = list(islice(request_iter, batch_size))
+                if not batch:
+                    break
+
+                # create a priority to mimic insertion order.
+                # Use priority as score (lower number = higher priority)
+                lane_members: dict[str, dict[bytes, float]] = {}
+                lane_times: dict[bytes, str] = {}
+                lane_of: dict[bytes, str] = {}
+                batch_ids: list[str] = []
+                pipe = self.redis_client.pipeline(transaction=transaction)
+                queued_at = time.time()
+                for request in batch:
+                    member, payload, add_priority = self._request_entry(request)
+                    lane_key = self._lane_key(request)
+                    lane_members.setdefault(lane_key, {})[member] = add_priority
+                    if lane_key != self.queue:
+                        lane_times[member] = f"{queued_at}:{add_priority}"
+                        lane_of[member] = lane_key
+                    batch_ids.append(request.request_id)
+                    queued.append((request.request_id, add_priority))
+                    if payload is not None:
+                        pipe.set(self._payload_key(request.request_id), payload, ex=self.payload_ttl_sec)
+
+                lanes, times_hash, lane_of_hash = self._lane_keys()
+                if lane_of:
+                    pipe.sadd(lanes, *[key for key in lane_members if key != self.queue])
+                    pipe.hset(times_hash, mapping=lane_times)
+                    pipe.hset(lane_of_hash, mapping=lane_of)
+                for lane_key, members in lane_members.items():
+                    pipe.zadd(lane_key, members)
+                # wake up a worker blocked in wait_for_request for each one
+                pipe.lpush(signal_key, *batch_ids[:BloombergRedis.MAX_SIGNALS])
+                pipe.ltrim(signal_key, 0, BloombergRedis.MAX_SIGNALS - 1)
+                pipe.execute()
+                round_trips += 1
+        except Exception as e:
+            logger.error(f"Error queuing requests to {self.queue} after {len(queued)}: {e}")
+            raise
+
+        if len(queued) > 1:
+            logger.info(f"Queued {len(queued)} requests on {self.queue} in {round_trips} round trips "
+                        f"{time.perf_counter() - start_time:.3f}s")
+        return queued
+
+    def _retry_keys(self) -> tuple[str, str]:
+        retry_set = f"{self.queue}:retry"
+        return (retry_set, f"{retry_set}:scores")
 
+    def schedule_retry(self, request: BloombergRequest, delay_sec : float) -> None:
+        """
+        Park a request in the retry zset scored by when it is due.  promote_due_retries
+        moves it back onto the queue so nobody has to sleep waiting for it.
+        """
+        retry_set, score_hash = self._retry_keys()
         try:
-            adjust_time = delta_time.seconds*100000 +  delta_time.microseconds + self.enqueue_counter
-            adjust_time = ((adjust_time / 10000000000.0) % 1.0) 
-            add_priority = request.priority + adjust_time # note sec inday is 86400
-        # Use priority as score (lower number = higher priority)
-            self.redis_client.zadd(
-                # create a priority to mimic insertion order.  
-                self.queue, {orjson.dumps(request_data): add_priority} 
-            )
+            member, payload, add_priority = self._request_entry(request)
+            pipe = self.redis_client.pipeline()
+            if payload is not None:
+                # retry_count and priority changed so the payload is rewritten
+                pipe.set(self._payload_key(request.request_id), payload, ex=int(delay_sec) + self.payload_ttl_sec)
+            pipe.zadd(retry_set, {member: time.time() + delay_sec})
+            pipe.hset(score_hash, member, add_priority)
+            lane_key = self._lane_key(request)
+            if lane_key != self.queue:
+                # back to its own lane when due, aging starts over at the retry priority
+                _, times_hash, lane_of_hash = self._lane_keys()
+                pipe.hset(times_hash, member, f"{time.time() + delay_sec}:{add_priority}")
+                pipe.hset(lane_of_hash, member, lane_key)
+            pipe.execute()
         except Exception as e:
-            logger.error(f"Error queuing request to {BloombergRedis.REQUEST_QUEUE}: {e}")
+            logger.error(f"Error scheduling retry on {retry_set}: {e}")
             raise
 
-    def submit_command(self, cmd: str, request_id : str = None, priority=DEFAULT_CMD_PRIORITY, payload : str = "") -> str:
-        if request_id is None:
-            request_id = str(uuid.uuid4())
+    def promote_due_retries(self) -> int:
+        """Move every retry that is due back onto the queue"""
+        retry_set, score_hash = self._retry_keys()
+        try:
+            cnt = self.redis_client.eval(BloombergRedis.PROMOTE_SCRIPT, 5,
+                                         self.queue, retry_set, score_hash, self._signal_key(), self._lane_keys()[2],
+                                         time.time(),
+                                         BloombergRedis.MAX_SIGNALS - 1)
+            if cnt:
+                logger.info(f"Promoted {cnt} retries onto {self.queue}")
+            return cnt
+        except Exception as e:
+            logger.error(f"Error promoting retries from {retry_set}: {e}")
+            raise
 
-        bloomberg_request = BloombergRequest(
+    def next_retry_due(self) -> Optional[float]:
+        """Seconds until the next retry is due, None if there are none"""
+        retry_set, _ = self._retry_keys()
+        try:
+            first = self.redis_client.zrange(retry_set, 0, 0, withscores=True)
+            if not first:
+                return None
+            return max(0.0, float(first[0][1]) - time.time())
+        except Exception as e:
+            logger.error(f"Error reading {retry_set}: {e}")
+            raise
+
+    @staticmethod
+    def _command_request(cmd: str, request_id : str = None, priority=DEFAULT_CMD_PRIORITY, payload : str = "") -> BloombergRequest:
+        return BloombergRequest(
             request_cmd=cmd,
-            request_id=request_id,
+            request_id=request_id or str(uuid.uuid4()),
             identifier="",
             request_name="",
             request_payload=payload,
@@ -90,9 +401,17 @@ class BloombergRedis:
             priority=priority,
             max_retries=1,
         )
+
+    def submit_command(self, cmd: str, request_id : str = None, priority=DEFAULT_CMD_PRIORITY, payload : str = "") -> str:
+        bloomberg_request = BloombergRedis._command_request(cmd, request_id, priority, payload)
         self.queue_request(bloomberg_request)
         return bloomberg_request.request_id
 
+    def submit_commands(self, cmds: Iterable[str], priority=DEFAULT_CMD_PRIORITY, batch_size: int = None) -> list[tuple[str, float]]:
+        """submit_command for a whole list of commands through queue_requests"""
+        return self.queue_requests((BloombergRedis._command_request(cmd, priority=priority) for cmd in cmds),
+                                   batch_size=batch_size)
+
     def get_request(self, max_items : int = 3) -> Optional[dict[any, any]]:
         try:
             return self.redis_client.zrange(
@@ -100,17 +419,292 @@ class BloombergRedis:
         except Exception as e:
             logger.error(f"Error getting queued request from {BloombergRedis.REQUEST_QUEUE}: {e}")
             raise
+
+    def load_requests(self, members: list) -> list[Optional[dict[str, Any]]]:
+        """
+        Request dicts for queue members from get_request / claim_request, one MGET for the lot.
+        Inline (old format) members are parsed as they are.
+        Returns:
+            a dict per member in the same order, None where the payload has expired
+        """
+        request_dicts: list[Optional[dict[str, Any]]] = [None] * len(members)
+        ref_index = [i for i, member in enumerate(members) if not BloombergRedis._is_inline(member)]
+        for i, member in enumerate(members):
+            if BloombergRedis._is_inline(member):
+                request_dicts[i] = orjson.loads(member)
+
+        if ref_index:
+            try:
+                payloads = self.redis_client.mget([self._payload_key(members[i]) for i in ref_index])
+            except Exception as e:
+                logger.error(f"Error loading request payloads from {self.queue}: {e}")
+                raise
+            for i, payload in zip(ref_index, payloads):
+                if payload is not None:
+                    request_dicts[i] = BloombergRedis._decode_payload(payload)
+        return request_dicts
     
-    def remove_request(self, json_request) -> None:
+    def _signal_key(self) -> str:
+        return f"{self.queue}:signal"
+
+    def wait_for_request(self, timeout : int) -> bool:
+        """
+        Block until something is queued or timeout seconds pass.  Uses no CPU while
+        idle and wakes as soon as queue_request runs.
+        Returns:
+            True if woken by an enqueue, False on timeout
+        """
+        try:
+            return self.redis_client.blpop(self._signal_key(), timeout=timeout) is not None
+        except Exception as e:
+            logger.error(f"Error waiting on {self._signal_key()}: {e}")
+            raise
+
+    def wake_workers(self, reason : str = "wake") -> None:
+        """Push a wake up so a worker blocked in wait_for_request returns now"""
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.lpush(self._signal_key(), reason)
+            pipe.ltrim(self._signal_key(), 0, BloombergRedis.MAX_SIGNALS - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error waking workers on {self._signal_key()}: {e}")
+            raise
+
+    def publish_completion(self, request_id : str) -> None:
+        """Tell the outputter a response has landed - a list so nothing is lost if it is down"""
+        try:
+            self.redis_client.lpush(BloombergRedis.COMPLETED_QUEUE, request_id)
+        except Exception as e:
+            logger.error(f"Error publishing completion to {BloombergRedis.COMPLETED_QUEUE}: {e}")
+            raise
+
+    def wait_for_completion(self, timeout : int) -> Optional[str]:
+        """Block for the next completed request id, None on timeout"""
+        try:
+            item = self.redis_client.brpop(BloombergRedis.COMPLETED_QUEUE, timeout=timeout)
+            if item is None:
+                return None
+            value = item[1]
+            return value.decode("utf-8") if isinstance(value, bytes) else value
+        except Exception as e:
+            logger.error(f"Error waiting on {BloombergRedis.COMPLETED_QUEUE}: {e}")
+            raise
+
+    def _processing_keys(self) -> tuple[str, str]:
+        processing_set = f"{BloombergRedis.PROCESSING_SET}:{self.queue}"
+        return (processing_set, f"{processing_set}:scores")
+
+    def _reclaim_keys(self) -> tuple[str, str]:
+        """member -> times its lease ran out, and the dead letter zset scored by when it went there"""
+        processing_set, _ = self._processing_keys()
+        return (f"{processing_set}:reclaims", f"{self.queue}:dead")
+
+    def claim_request(self, max_items : int = 1, lane_caps: dict[str, int] = None) -> list[tuple[bytes, float]]:
+        """
+        Atomically take up to max_items off the queue and lease them to this worker.
+        Same shape as get_request - a list of (member, score), load_requests turns the
+        members into requests.  Call remove_request once the item is done or release_request
+        to hand it back.
+        Args:
+            max_items: most to claim
+            lane_caps: request_name -> how many more this worker can run, lanes left out are uncapped
+        """
+        processing_set, score_hash = self._processing_keys()
+        try:
+            lease_expiry = time.time() + self.lease_sec
+            if not self.lanes_enabled:
+                items = self.redis_client.eval(BloombergRedis.CLAIM_SCRIPT, 3,
+                                               self.queue, processing_set, score_hash,
+                                               max_items, lease_expiry)
+                return [(items[i], float(items[i + 1])) for i in range(0, len(items), 2)]
+            return self._claim_from_lanes(max_items, lane_caps or {}, lease_expiry)
+        except Exception as e:
+            logger.error(f"Error claiming request from {self.queue}: {e}")
+            raise
+
+    def _claim_from_lanes(self, max_items: int, lane_caps: dict[str, int], lease_expiry: float) -> list[tuple[bytes, float]]:
+        """Look at the head of every lane, let the scheduler split max_items between them, claim"""
+        processing_set, score_hash = self._processing_keys()
+        _, times_hash, _ = self._lane_keys()
+        lane_keys = self._all_lane_keys()
+
+        pipe = self.redis_client.pipeline()
+        for lane_key in lane_keys:
+            pipe.zrange(lane_key, 0, max_items - 1, withscores=True)
+        heads = {self._lane_name(lane_key): [float(score) for _, score in head]
+                 for lane_key, head in zip(lane_keys, pipe.execute()) if head}
+        if not heads:
+            return []
+
+        plan = self.lane_scheduler.plan(heads, lane_caps, max_items)
+        lane_by_name = {self._lane_name(lane_key): lane_key for lane_key in lane_keys}
+        pipe = self.redis_client.pipeline()
+        for lane_name, count in plan.items():
+            pipe.eval(BloombergRedis.CLAIM_SCRIPT, 3, lane_by_name[lane_name], processing_set, score_hash,
+                      count, lease_expiry)
+
+        claimed: list[tuple[bytes, float]] = []
+        claimed_lanes: list[str] = []
+        for lane_name, items in zip(plan, pipe.execute()):
+            for i in range(0, len(items), 2):
+                claimed.append((items[i], float(items[i + 1])))
+                claimed_lanes.append(lane_name)
+
+        if claimed:
+            now = time.time()
+            waits: dict[str, list[float]] = {}
+            for lane_name, meta in zip(claimed_lanes, self.redis_client.hmget(times_hash, [m for m, _ in claimed])):
+                if meta is not None:
+                    meta = meta.decode("utf-8") if isinstance(meta, bytes) else meta
+                    waits.setdefault(lane_name, []).append(max(0.0, now - float(meta.split(":", 1)[0])))
+            for lane_name, wait_secs in waits.items():
+                self.lane_scheduler.record_waits(lane_name, wait_secs)
+        return claimed
+
+    def age_lanes(self) -> int:
+        """Move long waiting lane requests up a priority per BBG_LANE_AGING_SEC - runs every quarter of that"""
+        if not self.lanes_enabled or self.lane_aging_sec <= 0:
+            return 0
+        now = time.time()
+        if now - self.lanes_aged_at < self.lane_aging_sec / 4:
+            return 0
+        self.lanes_aged_at = now
+        _, times_hash, _ = self._lane_keys()
+        try:
+            pipe = self.redis_client.pipeline()
+            for lane_key in self._all_lane_keys()[1:]:
+                pipe.eval(BloombergRedis.AGE_SCRIPT, 2, lane_key, times_hash,
+                          now, self.lane_aging_sec, HIGH_REQUEST_PRIORITY, BloombergRedis.AGE_WINDOW)
+            cnt = sum(pipe.execute())
+            if cnt:
+                logger.info(f"Aged {cnt} waiting requests up a priority on {self.queue}")
+            return cnt
+        except Exception as e:
+            logger.error(f"Error aging lanes of {self.queue}: {e}")
+            raise
+
+    def lane_stats(self) -> dict[str, dict[str, Any]]:
+        """Depth and waits per lane - how long the head has been waiting now, served / waits since start up"""
+        _, times_hash, _ = self._lane_keys()
+        try:
+            lane_keys = self._all_lane_keys()
+            pipe = self.redis_client.pipeline()
+            for lane_key in lane_keys:
+                pipe.zcard(lane_key)
+                pipe.zrange(lane_key, 0, 0)
+            results = pipe.execute()
+            depths: dict[str, int] = {}
+            head_members: dict[str, Any] = {}
+            for i, lane_key in enumerate(lane_keys):
+                depths[self._lane_name(lane_key)] = int(results[2 * i])
+                if results[2 * i + 1]:
+                    head_members[self._lane_name(lane_key)] = results[2 * i + 1][0]
+
+            head_waits: dict[str, float] = {}
+            if head_members:
+                now = time.time()
+                for lane_name, meta in zip(head_members, self.redis_client.hmget(times_hash, list(head_members.values()))):
+                    if meta is not None:
+                        meta = meta.decode("utf-8") if isinstance(meta, bytes) else meta
+                        head_waits[lane_name] = max(0.0, now - float(meta.split(":", 1)[0]))
+            return self.lane_scheduler.stats(depths, head_waits)
+        except Exception as e:
+            logger.error(f"Error reading lane stats for {self.queue}: {e}")
+            raise
+
+    def release_request(self, member, score : float) -> None:
+        """Give a claimed request back to the queue (its lane) unprocessed."""
+        processing_set, score_hash = self._processing_keys()
+        _, _, lane_of_hash = self._lane_keys()
+        try:
+            lane_key = self.redis_client.hget(lane_of_hash, member) if self.lanes_enabled else None
+            pipe = self.redis_client.pipeline()
+            pipe.zadd(lane_key or self.queue, {member: score})
+            pipe.zrem(processing_set, member)
+            pipe.hdel(score_hash, member)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error releasing request back to {self.queue}: {e}")
+            raise
+
+    @staticmethod
+    def _member_request_id(member) -> str:
+        """request_id of a queue member - the member itself in ref mode, inside the json when inline"""
+        if BloombergRedis._is_inline(member):
+            return BloombergRedis._decode_payload(member)["request_id"]
+        return member.decode("utf-8") if isinstance(member, bytes) else member
+
+    def reclaim_expired_requests(self) -> int:
+        """
+        Put requests whose lease ran out (crashed worker) back on the queue.  One that has been
+        reclaimed max_reclaims times already goes to the dead letter zset instead, and its
+        request_id is kept for pop_dead_letters so the caller can error it out in the db.
+        """
+        processing_set, score_hash = self._processing_keys()
+        reclaims_hash, dead_set = self._reclaim_keys()
+        try:
+            result = self.redis_client.eval(BloombergRedis.RECLAIM_SCRIPT, 6,
+                                            self.queue, processing_set, score_hash, self._lane_keys()[2],
+                                            reclaims_hash, dead_set, time.time(), self.max_reclaims)
+            cnt, dead = int(result[0]), result[1:]
+            if cnt:
+                logger.warning(f"Reclaimed {cnt} expired requests onto {self.queue}")
+            if dead:
+                logger.error(f"{len(dead)} requests ran out their lease over {self.max_reclaims} times - moved to {dead_set}")
+                self.dead_letters.extend(BloombergRedis._member_request_id(member) for member in dead)
+            return cnt
+        except Exception as e:
+            logger.error(f"Error reclaiming expired requests for {self.queue}: {e}")
+            raise
+
+    def pop_dead_letters(self) -> list[str]:
+        """request_ids dead lettered by reclaim_expired_requests since the last call"""
+        dead_letters = list(self.dead_letters)
+        self.dead_letters.clear()
+        return dead_letters
+
+    def renew_leases(self, members: list) -> None:
+        """Push the lease out again for members still being worked on - only ones still in the processing zset"""
+        if not members:
+            return
+        processing_set, _ = self._processing_keys()
+        try:
+            lease_expiry = time.time() + self.lease_sec
+            self.redis_client.zadd(processing_set, {member: lease_expiry for member in members}, xx=True)
+        except Exception as e:
+            logger.error(f"Error renewing {len(members)} leases on {processing_set}: {e}")
+            raise
+
+    def remove_request(self, member) -> None:
+        """Done with a queue member - its payload key is dropped unless a retry still needs it"""
+        processing_set, score_hash = self._processing_keys()
+        retry_set, _ = self._retry_keys()
+        _, times_hash, lane_of_hash = self._lane_keys()
+        is_ref = not BloombergRedis._is_inline(member)
         try:
-            self.redis_client.zrem(self.queue, json_request)
+            self.redis_client.eval(BloombergRedis.REMOVE_SCRIPT, 8,
+                                   self.queue, processing_set, score_hash, retry_set,
+                                   self._payload_key(member if is_ref else ""), times_hash, lane_of_hash,
+                                   self._reclaim_keys()[0], member, 1 if is_ref else 0)
         except Exception as e:
             logger.error(f"Error removing sender request from {BloombergRedis.REQUEST_QUEUE}: {e}")
             raise
 
     def clear_queue(self) -> None:
+        processing_set, _ = self._processing_keys()
+        retry_set, _ = self._retry_keys()
         try:
-            self.redis_client.delete(self.queue)
+            lane_keys = self._all_lane_keys()
+            pipe = self.redis_client.pipeline()
+            for zset in lane_keys + [processing_set, retry_set, self._reclaim_keys()[1]]:
+                pipe.zrange(zset, 0, -1)
+            payload_keys = [self._payload_key(member) for members in pipe.execute() for member in members
+                            if not BloombergRedis._is_inline(member)]
+            for start in range(0, len(payload_keys), self.enqueue_batch):
+                self.redis_client.delete(*payload_keys[start:start + self.enqueue_batch])
+            self.redis_client.delete(*lane_keys, *self._lane_keys(), self._signal_key(),
+                                     *self._processing_keys(), *self._retry_keys(), *self._reclaim_keys())
         except Exception as e:
             logger.error(f"Error clearing out the queue {BloombergRedis.REQUEST_QUEUE}: {e}")
             raise
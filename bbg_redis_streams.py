@@ -0,0 +1,355 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Any, Iterable, Optional
+
+from bbg_redis import BloombergRedis
+from bbg_request import BloombergRequest, HIGH_CMD_PRIORITY, LAST_CMD_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+
+class BloombergStreamRedis(BloombergRedis):
+    """
+    The request queue on redis streams instead of a sorted set.  Each priority gets its own
+    stream <queue>:stream:<priority> read through a consumer group, so every worker gets its
+    own entries with no ZRANGE / ZREM race.  An entry stays pending until remove_request XACKs
+    it, and entries a dead worker never acked are taken over with XAUTOCLAIM once they have
+    been idle for lease_sec - at least once delivery.  Entries still in flight here have their
+    idle time reset on every reclaim pass so a long submit is not taken over while it runs.
+
+    Streams are read in smooth weighted round robin order (BBG_STREAM_WEIGHTS) so the high
+    priority streams go first most of the time but the low ones are never starved.  Same
+    interface as BloombergRedis - members handed out by claim_request are "<stream>|<entry id>".
+    """
+    TRANSPORT_ZSET = "zset"
+    TRANSPORT_STREAM = "stream"
+    DEFAULT_GROUP = "bbg_workers"
+    RECLAIM_COUNT = 100  # entries per stream per XAUTOCLAIM
+    MEMBER_SEP = "|"
+
+    # due retries onto the stream for their priority - ZREM, XADD, HDEL and DEL in one call so a
+    # retry is never lost or added twice when workers promote at the same time.  The stream and
+    # payload keys are built from ARGV prefixes, so like the zset scripts this needs non-cluster redis
+    PROMOTE_SCRIPT = """
+        local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        for _, request_id in ipairs(due) do
+            local priority = math.floor(tonumber(redis.call('HGET', KEYS[2], request_id) or ARGV[6]))
+            priority = math.min(math.max(priority, tonumber(ARGV[5])), tonumber(ARGV[6]))
+            local payload_key = ARGV[4] .. request_id
+            local payload = redis.call('GET', payload_key)
+            if payload then
+                redis.call('XADD', ARGV[3] .. priority, '*', 'id', request_id, 'r', payload)
+                redis.call('LPUSH', KEYS[3], 'retry')
+            end
+            redis.call('ZREM', KEYS[1], request_id)
+            redis.call('HDEL', KEYS[2], request_id)
+            redis.call('DEL', payload_key)
+        end
+        redis.call('LTRIM', KEYS[3], 0, ARGV[2])
+        return #due
+    """
+
+    def __init__(self, *args, group: str = None, consumer: str = None, **kwargs):
+        """
+        Args:
+            group: consumer group every sender (or poller) shares
+            consumer: name of this worker in the group, host:pid:uuid by default
+            other args as BloombergRedis
+        """
+        super().__init__(*args, **kwargs)
+        # retries are parked by id with the payload in its own key until they are due
+        self.entry_mode = BloombergRedis.ENTRY_MODE_REF
+        # the priority streams are the lanes here
+        self.lanes_enabled = False
+        self.group = group or os.environ.get("BBG_STREAM_GROUP", BloombergStreamRedis.DEFAULT_GROUP)
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.weights = BloombergStreamRedis._parse_weights(os.environ.get("BBG_STREAM_WEIGHTS", ""))
+        self._current_weights = {priority: 0 for priority in self.weights}
+        self._groups_ready: set[str] = set()
+        # payloads of entries delivered to this worker, keyed by member until removed or released
+        self._delivered: dict[str, tuple[Any, bytes]] = {}
+        self._reclaimed: deque[tuple[str, float]] = deque()
+        # XAUTOCLAIM cursor per stream, each pass carries on from where the last stopped
+        self._reclaim_cursor: dict[str, str] = {}
+        self._lock = threading.Lock()
+        logger.info(f"Stream queue {self.queue} group {self.group} consumer {self.consumer}")
+
+    @staticmethod
+    def _parse_weights(weights: str) -> dict[int, int]:
+        """'2=100,4=20' -> weight per priority, anything not given is 2 ** (LAST_CMD_PRIORITY - priority)"""
+        parsed = {priority: 2 ** (LAST_CMD_PRIORITY - priority)
+                  for priority in range(HIGH_CMD_PRIORITY, LAST_CMD_PRIORITY + 1)}
+        for item in weights.split(","):
+            if "=" not in item:
+                continue
+            priority, weight = item.split("=", 1)
+            try:
+                if int(priority) in parsed:
+                    parsed[int(priority)] = max(1, int(weight))
+            except ValueError:
+                logger.warning(f"Bad BBG_STREAM_WEIGHTS entry {item}")
+        return parsed
+
+    def _stream_key(self, priority: float) -> str:
+        priority = min(max(int(priority), HIGH_CMD_PRIORITY), LAST_CMD_PRIORITY)
+        return f"{self.queue}:stream:{priority}"
+
+    def _stream_keys(self) -> list[str]:
+        return [self._stream_key(priority) for priority in sorted(self.weights)]
+
+    @staticmethod
+    def _to_str(value) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def _member(self, stream_key, entry_id) -> str:
+        return f"{BloombergStreamRedis._to_str(stream_key)}{BloombergStreamRedis.MEMBER_SEP}{BloombergStreamRedis._to_str(entry_id)}"
+
+    @staticmethod
+    def _split_member(member) -> tuple[str, str]:
+        stream_key, entry_id = BloombergStreamRedis._to_str(member).rsplit(BloombergStreamRedis.MEMBER_SEP, 1)
+        return (stream_key, entry_id)
+
+    @staticmethod
+    def _priority_of(stream_key: str) -> float:
+        return float(stream_key.rsplit(":", 1)[1])
+
+    def _ensure_groups(self) -> None:
+        for stream_key in self._stream_keys():
+            if stream_key in self._groups_ready:
+                continue
+            try:
+                # from 0 so anything queued before the group existed is still read
+                self.redis_client.xgroup_create(stream_key, self.group, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    logger.error(f"Error creating group {self.group} on {stream_key}: {e}")
+                    raise
+            self._groups_ready.add(stream_key)
+
+    def _weighted_order(self) -> list[int]:
+        """Smooth weighted round robin pick goes first, then the rest in priority order"""
+        with self._lock:
+            total = sum(self.weights.values())
+            for priority, weight in self.weights.items():
+                self._current_weights[priority] += weight
+            pick = max(self._current_weights, key=lambda priority: self._current_weights[priority])
+            self._current_weights[pick] -= total
+        return [pick] + [priority for priority in sorted(self.weights) if priority != pick]
+
+    def queue_requests(self, requests: Iterable[BloombergRequest], batch_size: int = None,
+                       transaction: bool = False) -> list[tuple[str, float]]:
+        """XADD each request to the stream for its priority, batch_size per pipeline round trip"""
+        batch_size = batch_size or self.enqueue_batch
+        signal_key = self._signal_key()
+        queued: list[tuple[str, float]] = []
+        request_iter = iter(requests)
+
+        try:
+            while True:
+                batch = list(islice(request_iter, batch_size))
+                if not batch:
+                    break
+                pipe = self.redis_client.pipeline(transaction=transaction)
+                for request in batch:
+                    _, payload, add_priority = self._request_entry(request)
+                    pipe.xadd(self._stream_key(request.priority), {"id": request.request_id, "r": payload})
+                    queued.append((request.request_id, add_priority))
+                pipe.lpush(signal_key, *[request.request_id for request in batch[:BloombergRedis.MAX_SIGNALS]])
+                pipe.ltrim(signal_key, 0, BloombergRedis.MAX_SIGNALS - 1)
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"Error adding requests to the {self.queue} streams after {len(queued)}: {e}")
+            raise
+        return queued
+
+    def promote_due_retries(self) -> int:
+        """Due retries are added back to the stream for their priority"""
+        retry_set, score_hash = self._retry_keys()
+        try:
+            promoted = self.redis_client.eval(BloombergStreamRedis.PROMOTE_SCRIPT, 3,
+                                              retry_set, score_hash, self._signal_key(),
+                                              time.time(),
+                                              BloombergRedis.MAX_SIGNALS - 1,
+                                              f"{self.queue}:stream:",
+                                              self._payload_key(""),
+                                              HIGH_CMD_PRIORITY,
+                                              LAST_CMD_PRIORITY)
+        except Exception as e:
+            logger.error(f"Error promoting retries from {retry_set}: {e}")
+            raise
+        if promoted:
+            logger.info(f"Promoted {promoted} retries onto the {self.queue} streams")
+        return promoted
+
+    def _take_entries(self, stream_key, entries, claimed: list[tuple[str, float]]) -> list[str]:
+        """Remember delivered payloads, returns the ids of entries deleted out from under us"""
+        gone: list[str] = []
+        for entry_id, fields in entries:
+            fields = fields or {}
+            payload = fields.get(b"r", fields.get("r"))
+            if payload is None:
+                gone.append(entry_id)
+                continue
+            member = self._member(stream_key, entry_id)
+            self._delivered[member] = (fields.get(b"id", fields.get("id")), payload)
+            claimed.append((member, BloombergStreamRedis._priority_of(self._to_str(stream_key))))
+        return gone
+
+    def claim_request(self, max_items : int = 1, lane_caps: dict[str, int] = None) -> list[tuple[str, float]]:
+        """
+        Up to max_items new entries for this consumer, reclaimed ones first then the streams in
+        weighted order.  Each stays pending until remove_request or release_request.
+        """
+        claimed: list[tuple[str, float]] = []
+        while self._reclaimed and len(claimed) < max_items:
+            claimed.append(self._reclaimed.popleft())
+
+        try:
+            self._ensure_groups()
+            for priority in self._weighted_order():
+                if len(claimed) >= max_items:
+                    break
+                stream_key = self._stream_key(priority)
+                response = self.redis_client.xreadgroup(self.group, self.consumer, {stream_key: ">"},
+                                                        count=max_items - len(claimed))
+                for _, entries in response or []:
+                    gone = self._take_entries(stream_key, entries, claimed)
+                    if gone:
+                        self.redis_client.xack(stream_key, self.group, *gone)
+        except Exception as e:
+            if "NOGROUP" in str(e):
+                # streams cleared by another worker - groups come back on the next claim
+                self._groups_ready.clear()
+                return claimed
+            logger.error(f"Error claiming from the {self.queue} streams: {e}")
+            raise
+        return claimed
+
+    def get_request(self, max_items : int = 3) -> list[tuple[str, float]]:
+        """No peeking on a stream - the entries are claimed and must be removed or released"""
+        return self.claim_request(max_items)
+
+    def load_requests(self, members: list) -> list[Optional[dict[str, Any]]]:
+        request_dicts: list[Optional[dict[str, Any]]] = []
+        for member in members:
+            delivered = self._delivered.get(self._to_str(member))
+            request_dicts.append(None if delivered is None else BloombergRedis._decode_payload(delivered[1]))
+        return request_dicts
+
+    def remove_request(self, member) -> None:
+        """XACK and drop the entry"""
+        stream_key, entry_id = BloombergStreamRedis._split_member(member)
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.xack(stream_key, self.group, entry_id)
+            pipe.xdel(stream_key, entry_id)
+            pipe.execute()
+            self._delivered.pop(self._to_str(member), None)
+        except Exception as e:
+            logger.error(f"Error acking {member} on {self.queue}: {e}")
+            raise
+
+    def release_request(self, member, score : float) -> None:
+        """Hand an entry back unprocessed - added again as a new entry and the old one acked"""
+        stream_key, entry_id = BloombergStreamRedis._split_member(member)
+        delivered = self._delivered.pop(self._to_str(member), None)
+        try:
+            pipe = self.redis_client.pipeline()
+            if delivered is not None:
+                request_id, payload = delivered
+                pipe.xadd(stream_key, {"id": request_id, "r": payload})
+                pipe.lpush(self._signal_key(), "release")
+            pipe.xack(stream_key, self.group, entry_id)
+            pipe.xdel(stream_key, entry_id)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error releasing {member} back to {self.queue}: {e}")
+            raise
+
+    def _heartbeat(self, pipe, members: list) -> int:
+        """XCLAIM JUSTID our own in flight entries - resets their idle time, nothing is re-delivered"""
+        in_flight: dict[str, list[str]] = {}
+        for member in members:
+            stream_key, entry_id = BloombergStreamRedis._split_member(member)
+            in_flight.setdefault(stream_key, []).append(entry_id)
+        for stream_key, entry_ids in in_flight.items():
+            pipe.xclaim(stream_key, self.group, self.consumer, 0, entry_ids, justid=True)
+        return len(in_flight)
+
+    def renew_leases(self, members: list) -> None:
+        if not members:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._heartbeat(pipe, members)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error renewing {len(members)} stream entries on {self.queue}: {e}")
+            raise
+
+    def reclaim_expired_requests(self) -> int:
+        """
+        Keep our in flight entries alive, then XAUTOCLAIM entries other workers left pending
+        longer than lease_sec.  claim_request hands the reclaimed ones out first.
+        """
+        stream_keys = self._stream_keys()
+        count = 0
+        try:
+            self._ensure_groups()
+            pipe = self.redis_client.pipeline(transaction=False)
+            heartbeats = self._heartbeat(pipe, list(self._delivered))
+            for stream_key in stream_keys:
+                pipe.xautoclaim(stream_key, self.group, self.consumer, self.lease_sec * 1000,
+                                start_id=self._reclaim_cursor.get(stream_key, "0-0"),
+                                count=BloombergStreamRedis.RECLAIM_COUNT)
+            for stream_key, response in zip(stream_keys, pipe.execute()[heartbeats:]):
+                # 0-0 once the whole pending list has been walked, start over next time
+                self._reclaim_cursor[stream_key] = self._to_str(response[0])
+                reclaimed: list[tuple[str, float]] = []
+                gone = self._take_entries(stream_key, response[1], reclaimed)
+                if gone:
+                    self.redis_client.xack(stream_key, self.group, *gone)
+                self._reclaimed.extend(reclaimed)
+                count += len(reclaimed)
+        except Exception as e:
+            if "NOGROUP" in str(e):
+                self._groups_ready.clear()
+                self._reclaim_cursor.clear()
+                return 0
+            logger.error(f"Error reclaiming pending entries for {self.queue}: {e}")
+            raise
+        if count:
+            logger.warning(f"Reclaimed {count} entries idle over {self.lease_sec}s on {self.queue}")
+        return count
+
+    def clear_queue(self) -> None:
+        retry_set, _ = self._retry_keys()
+        try:
+            payload_keys = [self._payload_key(request_id) for request_id in self.redis_client.zrange(retry_set, 0, -1)]
+            self.redis_client.delete(*self._stream_keys(), self._signal_key(), *self._retry_keys(), *payload_keys)
+            self._delivered.clear()
+            self._reclaimed.clear()
+            self._reclaim_cursor.clear()
+            self._groups_ready.clear()
+        except Exception as e:
+            logger.error(f"Error clearing out the {self.queue} streams: {e}")
+            raise
+
+    def set_queue_name(self, queue_name : str):
+        super().set_queue_name(queue_name)
+        self._groups_ready.clear()
+        self._reclaim_cursor.clear()
+
+
+def redis_queue_from_env(**kwargs) -> BloombergRedis:
+    """BBG_QUEUE_TRANSPORT picks the request queue - zset (default) or stream"""
+    transport = os.environ.get("BBG_QUEUE_TRANSPORT", BloombergStreamRedis.TRANSPORT_ZSET).lower()
+    if transport == BloombergStreamRedis.TRANSPORT_STREAM:
+        return BloombergStreamRedis(**kwargs)
+    return BloombergRedis(**kwargs)
@@ -25,6 +25,10 @@ class BloombergRequest:
     priority: int = 4 
     retry_count: int = 0
     max_retries: int = 3
+    # set on the chunks of a universe split up by the sender
+    parent_request_id: str = None
+    chunk_index: int = None
+    chunk_count: int = None
 
     def print_the_dict(self, log_func):
         for key, value in self.__dict__.items():
@@ -35,7 +39,10 @@ class BloombergRequest:
 
     @staticmethod
     def create_from_json(inJSON : str):
-        tmp_dict = json.loads(inJSON)
+        return BloombergRequest.create_from_dict(json.loads(inJSON))
+
+    @staticmethod
+    def create_from_dict(tmp_dict : dict[str, Any]):
         bbgRequest = BloombergRequest("RT", "RC", "RI", "ID", "RN")
         for key, value in tmp_dict.items():
             bbgRequest.__dict__[key] = value 
@@ -4,6 +4,7 @@ import logging
 from ASL.utils.asl_logging import ASL_Logging
 
 from bbg_redis import BloombergRedis
+from bbg_redis_streams import redis_queue_from_env
 
 from bbg_send_cmds import (
     EXIT_CMD,
@@ -21,7 +22,7 @@ def setup_logging():
 
 def main():
     setup_logging()
-    redis_que = BloombergRedis()
+    redis_que = redis_queue_from_env()
     
     logger.info("Bloomberg Cusip Request Starting")
     logger.info("Clearing quueue..")
@@ -1,9 +1,13 @@
 import json
+import math
 import time
 import uuid
 import os
 import sys
 import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from ASL.utils.asl_logging import ASL_Logging
 # from asl_logging import ASL_Logging
 
@@ -12,9 +16,13 @@ from ASL.utils.asl_logging import ASL_Logging
 from typing import Any, Tuple
 
 from bbg_rest_connection import BloombergRestConnection
+from bbg_token_broker import token_broker_from_env
 from bbg_database import BloombergDatabase
 from bbg_redis import BloombergRedis
+from bbg_redis_streams import redis_queue_from_env
+from bbg_control import control_listener_from_env, ROLE_SENDER
 from bbg_request import BloombergRequest, DEFAULT_CMD_PRIORITY, DEFAULT_REQUEST_PRIORITY, HIGH_CMD_PRIORITY, LAST_CMD_PRIORITY 
+from bbg_request import LOWEST_REQUEST_PRIORITY
 from bbg_request import LAST_CMD_PRIORITY, REQUEST_TYPE_CMD, REQUEST_TYPE_BBG_REQUEST
 from bloomberg_data_def import BloombergDataDef
 from bbg_send_cmds import (
@@ -22,6 +30,8 @@ from bbg_send_cmds import (
     PAUSE_CMD,
     RESUME_CMD,
     CLR_QUEUES,
+    RELOAD_DEFS,
+    STATUS_CMD,
     REQUEST_TSY_CUSIPS,
     REQUEST_FUT_CUSIPS,
     REQUEST_MBS_CUSIPS,
@@ -44,6 +54,11 @@ class BloombergRequestSender:
     MAX_LOOPS = -1  # wait for exit...
     MIN_WAIT_TIME = 2
     MAX_WAIT_TIME = 120 # 2 min
+    DEFAULT_RETRY_WAIT_SEC = 120  # same as the bloomberg_requests_def default
+    MIN_CHUNK_SIZE = 50
+    PAUSED_SCAN_ITEMS = 100  # claimed per pass while paused, only commands are kept
+    WAIT_MODE_BLOCK = "block"  # block on redis until something is queued
+    WAIT_MODE_SLEEP = "sleep"  # old exponential sleep backoff
 
     def __init__(
         self,
@@ -77,47 +92,264 @@ class BloombergRequestSender:
         self.db_connection = BloombergDatabase(
             server=db_server, port=db_port, database=_database
         )
+        # pool threads each get their own db connection - pyodbc connections are not shared
+        self._db_args = {"server": db_server, "port": db_port, "database": _database}
+        self._thread_local = threading.local()
+        self._thread_db_connections: list[BloombergDatabase] = []
+        self._thread_db_lock = threading.Lock()
+
+        # Redis connection
+        lease_sec = int(os.environ.get("BBG_QUEUE_LEASE_SEC", BloombergRedis.DEFAULT_LEASE_SEC))
+        self.redis_connection = redis_queue_from_env(redis_host=redis_host, lease_sec=lease_sec)
 
         self.bbg_connection = BloombergRestConnection(
             self.db_connection,
             catalog=catalog,
             client_id=client_id,
             client_secret=client_secret,
+            token_broker=token_broker_from_env(self.redis_connection.get_client()),
         )
 
-        # Redis connection
-        self.redis_connection = BloombergRedis(redis_host=redis_host)
+        self.wait_mode = os.environ.get("BBG_SENDER_WAIT_MODE", BloombergRequestSender.WAIT_MODE_BLOCK).lower()
+
+        # concurrent submission - 1 worker is the old one at a time behaviour
+        self.max_workers = max(1, int(os.environ.get("BBG_SENDER_MAX_WORKERS", 1)))
+        self.name_limits: dict[str, int] = BloombergRequestSender._parse_name_limits("BBG_SENDER_CONCURRENCY")
+        self.name_semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self.name_semaphore_lock = threading.Lock()
+        # submits queued or running per request name - full names are not claimed from their lane
+        self.name_in_flight: Counter = Counter()
+        self.submit_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bbg_submit") \
+            if self.max_workers > 1 else None
+        self.pending_submits: set[Future] = set()
+        # queue members handed to the pool - their leases are pushed out until the submit finishes
+        self.leased_members: set = set()
+        self.leases_renewed_at = 0.0
+
+        # universe chunking - max members per chunk by request name, 0 / missing = no split.
+        # with a target time the chunk shrinks so a chunk should turn around in about that long
+        self.chunk_sizes: dict[str, int] = BloombergRequestSender._parse_name_limits("BBG_CHUNK_SIZE")
+        self.chunk_target_sec = int(os.environ.get("BBG_CHUNK_TARGET_SEC", 0))
         self.data_def = BloombergDataDef(self.db_connection)
         self.request_definitions = self.db_connection.get_request_definitions()
        # self.request_dates = self.db_connection.get_last_date_for_request()
+        self.lane_stats_sec = int(os.environ.get("BBG_LANE_STATS_SEC", 300))
+        self.lane_stats_logged_at = time.time()
+
+        # control channel - its thread only sets these, the main loop acts on them
+        self.run_state = RunState.INITIALIZING
+        self.control_state: RunState = None
+        self.reload_defs = False
+        self.control_event = threading.Event()
+        self.control_listener = control_listener_from_env(self.redis_connection.get_client(), ROLE_SENDER, {
+            EXIT_CMD: lambda message: self._control_set_state(RunState.CMD_DIE),
+            PAUSE_CMD: lambda message: self._control_set_state(RunState.PAUSED),
+            RESUME_CMD: lambda message: self._control_set_state(RunState.RESUMING),
+            CLR_QUEUES: self._control_clear_queues,
+            RELOAD_DEFS: self._control_reload_defs,
+            STATUS_CMD: self._control_status,
+        })
 
         logger.info("Init done")
 
+    @staticmethod
+    def _parse_name_limits(env_name: str) -> dict[str, int]:
+        """env_name='TsyBondInfo=2,MBSBondInfo=4' -> {'TsyBondInfo': 2, 'MBSBondInfo': 4}"""
+        limits: dict[str, int] = {}
+        for item in os.environ.get(env_name, "").split(","):
+            if "=" not in item:
+                continue
+            name, limit = item.split("=", 1)
+            try:
+                limits[name.strip()] = max(0, int(limit))
+            except ValueError:
+                logger.warning(f"Bad {env_name} entry {item}")
+        return limits
+
+    def _get_thread_db(self) -> BloombergDatabase:
+        """Db connection for the calling pool thread, created on first use"""
+        db = getattr(self._thread_local, "db_connection", None)
+        if db is None:
+            db = BloombergDatabase(**self._db_args)
+            self._thread_local.db_connection = db
+            with self._thread_db_lock:
+                self._thread_db_connections.append(db)
+        return db
+
+    def _get_name_semaphore(self, request_name: str) -> threading.BoundedSemaphore:
+        with self.name_semaphore_lock:
+            sem = self.name_semaphores.get(request_name)
+            if sem is None:
+                sem = threading.BoundedSemaphore(max(1, self.name_limits.get(request_name, self.max_workers)))
+                self.name_semaphores[request_name] = sem
+            return sem
+
+    def _free_submit_slots(self) -> int:
+        """How many more requests we can claim - waits for one to finish if the pool is full"""
+        if self.submit_pool is None:
+            return 1
+
+        self.pending_submits = {f for f in self.pending_submits if not f.done()}
+        while len(self.pending_submits) >= self.max_workers:
+            # long submits must not lose their lease while we sit here
+            self._renew_leases()
+            done, not_done = wait(self.pending_submits, timeout=self._lease_renew_sec(), return_when=FIRST_COMPLETED)
+            self.pending_submits = not_done
+        return self.max_workers - len(self.pending_submits)
+
+    def _lease_renew_sec(self) -> float:
+        return max(1.0, self.redis_connection.lease_sec / 3)
+
+    def _renew_leases(self) -> None:
+        """Keep the claims of running submits alive so no other sender reclaims them mid flight"""
+        if time.time() - self.leases_renewed_at < self._lease_renew_sec():
+            return
+        self.leases_renewed_at = time.time()
+        with self.name_semaphore_lock:
+            members = list(self.leased_members)
+        self.redis_connection.renew_leases(members)
+
+    def _fail_dead_letters(self) -> None:
+        """Requests reclaim_expired_requests gave up on are errored out so they do not sit pending forever"""
+        for request_id in self.redis_connection.pop_dead_letters():
+            try:
+                self.db_connection.set_request_failed(request_id)
+                self.db_connection.store_error_response(
+                    request_id, f"lease ran out over {self.redis_connection.max_reclaims} times - dead lettered")
+                logger.error(f"Request {request_id} dead lettered")
+            except Exception as e:
+                logger.error(f"Error failing dead lettered request {request_id}: {e}")
+
+    def _lane_caps(self) -> dict[str, int]:
+        """Free slots per capped request name, what claim_request may take from each lane"""
+        with self.name_semaphore_lock:
+            return {name: max(0, limit - self.name_in_flight[name]) for name, limit in self.name_limits.items()}
+
+    def _log_lane_stats(self) -> None:
+        if self.lane_stats_sec <= 0 or time.time() - self.lane_stats_logged_at < self.lane_stats_sec:
+            return
+        self.lane_stats_logged_at = time.time()
+        for lane, stats in self.redis_connection.lane_stats().items():
+            logger.info(f"Lane {lane}: {stats}")
+
+    def _submit_in_pool(self, bbg_request: BloombergRequest, queue_member) -> None:
+        sem = self._get_name_semaphore(bbg_request.request_name)
+        with sem:
+            try:
+                self._process_single_request(bbg_request, self._get_thread_db())
+            finally:
+                with self.name_semaphore_lock:
+                    self.name_in_flight[bbg_request.request_name] -= 1
+                    self.leased_members.discard(queue_member)
+                if queue_member is not None:
+                    self.redis_connection.remove_request(queue_member)
+                if bbg_request.request_name in self.name_limits:
+                    # its lane may have been skipped for being full
+                    self.redis_connection.wake_workers("lane")
+
+    def _get_chunk_size(self, request_name: str) -> int:
+        chunk_size = self.chunk_sizes.get(request_name, 0)
+        if chunk_size <= 0 or self.chunk_target_sec <= 0:
+            return chunk_size
+
+        sec_per_item = self.db_connection.get_seconds_per_security(request_name)
+        if sec_per_item:
+            history_size = max(BloombergRequestSender.MIN_CHUNK_SIZE, int(self.chunk_target_sec / sec_per_item))
+            chunk_size = min(chunk_size, history_size)
+        return chunk_size
+
+    def _chunk_request(self, bbg_request: BloombergRequest) -> list[BloombergRequest]:
+        """Split a big universe into chunk sized child requests tied to bbg_request as the parent"""
+        if bbg_request.parent_request_id is not None or bbg_request.request_payload is None:
+            return [bbg_request]  # already a chunk (retry)
+
+        universe_list = bbg_request.request_payload.get("universe", {}).get("contains", [])
+        chunk_size = self._get_chunk_size(bbg_request.request_name)
+        if chunk_size <= 0 or len(universe_list) <= chunk_size:
+            return [bbg_request]
+
+        chunk_count = math.ceil(len(universe_list) / chunk_size)
+        chunks: list[BloombergRequest] = []
+        for chunk_index in range(chunk_count):
+            child_id = str(uuid.uuid4())
+            identifier = f"{bbg_request.request_name}{child_id[:6]}"
+            payload = dict(bbg_request.request_payload)
+            payload["identifier"] = identifier
+            payload["title"] = f"{bbg_request.request_payload['title']} {chunk_index + 1}/{chunk_count}"
+            payload["universe"] = dict(bbg_request.request_payload["universe"])
+            payload["universe"]["contains"] = universe_list[chunk_index * chunk_size:(chunk_index + 1) * chunk_size]
+
+            chunks.append(BloombergRequest(
+                request_id=child_id,
+                request_type=bbg_request.request_type,
+                request_cmd=bbg_request.request_cmd,
+                identifier=identifier,
+                request_name=bbg_request.request_name,
+                request_payload=payload,
+                priority=bbg_request.priority,
+                max_retries=bbg_request.max_retries,
+                parent_request_id=bbg_request.request_id,
+                chunk_index=chunk_index,
+                chunk_count=chunk_count,
+            ))
+
+        bbg_request.chunk_count = chunk_count
+        logger.info(f"Request {bbg_request.request_id} split into {chunk_count} chunks of {chunk_size}")
+        return chunks
+
+    def _dispatch_request(self, bbg_request: BloombergRequest, queue_member) -> None:
+        """Run the request now or hand it to the submit pool"""
+        chunks = self._chunk_request(bbg_request)
+        if len(chunks) > 1:
+            # parent is never sent, the poller completes it once every chunk is in
+            self.db_connection.save_bbg_request(bbg_request, title=bbg_request.request_payload['title'],
+                                                status='processing')
+            # chunks go on the queue as entries of their own before the parent is acked so a
+            # restart cannot lose them
+            self.redis_connection.queue_requests(chunks)
+            self.redis_connection.remove_request(queue_member)
+        elif self.submit_pool is None:
+            self._process_single_request(bbg_request)
+            if queue_member is not None:
+                self.redis_connection.remove_request(queue_member)
+        else:
+            with self.name_semaphore_lock:
+                self.name_in_flight[bbg_request.request_name] += 1
+                if queue_member is not None:
+                    self.leased_members.add(queue_member)
+            future = self.submit_pool.submit(self._submit_in_pool, bbg_request, queue_member)
+            self.pending_submits.add(future)
+
     def _handle_request_failure(
-        self, request_data: BloombergRequest, error_message: str
+        self, request_data: BloombergRequest, error_message: str, db_connection: BloombergDatabase = None
     ):
-        """Handle failed request with retry logic"""
+        """Handle failed request with retry logic - retries go on the redis retry queue, no sleeping"""
+        db_connection = db_connection or self.db_connection
         request_id = request_data.request_id
-        retry_count = request_data["retry_count"]
-        max_retries = request_data["max_retries"]
+        request_def: dict[str, Any] = self.request_definitions.get(request_data.request_name, {})
+        retry_count = request_data.retry_count
+        max_retries = request_def.get("max_request_retries", request_data.max_retries)
+        retry_wait_sec = request_def.get("retry_wait_sec", BloombergRequestSender.DEFAULT_RETRY_WAIT_SEC)
 
         if retry_count < max_retries:
             # Retry the request
-            request_data["retry_count"] = retry_count + 1
-            request_data["priority"] = (
-                request_data.get("priority", 1) + 1
-            )  # Lower priority for retries
+            request_data.retry_count = retry_count + 1
+            request_data.priority = min(
+                request_data.priority + 1, LOWEST_REQUEST_PRIORITY
+            )  # Lower priority for retries - but stay ahead of the exit cmds
 
-            # Re-queue with delay
-            time.sleep(2 * retry_count)
+            # Re-queue with delay, backs off with each retry
+            delay_sec = retry_wait_sec * request_data.retry_count
+            self.redis_connection.schedule_retry(request_data, delay_sec)
+            db_connection.set_request_retry(request_id, request_data.retry_count)
 
             logger.info(
-                f"Request {request_id} queued for retry {retry_count + 1}/{max_retries}"
+                f"Request {request_id} queued for retry {retry_count + 1}/{max_retries} in {delay_sec}s"
             )
         else:
             # Mark as failed
-            self.db_connection.set_request_failed(request_id)
-            self.db_connection.store_error_response(request_id, error_message)
+            db_connection.set_request_failed(request_id)
+            db_connection.store_error_response(request_id, error_message)
 
             logger.error(
                 f"Request {request_id} failed permanently after {max_retries} retries"
@@ -125,7 +357,8 @@ class BloombergRequestSender:
 
     ## *******************************************************************
 
-    def _process_single_request(self, request_data: BloombergRequest):
+    def _process_single_request(self, request_data: BloombergRequest, db_connection: BloombergDatabase = None):
+        db_connection = db_connection or self.db_connection
         try:
             request_id = request_data.request_id
         except Exception as e:
@@ -133,13 +366,13 @@ class BloombergRequestSender:
 
         try:
             # Update status in database
-            self.db_connection.save_bbg_request(request_data, title=request_data.request_payload['title'], status='processing')
+            db_connection.save_bbg_request(request_data, title=request_data.request_payload['title'], status='processing')
 
             # Submit request to Bloomberg
             response = self.bbg_connection.submit_to_bloomberg(request_data)
             if response.status_code == 200 or response.status_code == 201:
                 # Request submitted successfully
-                self.db_connection.set_request_submitted(request_id)
+                db_connection.set_request_submitted(request_id)
 
                 logger.info(f"Request {request_id} submitted successfully to Bloomberg")
             else:
@@ -147,14 +380,65 @@ class BloombergRequestSender:
                 error_msg = f"Bloomberg submission failed: {response.status_code} - {response.text}"
                 logger.error(f"Request {request_id}: {error_msg}")
                 logger.debug(response)
-                self._handle_request_failure(request_data, error_msg)
+                self._handle_request_failure(request_data, error_msg, db_connection)
 
         except Exception as e:
             logger.error(f"Error processing request {request_id}: {e}")
-            self._handle_request_failure(request_data, str(e))
+            self._handle_request_failure(request_data, str(e), db_connection)
 
     ## *****************************************************
 
+    def _idle_wait_time(self) -> int:
+        """Block no longer than it takes for the next retry to come due"""
+        wait_time = BloombergRequestSender.MAX_WAIT_TIME
+        retry_due = self.redis_connection.next_retry_due()
+        if retry_due is not None:
+            wait_time = min(wait_time, max(1, math.ceil(retry_due)))
+        return wait_time
+
+    def _control_set_state(self, run_state: RunState) -> dict[str, Any]:
+        """Control thread - the main loop switches state at the top of its next pass"""
+        self.control_state = run_state
+        self.control_event.set()
+        self.redis_connection.wake_workers("control")
+        return {"state": run_state.name}
+
+    def _control_clear_queues(self, message: dict[str, Any]) -> dict[str, Any]:
+        self.redis_connection.clear_queue()
+        return {"cleared": self.redis_connection.queue}
+
+    def _control_reload_defs(self, message: dict[str, Any]) -> dict[str, Any]:
+        self.reload_defs = True
+        self.control_event.set()
+        self.redis_connection.wake_workers("control")
+        return {"reload_defs": True}
+
+    def _control_status(self, message: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "state": self.run_state.name,
+            "queue": self.redis_connection.queue,
+            "pending_submits": len(self.pending_submits),
+            "max_workers": self.max_workers,
+            "request_definitions": len(self.request_definitions),
+            "lanes": self.redis_connection.lane_stats(),
+        }
+
+    def _apply_control(self, RunningState: RunState) -> RunState:
+        """Pick up whatever came in on the control channel since the last pass"""
+        self.control_event.clear()
+        if self.reload_defs:
+            self.reload_defs = False
+            self.request_definitions = self.db_connection.get_request_definitions()
+            self.data_def = BloombergDataDef(self.db_connection)
+            logger.info(f"Reloaded {len(self.request_definitions)} request definitions")
+
+        control_state, self.control_state = self.control_state, None
+        if control_state is not None:
+            logger.info(f"{RunningState.name} -> {control_state.name} from the control channel")
+            RunningState = control_state
+        self.run_state = RunningState
+        return RunningState
+
     def _continue_processing(self, RunningState, count: int):
         if RunningState == RunState.CMD_DIE or RunningState == RunState.ERROR_DIE:
             return False
@@ -169,18 +453,33 @@ class BloombergRequestSender:
         count = 0
         sleep_time = BloombergRequestSender.MIN_WAIT_TIME
         RunningState = RunState.RUNNING
-        max_items = 1
+        if self.control_listener is not None:
+            self.control_listener.start()
 
         try:
           while self._continue_processing(RunningState, count):
             try:
                 # Get highest priority request
                 count += 1
+                RunningState = self._apply_control(RunningState)
+                if RunningState == RunState.CMD_DIE:
+                    break
                 if (RunningState == RunState.RESUMING):
                     RunningState = RunState.RUNNING
 
                 ## need to change the low and hi values to remove if paused.    
-                requests_data = self.redis_connection.get_request(max_items)
+                # claim not peek so N senders never submit the same request
+                self._renew_leases()
+                self.redis_connection.reclaim_expired_requests()
+                self._fail_dead_letters()
+                self.redis_connection.promote_due_retries()
+                self.redis_connection.age_lanes()
+                self._log_lane_stats()
+                max_items = self._free_submit_slots()
+                if RunningState == RunState.PAUSED:
+                    # nothing is submitted, look further down the queue for a queued RESUME / EXIT
+                    max_items = max(max_items, BloombergRequestSender.PAUSED_SCAN_ITEMS)
+                requests_data = self.redis_connection.claim_request(max_items, lane_caps=self._lane_caps())
                 if (logger.getEffectiveLevel() <= logging.DEBUG):
                     logger.debug(f"Looping...{sleep_time}")
                     if (not requests_data):
@@ -188,8 +487,12 @@ class BloombergRequestSender:
                     else:
                         logger.debug(f"got {requests_data}")
 
-                if not requests_data:
-                    time.sleep(sleep_time)
+                if not requests_data and self.wait_mode == BloombergRequestSender.WAIT_MODE_BLOCK:
+                    # wakes on enqueue, the timeout is just so we still reclaim leases and promote retries
+                    self.redis_connection.wait_for_request(self._idle_wait_time())
+                    continue
+                elif not requests_data:
+                    self.control_event.wait(sleep_time)
                     new_sleep_time = sleep_time * 2
                     new_sleep_time = (
                         BloombergRequestSender.MAX_WAIT_TIME if (new_sleep_time > BloombergRequestSender.MAX_WAIT_TIME) else new_sleep_time
@@ -200,30 +503,41 @@ class BloombergRequestSender:
                 else:
                     sleep_time = BloombergRequestSender.MIN_WAIT_TIME
 
-                for request_data in requests_data:
+                # members are request ids, the payloads come back in one round trip
+                request_dicts = self.redis_connection.load_requests([member for member, _ in requests_data])
+                for idx, request_data in enumerate(requests_data):
                     logger.debug(f"request from q {request_data}")
-                    orig_request_json, priority = request_data
-                    request_dict: dict[str, Any] = json.loads(orig_request_json)
+                    queue_member, priority = request_data
+                    request_dict: dict[str, Any] = request_dicts[idx]
+                    if request_dict is None:
+                        logger.warning(f"Payload for queued request {queue_member} has expired - dropped")
+                        self.redis_connection.remove_request(queue_member)
+                        continue
                     cmd : str = request_dict['request_cmd'] if request_dict['request_cmd'] is not None else ""
                     cmd_upper = cmd.upper()
 
                     if cmd_upper == EXIT_CMD:
                         RunningState = RunState.CMD_DIE
-                        self.redis_connection.remove_request(orig_request_json)
+                        self.redis_connection.remove_request(queue_member)
                         # break the for loop...
                         break 
                     elif cmd_upper == PAUSE_CMD:
                         RunningState = RunState.PAUSED
                         # only read 
-                        self.redis_connection.remove_request(orig_request_json)
+                        self.redis_connection.remove_request(queue_member)
                         break
                     elif cmd_upper == RESUME_CMD:
                         RunningState = RunState.RESUMING
-                        self.redis_connection.remove_request(orig_request_json)
+                        self.redis_connection.remove_request(queue_member)
                         break
                     elif cmd_upper == CLR_QUEUES:
                         self.redis_connection.clear_queue()  # no need to remove request b/c its gone...
+                        requests_data = []  # nothing left to hand back either
                         break
+                    elif RunningState == RunState.PAUSED:
+                        # paused - data goes straight back, keep looking through the claim for commands
+                        self.redis_connection.release_request(queue_member, priority)
+                        continue
                     else:  # process data commands
                         bbg_request : BloombergRequest = None
 
@@ -235,20 +549,21 @@ class BloombergRequestSender:
                             bbg_request = self.create_mbs_cusip_request(request_id=request_dict['request_id'])  # self.submit_mbs_cusip_request()
                         else: # otherwise we try to use the json here to do something
                             # this is now wokinh
-                            if (orig_request_json):
-                                request_dict: dict[str, Any] = json.loads(orig_request_json)
+                            bbg_request = BloombergRequest.create_from_dict(request_dict)
 
                         if (bbg_request):
-                            self._process_single_request(bbg_request)
-                            self.redis_connection.remove_request(orig_request_json)
-                        elif orig_request_json:
-                            bbg_request = BloombergRequest.create_from_json(orig_request_json)
-                            self._process_single_request(bbg_request)
-                            self.redis_connection.remove_request(orig_request_json)
+                            self._dispatch_request(bbg_request, queue_member)
                         else:
                             logger.info(f"On command {requests_data} no json was generated")
                             time.sleep(sleep_time)  # IDK about these sleeps
 
+                # anything claimed but not looked at after a cmd break goes back
+                for unhandled_member, unhandled_priority in requests_data[idx + 1:]:
+                    self.redis_connection.release_request(unhandled_member, unhandled_priority)
+                if RunningState == RunState.PAUSED:
+                    # RESUME / EXIT on the control channel cut this short
+                    self.control_event.wait(self._idle_wait_time())
+
             except Exception as e:
                 logger.error(f"Error in request processing loop: {e}")
                 time.sleep(sleep_time)
@@ -524,6 +839,13 @@ class BloombergRequestSender:
 
     def close(self):
         try:
+            if self.control_listener is not None:
+                self.control_listener.stop()
+            if self.submit_pool is not None:
+                # let in flight submits finish before pulling the connections
+                self.submit_pool.shutdown(wait=True)
+            for thread_db in self._thread_db_connections:
+                thread_db.close()
             self.redis_connection.close()
             self.bbg_connection.close()
             self.db_connection.close()
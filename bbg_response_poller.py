@@ -5,6 +5,10 @@ import os
 import orjson
 import logging
 import sys
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import uuid
 
 from ASL.utils.asl_logging import ASL_Logging
 from datetime import datetime
@@ -12,9 +16,15 @@ from typing import Any, Callable
 
 from bbg_request import BloombergRequest
 from bbg_rest_connection import BloombergRestConnection
+from bbg_poll_schedule import BloombergPollSchedule
+from bbg_token_broker import token_broker_from_env
 from bbg_database import BloombergDatabase
+from bbg_db_writer import BloombergDBWriter
 from bbg_redis import BloombergRedis
-from bbg_send_cmds import EXIT_CMD
+from bbg_redis_streams import redis_queue_from_env
+from bbg_send_cmds import EXIT_CMD, PAUSE_CMD, RESUME_CMD, CLR_QUEUES, RELOAD_DEFS, STATUS_CMD
+from bbg_control import control_listener_from_env, ROLE_POLLER
+from bbg_sse_client import BloombergSSEClient, SSEEvent
 from run_state import RunState
 
 # Attach logging
@@ -25,6 +35,11 @@ def _content_type_match(content_type, match_str):
 
 
 class BloombergResponsePoller:
+    POLL_MODE_BATCH = "batch"    # 1 catalog listing per cycle matched against all pending
+    POLL_MODE_SINGLE = "single"  # 1 GET per submitted request
+    NOTIFY_MODE_POLL = "poll"    # sleep poll_interval between cycles
+    NOTIFY_MODE_SSE = "sse"      # wake on bloomberg push notifications, poll if the stream is down
+
     def __init__(
         self,
         run_til_complete = False,
@@ -59,16 +74,17 @@ class BloombergResponsePoller:
             server=db_server, port=db_port, database=_database
         )
 
+        # Redis connection
+        self.redis_connection = redis_queue_from_env(redis_host=redis_host, queue=BloombergRedis.RESPONSE_QUEUE)
+
         self.bbg_connection = BloombergRestConnection(
             self.db_connection,
             catalog=catalog,
             client_id=client_id,
             client_secret=client_secret,
+            token_broker=token_broker_from_env(self.redis_connection.get_client()),
         )
 
-        # Redis connection
-        self.redis_connection = BloombergRedis(redis_host=redis_host, queue=BloombergRedis.RESPONSE_QUEUE)
-
         # Processing state
         self.is_running = False
         ## these are in the defs below need to fix that
@@ -78,8 +94,63 @@ class BloombergResponsePoller:
         self.max_poll_attempts = (
             240  # Maximum polling attempts (1 hour at 15-second intervals)
         )
+        self.poll_mode = os.environ.get("BBG_POLL_MODE", BloombergResponsePoller.POLL_MODE_BATCH).lower()
+        self.keep_spool_files = os.environ.get("BBG_KEEP_SPOOL", "false").lower() == "true"
+
+        # per request poll times off the request defs and past turnaround, poll_interval is the longest sleep
+        self.poll_schedule = BloombergPollSchedule(
+            backoff_factor=float(os.environ.get("BBG_POLL_BACKOFF", 1.5)),
+            max_interval_sec=float(os.environ.get("BBG_POLL_MAX_INTERVAL_SEC", 300)),
+        )
+        self.turnaround_refresh_sec = int(os.environ.get("BBG_TURNAROUND_REFRESH_SEC", 900))
+        self.turnaround_loaded_at = 0.0
+        # a split request whose chunks never all made it into the db is failed after this long
+        self.chunk_orphan_sec = int(os.environ.get("BBG_CHUNK_ORPHAN_SEC", 4 * 3600))
+        self.notified = False
+
+        # submitted requests are leased in the db so several pollers can split them
+        self.poll_owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poll_lease_sec = int(os.environ.get("BBG_POLL_LEASE_SEC", 300))
+        self.poll_claim_batch = int(os.environ.get("BBG_POLL_CLAIM_BATCH", 500))
+        logger.info(f"Poller {self.poll_owner} lease {self.poll_lease_sec}s claim batch {self.poll_claim_batch}")
+
+        # push notifications - while the stream is up we only sweep every sse_sweep_interval
+        self.wake_event = threading.Event()
+        self.sse_sweep_interval = int(os.environ.get("BBG_SSE_SWEEP_SEC", 120))
+        self.sse_client = None
+        if os.environ.get("BBG_NOTIFY_MODE", BloombergResponsePoller.NOTIFY_MODE_POLL).lower() == BloombergResponsePoller.NOTIFY_MODE_SSE:
+            self.sse_client = BloombergSSEClient(
+                connect=self.bbg_connection.open_notification_stream,
+                on_event=self._handle_notification,
+            )
+        # concurrent listings / downloads - every db write from the workers goes through 1 writer thread
+        self.poll_workers = max(1, int(os.environ.get("BBG_POLL_WORKERS", 4)))
+        self.poll_pool = None
+        self.write_db = self.db_connection
+        if self.poll_workers > 1:
+            self.poll_pool = ThreadPoolExecutor(max_workers=self.poll_workers, thread_name_prefix="bbg_poll")
+            self.write_db = BloombergDBWriter(server=db_server, port=db_port, database=_database)
+            self.bbg_connection.set_db_connection(self.write_db)
+        logger.info(f"Poller using {self.poll_workers} workers")
+
         self.request_definitions = self.db_connection.get_request_definitions()
         self._register_default_handlers()
+        self.bbg_connection.register_completion_listener(self._queue_completion)
+        # completions seen during a batched cycle - published once their status is flushed
+        self.pending_completions: list[dict[str, Any]] = []
+        self.pending_completions_lock = threading.Lock()
+
+        # control channel - its thread only flips these and wakes the poll loop
+        self.paused = False
+        self.reload_defs = False
+        self.control_listener = control_listener_from_env(self.redis_connection.get_client(), ROLE_POLLER, {
+            EXIT_CMD: self._control_exit,
+            PAUSE_CMD: self._control_pause,
+            RESUME_CMD: self._control_resume,
+            CLR_QUEUES: self._control_clear_queues,
+            RELOAD_DEFS: self._control_reload_defs,
+            STATUS_CMD: self._control_status,
+        })
 
     def _get_response_content_type(self, response_payload : dict[str, Any]) -> str:
         """
@@ -154,18 +225,23 @@ class BloombergResponsePoller:
     def process_redis_requests(self, max_items : int = 1):
         requests_data : list[BloombergRequest] = self.redis_connection.get_request(max_items)
 
-        for request_data in requests_data:
-            orig_request_json, priority = request_data
-            request_dict: dict[str, Any] = json.loads(orig_request_json)
+        request_dicts = self.redis_connection.load_requests([member for member, _ in requests_data])
+        for (queue_member, priority), request_dict in zip(requests_data, request_dicts):
+            if request_dict is None:
+                self.redis_connection.remove_request(queue_member)
+                continue
             cmd : str = request_dict['request_cmd'] if request_dict['request_cmd'] is not None else ""
             cmd = cmd.upper()
 
             if cmd == EXIT_CMD:
                 RunningState = RunState.CMD_DIE
                 self.is_running = False
-                self.redis_connection.remove_request(orig_request_json)
+                self.redis_connection.remove_request(queue_member)
                 # break the for loop...
                 break 
+            else:
+                # not ours - left on the queue (a stream entry is claimed so it has to go back)
+                self.redis_connection.release_request(queue_member, priority)
 
     # run til complete once all pending are resolved exit..
     def start_polling(self, until_complete : bool = False):
@@ -174,14 +250,27 @@ class BloombergResponsePoller:
         logger.info("Starting Bloomberg response polling...")
 
         try:
+            if self.sse_client is not None:
+                self.sse_client.start()
+            if self.control_listener is not None:
+                self.control_listener.start()
+
             while self.is_running:
+                if self.paused:
+                    # RESUME / EXIT set the wake event
+                    self.wake_event.wait(self.poll_interval)
+                    self.wake_event.clear()
+                    continue
+                # a notification means something finished - look at everything not just what is due
+                self.notified = self.wake_event.is_set()
+                self.wake_event.clear()
                 cnt = self._poll_bbg_existing_requests()
 
                 if ((cnt == 0)and(self.run_til_complete)):
                     self.is_running = False
 
                 if (self.is_running):
-                    time.sleep(self.poll_interval)
+                    self._wait_for_next_cycle()
 
         except KeyboardInterrupt:
             logger.info("Polling interrupted by user")
@@ -190,6 +279,55 @@ class BloombergResponsePoller:
         finally:
             self.close()
 
+    def _handle_notification(self, event: SSEEvent):
+        """Runs on the sse thread - just wakes the poll loop, all the work stays on the main thread"""
+        if not event.data:
+            return
+        logger.info(f"Notification {event.event} id {event.id}")
+        logger.debug(event.data)
+        self.wake_event.set()
+
+    def _control_exit(self, message: dict[str, Any]) -> dict[str, Any]:
+        self.is_running = False
+        self.wake_event.set()
+        return {"running": False}
+
+    def _control_pause(self, message: dict[str, Any]) -> dict[str, Any]:
+        self.paused = True
+        return {"paused": True}
+
+    def _control_resume(self, message: dict[str, Any]) -> dict[str, Any]:
+        # wakes straight into a full cycle to catch up on anything that finished while paused
+        self.paused = False
+        self.wake_event.set()
+        return {"paused": False}
+
+    def _control_clear_queues(self, message: dict[str, Any]) -> dict[str, Any]:
+        self.redis_connection.clear_queue()
+        return {"cleared": self.redis_connection.queue}
+
+    def _control_reload_defs(self, message: dict[str, Any]) -> dict[str, Any]:
+        self.reload_defs = True
+        return {"reload_defs": True}
+
+    def _control_status(self, message: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "running": self.is_running,
+            "paused": self.paused,
+            "poll_owner": self.poll_owner,
+            "scheduled": len(self.poll_schedule.requests),
+            "poll_workers": self.poll_workers,
+        }
+
+    def _wait_for_next_cycle(self):
+        wait_time = self.poll_interval
+        if self.sse_client is not None and self.sse_client.connected.is_set():
+            wait_time = self.sse_sweep_interval  # stream will wake us, this is just a safety sweep
+        next_due = self.poll_schedule.next_due_in()
+        if next_due is not None:
+            wait_time = max(1, min(wait_time, next_due))
+        self.wake_event.wait(wait_time)
+
     def stop_polling(self):
         """Stop the response polling loop"""
         self.is_running = False
@@ -197,6 +335,14 @@ class BloombergResponsePoller:
 
     def close(self):
         try:
+            if self.control_listener is not None:
+                self.control_listener.stop()
+            if self.sse_client is not None:
+                self.sse_client.stop()
+            if self.poll_pool is not None:
+                self.poll_pool.shutdown(wait=True)
+                self.write_db.close()
+            self.db_connection.release_poll_requests(self.poll_owner)
             self.redis_connection.close()
             self.bbg_connection.close()
             self.db_connection.close()
@@ -206,34 +352,157 @@ class BloombergResponsePoller:
     def _poll_bbg_existing_requests(self) -> int:
         """Poll existing requests for responses"""
         try:
-            # Get all active polling requests
-            active_requests = self.db_connection.get_sumbitted_requests()
-
-            for request in active_requests:
-                self.bbg_connection.poll_single_request(request)
-                
+            if self.reload_defs:
+                self.reload_defs = False
+                self.request_definitions = self.db_connection.get_request_definitions()
+                self.turnaround_loaded_at = 0.0
+                logger.info(f"Reloaded {len(self.request_definitions)} request definitions")
+            # Renew our leases, pick up unowned / abandoned work, then poll just what we hold
+            self.db_connection.claim_poll_requests(self.poll_owner, self.poll_lease_sec, self.poll_claim_batch)
+            active_requests = self.db_connection.get_sumbitted_requests(poll_owner=self.poll_owner)
+            self._refresh_turnaround()
+            self.poll_schedule.sync(active_requests)
+            self._expire_requests()
+
+            due_requests = self.poll_schedule.due()
+            if self.notified:
+                due_requests = list(self.poll_schedule.requests.values())
+            logger.info(f"{len(due_requests)} of {len(active_requests)} submitted requests due for a poll")
+
+            start_time = time.perf_counter()
+            # poll counts and completions for the cycle go in as 1 transaction at the end
+            self.write_db.begin_status_batch()
+            try:
+                self._poll_due_requests(due_requests)
+            finally:
+                self.write_db.flush_status_batch()
+                self._publish_pending_completions()
+            if due_requests:
+                logger.info(f"Poll cycle for {len(due_requests)} requests took {time.perf_counter() - start_time:.3f}s")
+
+            self._complete_chunked_requests()
             self.process_redis_requests(1)  # exit command and more later.
             return len(active_requests)
         except Exception as e:
             logger.error(f"Error polling existing requests: {e}")
+
+    def _poll_due_requests(self, due_requests: list[dict[str, Any]]):
+        """Poll the due requests - listing / downloads on the pool if there is one"""
+        polled = not due_requests
+        try:
+            if due_requests and self.poll_mode == BloombergResponsePoller.POLL_MODE_BATCH:
+                # the listing is 1 call either way so match it against everything, only the due ones count as polled
+                polled = self.bbg_connection.poll_requests_batch(
+                    list(self.poll_schedule.requests.values()),
+                    polled_ids=[request["request_id"] for request in due_requests],
+                    executor=self.poll_pool)
+                if not polled:
+                    logger.warning("Batch listing failed - polling requests one at a time")
+
+            if not polled:
+                if self.poll_pool is None:
+                    for request in due_requests:
+                        self.bbg_connection.poll_single_request(request)
+                else:
+                    wait([self.poll_pool.submit(self.bbg_connection.poll_single_request, request)
+                          for request in due_requests])
+        finally:
+            # due() took them off the heap - put them back even if the poll blew up or they are never looked at again
+            for request in due_requests:
+                self.poll_schedule.polled(request)  # completed ones drop out on the next sync
+
+    def _refresh_turnaround(self):
+        """Reload the average turnaround per request name every turnaround_refresh_sec"""
+        if time.time() - self.turnaround_loaded_at < self.turnaround_refresh_sec:
+            return
+        self.poll_schedule.set_turnaround(self.db_connection.get_turnaround_seconds())
+        self.turnaround_loaded_at = time.time()
+
+    def _expire_requests(self):
+        """Give up on requests that have used up max_response_polls"""
+        expired = self.poll_schedule.expired()
+        if not expired:
+            return
+        for request in expired:
+            logger.error(f"Request {request['request_id']} {request['request_name']} not back after "
+                         f"{request['response_poll_count']} polls - expiring")
+        self.db_connection.set_requests_expired([request["request_id"] for request in expired])
+        for request in expired:
+            self.poll_schedule.forget(request["request_id"])
+
+    def _queue_completion(self, request: dict[str, Any]):
+        """Completion listener - the completed status is still in the batch so hold the wake up"""
+        with self.pending_completions_lock:
+            self.pending_completions.append(request)
+
+    def _publish_pending_completions(self):
+        with self.pending_completions_lock:
+            completed, self.pending_completions = self.pending_completions, []
+        for request in completed:
+            try:
+                self._publish_completion(request)
+            except Exception as e:
+                logger.error(f"Error publishing completion for {request['request_id']}: {e}")
+
+    def _publish_completion(self, request: dict[str, Any]):
+        """Wake the outputter daemon - chunks are not output on their own so skip them"""
+        if request.get("parent_request_id"):
+            return
+        self.redis_connection.publish_completion(request["request_id"])
+
+    def _complete_chunked_requests(self):
+        """Once every chunk of a split request is in merge them under the parent and complete it"""
+        for parent in self.db_connection.get_chunked_parents(poll_owner=self.poll_owner):
+            request_id = parent['request_id']
+            try:
+                if parent['failed_count'] > 0:
+                    logger.error(f"Chunked request {request_id} has {parent['failed_count']} failed chunks")
+                    self.db_connection.set_request_failed(request_id)
+                elif (parent['saved_count'] or 0) < parent['chunk_count'] and (parent['idle_sec'] or 0) > self.chunk_orphan_sec:
+                    logger.error(f"Chunked request {request_id} only has {parent['saved_count']} of "
+                                 f"{parent['chunk_count']} chunks after {parent['idle_sec']}s - giving up")
+                    self.db_connection.set_request_failed(request_id)
+                elif parent['completed_count'] >= parent['chunk_count']:
+                    if self.db_connection.merge_chunk_data(request_id, parent['identifier'],
+                                                           parent['request_name'], parent['chunk_count']):
+                        self.db_connection.set_request_completed(request_id)
+                        self._publish_completion(parent)
+                        logger.info(f"All {parent['chunk_count']} chunks in for request {request_id}")
+                    else:
+                        self.db_connection.set_request_failed(request_id)
+            except Exception as e:
+                logger.error(f"Error completing chunked request {request_id}: {e}")
          
     
     def _handle_csv_response(self, response_payload: dict[str, Any]):
         """Handle CSV data responses"""
+        spool_info = None
         try:
             key : str = response_payload["key"]
             request_id : str = response_payload["request_id"]
             identifier : str = response_payload["identifier"]
             request_name : str = response_payload["request_name"]
-            csv_data = self.bbg_connection.download_response_content(key)
+            spool_info = self.bbg_connection.download_response_to_file(key, file_name=f"{request_id}_{key}")
+            if spool_info is None:
+                raise IOError(f"Unable to download {key}")
 
-            # Store CSV data in database
-            self.db_connection.store_csv_data(request_id=request_id, identifier=identifier, request_name=request_name, csv_data=csv_data)
+            # Store CSV data in database - streamed in from the spool file
+            self.write_db.store_csv_file(request_id=request_id, identifier=identifier,
+                                              request_name=request_name, csv_path=spool_info["path"],
+                                              content_hash=spool_info["sha256"])
 
             logger.info(f"CSV response processed for request {request_id}")
 
         except Exception as e:
             logger.error(f"Error handling CSV response: {e}")
+            raise  # the request is not completed until its data is stored
+        finally:
+            # a failed store downloads again on the next poll, so the spool file never outlives this call
+            if spool_info is not None and not self.keep_spool_files and os.path.exists(spool_info["path"]):
+                try:
+                    os.remove(spool_info["path"])
+                except OSError as e:
+                    logger.warning(f"Unable to remove spool file {spool_info['path']}: {e}")
 
     def _handle_json_response(self, response: dict[str, Any]):
         """Handle JSON data responses"""
@@ -243,7 +512,7 @@ class BloombergResponsePoller:
             request_id = response.get("request_id")
 
             # Store JSON data in database
-            self.db_connection.store_json_data(request_id, identifier, json_data)
+            self.write_db.store_json_data(request_id, identifier, json_data)
 
             logger.info(f"JSON response processed for request {request_id}")
 
@@ -258,7 +527,7 @@ class BloombergResponsePoller:
             status_code = response.get("status_code", 500)
 
             # Store error in database
-            self.db_connection.store_poll_error_response(
+            self.write_db.store_poll_error_response(
                 request_id, error_message, status_code
             )
 
@@ -279,7 +548,7 @@ class BloombergResponsePoller:
             
 
             # Store raw response data
-            self.db_connection.store_raw_response(request_id=request_id, 
+            self.write_db.store_raw_response(request_id=request_id, 
                                                   identifier=identifier, request_name=request_name,
                                                   response_data=response_data)
 
@@ -294,7 +563,7 @@ class BloombergResponsePoller:
         """Handle polling errors"""
         try:
             # Update polling status
-            self.db_connection.update_request_status(request_id, "error")
+            self.write_db.update_request_status(request_id, "error")
 
             # Create error response
             error_payload = {
@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from typing import Any, IO, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BloombergResponseStore:
+    """
+    Downloaded responses kept on disk by sha256 of their content instead of in bloomberg_data.
+    Files are fanned out as ab/cd/<hash>.csv[.gz] under root so no directory gets huge, and a
+    snapshot that comes back identical is only stored once.  bloomberg_data keeps the hash,
+    size and the path relative to root.
+    """
+    COPY_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, root: str, compress: bool = True, compress_level: int = 6):
+        """
+        Args:
+            root: local or shared directory every poller and outputter can see
+            compress: gzip the stored files
+            compress_level: gzip level
+        """
+        self.root = root
+        self.compress = compress
+        self.compress_level = compress_level
+        os.makedirs(self.root, exist_ok=True)
+
+    def _relative_path(self, content_hash: str) -> str:
+        suffix = ".csv.gz" if self.compress else ".csv"
+        return os.path.join(content_hash[:2], content_hash[2:4], content_hash + suffix)
+
+    def full_path(self, relative_path: str) -> str:
+        return os.path.join(self.root, relative_path)
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(BloombergResponseStore.COPY_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def put_file(self, src_path: str, content_hash: str = None) -> dict[str, Any]:
+        """
+        Copy src_path into the store - a no op if the same content is already there.
+        Args:
+            src_path: file to store, left where it is
+            content_hash: sha256 of the file if the caller already has it
+        Returns:
+            dict with hash, size (uncompressed bytes) and path relative to root
+        """
+        content_hash = content_hash or BloombergResponseStore.hash_file(src_path)
+        size = os.path.getsize(src_path)
+        relative_path = self._relative_path(content_hash)
+        dest_path = self.full_path(relative_path)
+
+        if os.path.exists(dest_path):
+            logger.info(f"Response {content_hash} already stored - {size} bytes not written again")
+            return {"hash": content_hash, "size": size, "path": relative_path}
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        # write next to the target then rename so readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix=".tmp")
+        try:
+            with open(src_path, "rb") as src, os.fdopen(fd, "wb") as raw:
+                if self.compress:
+                    with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.compress_level) as dest:
+                        shutil.copyfileobj(src, dest, BloombergResponseStore.COPY_CHUNK_SIZE)
+                else:
+                    shutil.copyfileobj(src, raw, BloombergResponseStore.COPY_CHUNK_SIZE)
+            os.replace(tmp_path, dest_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        logger.info(f"Stored response {content_hash} {size} bytes as {os.path.getsize(dest_path)} at {relative_path}")
+        return {"hash": content_hash, "size": size, "path": relative_path}
+
+    def open_text(self, relative_path: str) -> IO[str]:
+        """Stream a stored response as text"""
+        path = self.full_path(relative_path)
+        if path.endswith(".gz"):
+            return gzip.open(path, "rt", encoding="utf-8", newline="")
+        return open(path, "r", encoding="utf-8", newline="")
+
+
+def response_store_from_env() -> Optional[BloombergResponseStore]:
+    """BBG_RESPONSE_STORE_DIR turns the store on, blank keeps responses in bloomberg_data.data_content"""
+    root = os.environ.get("BBG_RESPONSE_STORE_DIR", "")
+    if not root:
+        return None
+    compress = os.environ.get("BBG_RESPONSE_STORE_COMPRESS", "true").lower() == "true"
+    return BloombergResponseStore(root, compress=compress)
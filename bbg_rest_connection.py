@@ -1,21 +1,36 @@
+from concurrent.futures import Executor, wait
 from datetime import datetime
+import gzip
+import hashlib
+import json
 import os
+import re
 import logging
-from typing import Any, Callable, Optional
+import threading
+from typing import Any, Callable, Iterable, Iterator, Optional
 from urllib.parse import urljoin
 import uuid
+import zlib
 
 import ASL.utils.secrets
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import BackendApplicationClient
 from bbg_database import BloombergDatabase
+from bbg_http_transport import BloombergTransport
 from bbg_request import BloombergRequest
+from bbg_token_broker import BloombergTokenBroker
 from response_handler import ResponseHandler
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_BBG_HOST = "https://api.bloomberg.com"
 DEFAULT_OAUTH2_ENDPOINT = "https://bsso.blpprofessional.com/ext/api/as/token.oauth2"
+DEFAULT_SSE_PATH = "/eap/notifications/sse"
+SSE_READ_TIMEOUT = 90  # server heartbeats well inside this - longer means the stream is dead
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+GZIP_MIN_BYTES = 8 * 1024  # smaller payloads are not worth compressing
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_CONTENT_TYPES = ("application/gzip", "application/x-gzip")
 
 def get_obj_dict(obj):
     return obj.__dict__
@@ -34,11 +49,15 @@ class BloombergRestConnection:
                 auto_refresh_kwargs={"client_id": self.client_id},
                 token_updater=self._token_updater,
             )
+            self.transport.mount(self.session)
+            # requests undoes Content-Encoding: gzip transparently, .gz files are handled on download
+            self.session.headers["Accept-Encoding"] = "gzip, deflate"
 
-            # Fetch initial token
-            token = self.session.fetch_token(
-                token_url=self.OAUTH2_ENDPOINT, client_secret=self.client_secret
-            )
+            # Fetch initial token - from the shared cache if another process has one
+            if self.token_broker is not None:
+                self.session.token = self.token_broker.get_token(self._fetch_new_token)
+            else:
+                token = self._fetch_new_token()
 
             logger.info("OAuth2 session initialized successfully")
 
@@ -46,20 +65,44 @@ class BloombergRestConnection:
             logger.error(f"Failed to initialize OAuth2 session: {e}")
             raise
 
+    def _fetch_new_token(self) -> dict[str, Any]:
+        """Go to BSSO for a new client credentials token"""
+        return self.session.fetch_token(
+            token_url=self.OAUTH2_ENDPOINT, client_secret=self.client_secret
+        )
+
+    def _ensure_token(self):
+        """Swap in the shared token before it expires - a no op without a token broker"""
+        if self.token_broker is None:
+            return
+        with self.token_lock:
+            token = self.token_broker.get_token(self._fetch_new_token)
+            if token is not self.session.token:
+                self.session.token = token
+
     def _refresh_oauth_token(self):
         """Refresh OAuth2 token"""
-        try:
-            token = self.session.refresh_token(
-                self.OAUTH2_ENDPOINT,
-                client_id=self.client_id,
-                client_secret=self.client_secret,
-            )
-            logger.info("OAuth2 token refreshed successfully")
+        # the session is shared by the sender submit pool so only 1 thread refreshes
+        with self.token_lock:
+            if self.token_broker is not None:
+                # the shared token was rejected - drop it so every process gets the new one
+                self.token_broker.invalidate(self.session.token)
+                self.session.token = self.token_broker.get_token(self._fetch_new_token)
+                logger.info("OAuth2 token refreshed successfully")
+                return
 
-        except Exception as e:
-            logger.error(f"Failed to refresh OAuth2 token: {e}")
-            # Re-initialize session if refresh fails
-            self._initialize_oauth_session()
+            try:
+                token = self.session.refresh_token(
+                    self.OAUTH2_ENDPOINT,
+                    client_id=self.client_id,
+                    client_secret=self.client_secret,
+                )
+                logger.info("OAuth2 token refreshed successfully")
+
+            except Exception as e:
+                logger.error(f"Failed to refresh OAuth2 token: {e}")
+                # Re-initialize session if refresh fails
+                self._initialize_oauth_session()
 
     def __init__(
         self,
@@ -67,6 +110,7 @@ class BloombergRestConnection:
         catalog=None,
         client_id=None,
         client_secret=None,
+        token_broker: Optional[BloombergTokenBroker] = None,
     ):
         """
         Initialize the Bloomberg Rest connection for either direction...
@@ -76,6 +120,7 @@ class BloombergRestConnection:
             catalog: Bloomberg Data License Account Number
             client_id: Bloomberg OAuth2 client ID
             client_secret: Bloomberg OAuth2 client secret
+            token_broker: shares the OAuth2 token with the other processes, None for a private token
         """
         self.catalog = catalog or os.environ.get("BLOOMBERG_DL_ACCOUNT_NUMBER", "")
         self.client_id = client_id or ASL.utils.secrets.my_secrets["BBG_REST_API_KEY"]
@@ -88,6 +133,9 @@ class BloombergRestConnection:
                 "Bloomberg credentials not provided. Set environment variables or pass parameters."
             )
 
+        self.token_lock = threading.RLock()
+        self.token_broker = token_broker
+        self.transport = BloombergTransport()
         self._initialize_oauth_session()
         # for saving calls made...
         self.db_connection = _db_connection
@@ -95,7 +143,13 @@ class BloombergRestConnection:
         self.request_response_base = f"/eap/catalogs/{self.catalog}"
         self.doc_request_base = f""
         self.poll_response_base = f"/eap/catalogs/{self.catalog}/content/responses/?requestIdentifier="
+        self.list_response_base = f"/eap/catalogs/{self.catalog}/content/responses/"
+        self.sse_uri = os.environ.get("BBG_SSE_URL", "") or urljoin(self.bbg_host, DEFAULT_SSE_PATH)
+        self.spool_dir = os.environ.get("BBG_SPOOL_DIR", "./spool")
+        self.gzip_upload = os.environ.get("BBG_GZIP_UPLOAD", "true").lower() == "true"
+        self.gzip_level = int(os.environ.get("BBG_GZIP_LEVEL", 6))
         self.response_handlers: list[ResponseHandler] = []
+        self.completion_listeners: list[Callable[[dict[str, Any]], None]] = []
 
     def _token_updater(self, token):
         """Handle token updates"""
@@ -107,12 +161,18 @@ class BloombergRestConnection:
         self.db_connection = _db_connection
 
     def close(self) -> None:
+        self.transport.log_stats()
         self.session.close()
 
+    def _http(self, method: str, url: str, endpoint: str, **kwargs) -> Any:
+        """Every Bloomberg call goes through the transport for pooling, retries and latency counters"""
+        return self.transport.request(self.session, method, url, endpoint, **kwargs)
+
     def submit_to_bloomberg(self, bbg_request: BloombergRequest) -> Any:
         """Submit request to Bloomberg Data License API"""
         request_uri = urljoin(self.bbg_host, self.request_response_base) + "/requests/"
         logger.info(f"Submitting to Bloomberg: {request_uri}")
+        self._ensure_token()
 
         if (logger.getEffectiveLevel() == logging.DEBUG):
             try:
@@ -123,14 +183,49 @@ class BloombergRestConnection:
                 raise
 
         try:
-            response = self.session.post(
-                url=request_uri, json=bbg_request.request_payload, headers={'api-version': '2'})
+            body, headers = self._encode_payload(bbg_request.request_payload)
+            response = self._http("POST", request_uri, "submit", data=body, headers=headers)
+
+            if "Content-Encoding" in headers and response.status_code in (400, 415):
+                # api would not take the gzip body - send it plain and stop compressing if that works
+                logger.warning(f"Compressed submit rejected HTTP {response.status_code} - resending uncompressed")
+                response = self._http(
+                    "POST", request_uri, "submit", json=bbg_request.request_payload, headers={'api-version': '2'})
+                if response.status_code < 300:
+                    logger.warning("Disabling gzip uploads")
+                    self.gzip_upload = False
         except Exception as e:
             logger.error(f"Sending to bbg failed on session post {e}")
             raise
 
         return response
 
+    def _encode_payload(self, payload: Any) -> tuple[bytes, dict[str, str]]:
+        """JSON body and headers for a submit - gzipped when it is big enough to be worth it"""
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"api-version": "2", "Content-Type": "application/json"}
+        if self.gzip_upload and len(body) >= GZIP_MIN_BYTES:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level)
+            logger.info(f"Submit payload {len(body)} bytes gzipped to {len(compressed)}")
+            headers["Content-Encoding"] = "gzip"
+            return compressed, headers
+        return body, headers
+
+    def open_notification_stream(self, last_event_id: Optional[str] = None) -> Any:
+        """Open the server sent events notification stream, resuming after last_event_id"""
+        headers = {"Accept": "text/event-stream", "api-version": "2"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+
+        logger.info(f"Opening notification stream {self.sse_uri}")
+        self._ensure_token()
+        response = self._http("GET", self.sse_uri, "sse", headers=headers, stream=True,
+                              timeout=(self.transport.connect_timeout, SSE_READ_TIMEOUT))
+        if response.status_code == 401:
+            logger.warning("Authentication error on notification stream - attempting token refresh")
+            self._refresh_oauth_token()
+        return response
+
     ##
     ## Response side goes here
     ##
@@ -144,6 +239,18 @@ class BloombergRestConnection:
         self.response_handlers.append(ResponseHandler(name, condition, handler))
         logger.info(f"Registered response handler: {name}")
 
+    def register_completion_listener(self, listener: Callable[[dict[str, Any]], None]):
+        """listener(request) is called after a request is marked completed"""
+        self.completion_listeners.append(listener)
+
+    def _set_request_completed(self, request: dict[str, Any]):
+        self.db_connection.set_request_completed(request["request_id"])
+        for listener in self.completion_listeners:
+            try:
+                listener(request)
+            except Exception as e:
+                logger.error(f"Error in completion listener for {request['request_id']}: {e}")
+
     def _execute_response_handlers(self, response_payload: dict[str, Any]):
         """
         Executes the first registered response handler whose condition matches the given response payload.
@@ -156,7 +263,7 @@ class BloombergRestConnection:
             response_payload (dict[str, Any]): The response data to be processed by the handlers.
 
         Raises:
-            Logs any exceptions raised by handler execution but does not propagate them.
+            Logs and re-raises anything the handler raises so the request is not marked completed.
         """
 
         for handler in self.response_handlers:
@@ -167,6 +274,7 @@ class BloombergRestConnection:
                     break  # Only execute the first matching handler
             except Exception as e:
                 logger.error(f"Error in response handler {handler.name}: {e}")
+                raise
 
     def download_response_content(self, key: str) -> Optional[str]:
         """Download content from Bloomberg response URL"""
@@ -174,8 +282,11 @@ class BloombergRestConnection:
             data_uri = urljoin(
                 self.bbg_host, f"/eap/catalogs/{self.catalog}/content/responses/{key}"
             )
-            response = self.session.get(data_uri)
+            self._ensure_token()
+            response = self._http("GET", data_uri, "download")
             if response.status_code == 200:
+                if self._is_gzip_file(key, response) and response.content[:2] == GZIP_MAGIC:
+                    return gzip.decompress(response.content).decode(response.encoding or "utf-8")
                 return response.text
             else:
                 logger.error(
@@ -186,6 +297,99 @@ class BloombergRestConnection:
             logger.error(f"Error downloading content from {data_uri}: {e}")
             return None
 
+    def download_response_to_file(self, key: str, file_name: str = None) -> Optional[dict[str, Any]]:
+        """
+        Stream a response to a spool file chunk by chunk so memory stays at DOWNLOAD_CHUNK_SIZE
+        no matter how big the response is.  .gz responses are unzipped on the way through.
+
+        Returns:
+            dict with path, size and sha256 of the file or None if the download failed
+        """
+        data_uri = urljoin(
+            self.bbg_host, f"/eap/catalogs/{self.catalog}/content/responses/{key}"
+        )
+        # whatever we are given ends up a plain name inside spool_dir
+        file_name = re.sub(r'[^A-Za-z0-9_.-]', '_', file_name or key).lstrip(".") or "response"
+        if file_name.lower().endswith(".gz"):
+            file_name = file_name[:-3]
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spool_path = os.path.join(self.spool_dir, file_name)
+        part_path = spool_path + ".part"
+
+        try:
+            self._ensure_token()
+            with self._http("GET", data_uri, "download", stream=True) as response:
+                if response.status_code != 200:
+                    logger.error(
+                        f"Failed to download content from {data_uri}: HTTP {response.status_code}"
+                    )
+                    return None
+
+                chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                if self._is_gzip_file(key, response):
+                    chunks = BloombergRestConnection._gunzip_chunks(chunks)
+
+                sha256 = hashlib.sha256()
+                size = 0
+                with open(part_path, "wb") as f:
+                    for chunk in chunks:
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+                wire_size = response.raw.tell() if hasattr(response.raw, "tell") else size
+
+            os.replace(part_path, spool_path)
+            logger.info(f"Downloaded {key} to {spool_path} {size} bytes ({wire_size} on the wire) sha256 {sha256.hexdigest()}")
+            return {"path": spool_path, "size": size, "sha256": sha256.hexdigest()}
+        except Exception as e:
+            logger.error(f"Error downloading content from {data_uri}: {e}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return None
+
+    @staticmethod
+    def _is_gzip_file(key: str, response: Any) -> bool:
+        """The file itself is gzipped - as opposed to gzip transfer encoding which requests already undoes"""
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        return key.lower().endswith(".gz") or content_type in GZIP_CONTENT_TYPES
+
+    @staticmethod
+    def _gunzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Unzip a stream of chunks as they arrive.  Handles multi member files, passes plain data through.
+        Raises:
+            IOError: the stream stopped before the end of the last gzip member
+        """
+        decompressor = None
+        head = b""
+        for chunk in chunks:
+            if decompressor is None:
+                head += chunk
+                if len(head) < len(GZIP_MAGIC):
+                    continue
+                chunk, head = head, b""
+                if chunk[:2] != GZIP_MAGIC:
+                    # labelled .gz but not gzipped - hand it on untouched
+                    yield chunk
+                    yield from chunks
+                    return
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            while chunk:
+                if decompressor.eof:
+                    # next member of a multi member file
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                yield decompressor.decompress(chunk)
+                chunk = decompressor.unused_data if decompressor.eof else b""
+        if decompressor is not None:
+            yield decompressor.flush()
+            if not decompressor.eof:
+                raise IOError("gzip response ended part way through - download truncated")
+        elif head:
+            yield head
+
     def _process_bloomberg_response(
         self, request_id: str, identifier: str, request_name : str, responses: list[Any]
     ):
@@ -226,6 +430,7 @@ class BloombergRestConnection:
                 "status_code": 500,
                 "timestamp": datetime.now().isoformat(),
             }
+            raise
 
 
     def poll_single_request(self, request: BloombergRequest):
@@ -247,8 +452,9 @@ class BloombergRestConnection:
 
             # Make the polling request
             self.db_connection.update_response_poll(request_id)
-            response = self.session.get(
-                content_responses_uri, headers={"api-version": "2"}
+            self._ensure_token()
+            response = self._http(
+                "GET", content_responses_uri, "poll", headers={"api-version": "2"}
             )
 
             if response.status_code == 200:
@@ -261,7 +467,7 @@ class BloombergRestConnection:
                     logger.info(f"Response received for request {request_id}")
                     self._process_bloomberg_response(request_id=request_id, identifier=identifier, 
                                                      request_name=request_name, responses=responses)
-                    self.db_connection.set_request_completed(request_id)
+                    self._set_request_completed(request)
                 else:
                     logger.debug(
                         f"No response yet for request {request_id}, poll count: {poll_count + 1}"
@@ -290,3 +496,104 @@ class BloombergRestConnection:
 
         except Exception as e:
             logger.error(f"Error polling request {request_id}: {e}")
+
+    @staticmethod
+    def _match_response_identifier(response_item: dict[str, Any], identifiers: set[str]) -> Optional[str]:
+        """Which pending identifier a catalog listing entry belongs to, None if not ours"""
+        metadata = response_item.get("metadata", {}) or {}
+        for ident in (response_item.get("requestIdentifier"), metadata.get("DL_REQUEST_ID")):
+            if ident in identifiers:
+                return ident
+
+        # keys are prefixed with the request identifier
+        key: str = response_item.get("key", "")
+        for ident in identifiers:
+            if key.startswith(ident):
+                return ident
+        return None
+
+    def list_catalog_responses(self) -> Optional[list[dict[str, Any]]]:
+        """
+        One listing of every response in the catalog, following next links.
+        Returns:
+            list of response entries or None if the listing failed
+        """
+        content_responses_uri = urljoin(self.bbg_host, self.list_response_base)
+        responses: list[dict[str, Any]] = []
+        self._ensure_token()
+
+        while content_responses_uri:
+            logger.info(f"Listing Bloomberg responses: {content_responses_uri}")
+            response = self._http("GET", content_responses_uri, "list", headers={"api-version": "2"})
+
+            if response.status_code == 401:
+                logger.warning("Authentication error - attempting token refresh")
+                self._refresh_oauth_token()
+                return None
+            elif response.status_code != 200:
+                logger.error(f"HTTP error {response.status_code} listing responses")
+                return None
+
+            response_data = response.json()
+            responses.extend(response_data.get("contains", []))
+            next_page = response_data.get("next")
+            content_responses_uri = urljoin(self.bbg_host, next_page) if next_page else None
+
+        return responses
+
+    def poll_requests_batch(self, requests: list[dict[str, Any]], polled_ids: Optional[list[str]] = None,
+                            executor: Optional[Executor] = None) -> bool:
+        """
+        Poll every submitted request off 1 catalog listing instead of 1 GET each.
+        Poll counts are bumped in a single update.
+        Args:
+            requests: submitted requests to match against the listing
+            polled_ids: the request ids that count this as a poll - default all of them
+            executor: download / store the ready requests in parallel on this pool, None for one at a time
+        Returns:
+            False if the listing failed and the caller should fall back to poll_single_request
+        """
+        if not requests:
+            return True
+
+        try:
+            catalog_responses = self.list_catalog_responses()
+        except Exception as e:
+            logger.error(f"Error listing catalog responses: {e}")
+            return False
+
+        if catalog_responses is None:
+            return False
+
+        by_identifier: dict[str, dict[str, Any]] = {request["identifier"]: request for request in requests}
+        identifiers = set(by_identifier)
+        matched: dict[str, list[Any]] = {}
+        for response_item in catalog_responses:
+            ident = self._match_response_identifier(response_item, identifiers)
+            if ident is not None:
+                matched.setdefault(ident, []).append(response_item)
+
+        if polled_ids is None:
+            polled_ids = [request["request_id"] for request in requests]
+        self.db_connection.update_response_polls(polled_ids)
+        logger.info(f"Catalog listing has {len(catalog_responses)} responses, {len(matched)} of {len(requests)} pending are ready")
+
+        if executor is None:
+            for ident, responses in matched.items():
+                self._process_ready_request(by_identifier[ident], responses)
+        else:
+            wait([executor.submit(self._process_ready_request, by_identifier[ident], responses)
+                  for ident, responses in matched.items()])
+
+        return True
+
+    def _process_ready_request(self, request: dict[str, Any], responses: list[Any]):
+        """Hand a request's responses to the handlers then mark it completed"""
+        request_id = request["request_id"]
+        try:
+            logger.info(f"Response received for request {request_id}")
+            self._process_bloomberg_response(request_id=request_id, identifier=request["identifier"],
+                                             request_name=request["request_name"], responses=responses)
+            self._set_request_completed(request)
+        except Exception as e:
+            logger.error(f"Error processing batch response for {request_id}: {e}")
@@ -7,6 +7,9 @@ EXIT_CMD="EXIT"
 PAUSE_CMD="PAUSE"
 RESUME_CMD="RESUME"
 CLR_QUEUES="CLR_QUEUES"
+# control channel only
+RELOAD_DEFS="RELOAD_DEFS"
+STATUS_CMD="STATUS"
 REQUEST_TSY_CUSIPS = "TsyBondInfo"
 REQUEST_FUT_CUSIPS = "FuturesInfo"
 REQUEST_MBS_CUSIPS = "MBSBondInfo"
@@ -0,0 +1,42 @@
+import logging
+import os
+import sys
+from ASL import ASL_Logging
+
+from bbg_redis import BloombergRedis
+from bbg_control import send_control, TARGET_ALL
+
+# Attach logging
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    logger = ASL_Logging(log_file="bbg_cmd_sender_log", log_path="./logs", useBusinessDateRollHandler=True)
+
+def main():
+    """bbg_send_control.py CMD [all|sender|poller|worker] - CMD is EXIT, PAUSE, RESUME, CLR_QUEUES, RELOAD_DEFS or STATUS"""
+    setup_logging()
+    if len(sys.argv) < 2:
+        print(main.__doc__)
+        return
+    cmd = sys.argv[1].upper()
+    target = sys.argv[2] if len(sys.argv) > 2 else TARGET_ALL
+
+    redis_que = BloombergRedis(redis_host=os.environ.get("REDIS_HOST", "cacheuat"))
+    try:
+        replies = send_control(redis_que.get_client(), cmd, target=target,
+                               reply_wait_sec=float(os.environ.get("BBG_CONTROL_REPLY_SEC", 5)))
+    except RuntimeError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    finally:
+        redis_que.close()
+    for reply in replies:
+        print(f'{reply["role"]} {reply["worker"]}: {reply["result"]}')
+
+
+# *****************************************************
+#
+#  MAIN MAIN
+# *********************************************************
+if __name__ == "__main__":
+    main()
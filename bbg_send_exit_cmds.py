@@ -3,6 +3,7 @@ import logging
 from ASL import ASL_Logging
 
 from bbg_redis import BloombergRedis
+from bbg_redis_streams import redis_queue_from_env
 from bbg_send_cmds import (
     EXIT_CMD,
     REQUEST_TSY_CUSIPS,
@@ -18,7 +19,7 @@ def setup_logging():
 
 def main():
     setup_logging()
-    redis_que = BloombergRedis()
+    redis_que = redis_queue_from_env()
     logger.info("Bloomberg CMD Sender Starting")
 
     #logger.info("Requesting TSY")
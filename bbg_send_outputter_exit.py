@@ -0,0 +1,33 @@
+import logging
+import os
+from ASL import ASL_Logging
+
+from bbg_redis import BloombergRedis
+from bbg_send_cmds import (
+    EXIT_CMD,
+)
+
+# Attach logging
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    logger = ASL_Logging(log_file="bbg_cmd_sender_log", log_path="./logs", useBusinessDateRollHandler=True)
+
+def main():
+    setup_logging()
+    redis_que = BloombergRedis(redis_host=os.environ.get("REDIS_HOST", "cacheuat"))
+    logger.info("Bloomberg CMD Sender Starting")
+
+    # outputter daemon listens on the completion queue not the request queues
+    try:
+        redis_que.publish_completion(EXIT_CMD)
+    finally:
+        redis_que.close()
+
+
+# *****************************************************
+#
+#  MAIN MAIN
+# *********************************************************
+if __name__ == "__main__":
+    main()
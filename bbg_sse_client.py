@@ -0,0 +1,153 @@
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SSEEvent:
+    event: str = "message"
+    data: str = ""
+    id: Optional[str] = None
+    retry: Optional[int] = None
+
+
+def parse_sse_lines(lines: Iterable[str]) -> Iterator[SSEEvent]:
+    """
+    Turn the lines of a text/event-stream into events.  Comment lines (heartbeats)
+    are skipped, a blank line ends an event.  An event with only retry: in it is still
+    yielded so the reader can pick up the new reconnect time.
+    """
+    event = SSEEvent()
+    data_lines: list[str] = []
+    has_fields = False
+
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r")
+
+        if line == "":
+            if has_fields:
+                event.data = "\n".join(data_lines)
+                yield event
+            event = SSEEvent()
+            data_lines = []
+            has_fields = False
+            continue
+
+        if line.startswith(":"):
+            continue  # heartbeat / comment
+
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+
+        if field == "data":
+            data_lines.append(value)
+            has_fields = True
+        elif field == "event":
+            event.event = value
+            has_fields = True
+        elif field == "id":
+            event.id = value
+            has_fields = True
+        elif field == "retry":
+            try:
+                event.retry = int(value)
+                has_fields = True
+            except ValueError:
+                pass
+
+
+class BloombergSSEClient:
+    """
+    Listens to a server sent events stream on a background thread and calls on_event
+    for every event.  Reconnects with backoff and resumes from the last event id.
+    connected is set while the stream is up so callers know when to fall back to polling.
+    """
+    MIN_RECONNECT_SEC = 1
+    MAX_RECONNECT_SEC = 60
+
+    def __init__(
+        self,
+        connect: Callable[[Optional[str]], Any],
+        on_event: Callable[[SSEEvent], None],
+        name: str = "bbg_sse",
+    ):
+        """
+        Args:
+            connect: opens the stream given the last event id (or None) - returns a streaming
+                     requests response
+            on_event: called on the listener thread for each event
+            name: thread name
+        """
+        self.connect = connect
+        self.on_event = on_event
+        self.name = name
+        self.last_event_id: Optional[str] = None
+        self.retry_sec: Optional[float] = None  # reconnect time the server asked for
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._response = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        response = self._response
+        if response is not None:
+            try:
+                response.close()  # unblocks the read
+            except Exception as e:
+                logger.debug(f"Error closing sse stream {e}")
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        reconnect_sec = BloombergSSEClient.MIN_RECONNECT_SEC
+
+        while not self._stop.is_set():
+            try:
+                self._response = self.connect(self.last_event_id)
+                if self._response.status_code != 200:
+                    logger.error(f"SSE connect failed HTTP {self._response.status_code}")
+                    self._response.close()
+                else:
+                    logger.info(f"SSE stream connected last event id {self.last_event_id}")
+                    self.connected.set()
+                    reconnect_sec = self.retry_sec or BloombergSSEClient.MIN_RECONNECT_SEC
+
+                    for event in parse_sse_lines(self._response.iter_lines(decode_unicode=True)):
+                        if event.id is not None:
+                            self.last_event_id = event.id
+                        if event.retry is not None:
+                            self.retry_sec = max(BloombergSSEClient.MIN_RECONNECT_SEC, event.retry / 1000.0)
+                            reconnect_sec = self.retry_sec
+                            if event.id is None and not event.data and event.event == "message":
+                                continue  # retry only - nothing for the handler
+                        try:
+                            self.on_event(event)
+                        except Exception as e:
+                            logger.error(f"Error in sse event handler: {e}")
+                        if self._stop.is_set():
+                            break
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.warning(f"SSE stream dropped: {e}")
+            finally:
+                self.connected.clear()
+                self._response = None
+
+            if not self._stop.is_set():
+                logger.info(f"SSE reconnecting in {reconnect_sec}s")
+                self._stop.wait(reconnect_sec)
+                reconnect_sec = min(reconnect_sec * 2, BloombergSSEClient.MAX_RECONNECT_SEC)
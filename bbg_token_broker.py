@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore(ABC):
+    """Where the shared token lives - get / put the token dict and a short lock around refreshing"""
+
+    @abstractmethod
+    def get(self) -> Optional[dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, token: dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self) -> None:
+        ...
+
+    @abstractmethod
+    def acquire_lock(self, owner: str, ttl_sec: int) -> bool:
+        ...
+
+    @abstractmethod
+    def release_lock(self, owner: str) -> None:
+        ...
+
+
+class RedisTokenStore(TokenStore):
+    TOKEN_KEY = "BBG_API:oauth_token"
+    LOCK_KEY = "BBG_API:oauth_token:lock"
+
+    # only the owner may drop the lock
+    RELEASE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def get(self) -> Optional[dict[str, Any]]:
+        value = self.redis_client.get(RedisTokenStore.TOKEN_KEY)
+        return json.loads(value) if value else None
+
+    def put(self, token: dict[str, Any]) -> None:
+        ttl = max(1, int(token["expires_at"] - time.time()))
+        self.redis_client.set(RedisTokenStore.TOKEN_KEY, json.dumps(token), ex=ttl)
+
+    def delete(self) -> None:
+        self.redis_client.delete(RedisTokenStore.TOKEN_KEY)
+
+    def acquire_lock(self, owner: str, ttl_sec: int) -> bool:
+        return bool(self.redis_client.set(RedisTokenStore.LOCK_KEY, owner, nx=True, ex=ttl_sec))
+
+    def release_lock(self, owner: str) -> None:
+        self.redis_client.eval(RedisTokenStore.RELEASE_SCRIPT, 1, RedisTokenStore.LOCK_KEY, owner)
+
+
+class FileTokenStore(TokenStore):
+    """Local file version for tests and single box runs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+
+    def get(self) -> Optional[dict[str, Any]]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, token: dict[str, Any]) -> None:
+        tmp_path = self.path + ".tmp"
+        # owner only - it is a live bearer token
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.chmod(tmp_path, 0o600)  # in case an old tmp file was left with wider access
+        with os.fdopen(fd, "w") as f:
+            json.dump(token, f)
+        os.replace(tmp_path, self.path)
+
+    def delete(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def acquire_lock(self, owner: str, ttl_sec: int) -> bool:
+        try:
+            if time.time() - os.path.getmtime(self.lock_path) > ttl_sec:
+                os.remove(self.lock_path)  # left behind by a dead process
+        except OSError:
+            pass
+
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(owner)
+        return True
+
+    def release_lock(self, owner: str) -> None:
+        try:
+            with open(self.lock_path, "r") as f:
+                if f.read() != owner:
+                    return
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+
+class BloombergTokenBroker:
+    """
+    Shares one OAuth2 access token between the sender, poller and outputter.  A process only
+    goes to BSSO when the shared token is missing or within refresh_margin_sec of expiry, and
+    only one process does so at a time - everyone else waits for it and picks the new token up.
+    """
+    REFRESH_MARGIN_SEC = 120
+    LOCK_TTL_SEC = 30
+    LOCK_POLL_SEC = 0.1
+
+    def __init__(self, store: TokenStore, refresh_margin_sec: int = REFRESH_MARGIN_SEC):
+        self.store = store
+        self.refresh_margin_sec = refresh_margin_sec
+        self.owner = str(uuid.uuid4())
+        self._token: Optional[dict[str, Any]] = None
+
+    def _is_fresh(self, token: Optional[dict[str, Any]]) -> bool:
+        return token is not None and token.get("expires_at", 0) - self.refresh_margin_sec > time.time()
+
+    @staticmethod
+    def _with_expiry(token: dict[str, Any]) -> dict[str, Any]:
+        token = dict(token)
+        if "expires_at" not in token:
+            token["expires_at"] = time.time() + float(token.get("expires_in", 0))
+        return token
+
+    def get_token(self, fetch_token: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+        """
+        Args:
+            fetch_token: goes to BSSO for a brand new token - only called by the lock holder
+        Returns:
+            a token dict good for at least refresh_margin_sec
+        """
+        if self._is_fresh(self._token):
+            return self._token
+
+        deadline = time.time() + BloombergTokenBroker.LOCK_TTL_SEC
+        while True:
+            shared = self._read_store()
+            if self._is_fresh(shared):
+                self._token = shared
+                return shared
+
+            if self._try_lock():
+                try:
+                    shared = self._read_store()  # someone may have beaten us to it
+                    if self._is_fresh(shared):
+                        self._token = shared
+                        return shared
+
+                    start_time = time.perf_counter()
+                    token = BloombergTokenBroker._with_expiry(fetch_token())
+                    logger.info(f"Fetched new OAuth2 token in {time.perf_counter() - start_time:.3f}s")
+                    self._write_store(token)
+                    self._token = token
+                    return token
+                finally:
+                    self._unlock()
+
+            if time.time() > deadline:
+                # lock holder died or the store is down - do not hang, just fetch
+                logger.warning("Timed out waiting on the token lock fetching our own token")
+                self._token = BloombergTokenBroker._with_expiry(fetch_token())
+                return self._token
+
+            time.sleep(BloombergTokenBroker.LOCK_POLL_SEC)
+
+    def invalidate(self, token: Optional[dict[str, Any]] = None) -> None:
+        """The API said 401 - drop the shared token if it is still the one that failed"""
+        token = token or self._token
+        self._token = None
+        shared = self._read_store()
+        if shared is not None and token is not None and shared.get("access_token") == token.get("access_token"):
+            try:
+                self.store.delete()
+            except Exception as e:
+                logger.error(f"Error dropping shared token {e}")
+
+    def _read_store(self) -> Optional[dict[str, Any]]:
+        try:
+            return self.store.get()
+        except Exception as e:
+            logger.error(f"Error reading shared token {e}")
+            return None
+
+    def _write_store(self, token: dict[str, Any]) -> None:
+        try:
+            self.store.put(token)
+        except Exception as e:
+            logger.error(f"Error saving shared token {e}")
+
+    def _try_lock(self) -> bool:
+        try:
+            return self.store.acquire_lock(self.owner, BloombergTokenBroker.LOCK_TTL_SEC)
+        except Exception as e:
+            logger.error(f"Error taking token lock {e}")
+            return False
+
+    def _unlock(self) -> None:
+        try:
+            self.store.release_lock(self.owner)
+        except Exception as e:
+            logger.error(f"Error releasing token lock {e}")
+
+
+TOKEN_CACHE_REDIS = "redis"
+TOKEN_CACHE_FILE = "file"
+TOKEN_CACHE_NONE = "none"
+
+
+def token_broker_from_env(redis_client=None) -> Optional[BloombergTokenBroker]:
+    """
+    BBG_TOKEN_CACHE picks the store - redis (default, needs redis_client), file (BBG_TOKEN_CACHE_FILE)
+    or none to keep a private token per process.
+    """
+    cache_mode = os.environ.get("BBG_TOKEN_CACHE", TOKEN_CACHE_REDIS).lower()
+    refresh_margin_sec = int(os.environ.get("BBG_TOKEN_REFRESH_MARGIN_SEC", BloombergTokenBroker.REFRESH_MARGIN_SEC))
+
+    if cache_mode == TOKEN_CACHE_REDIS and redis_client is not None:
+        store = RedisTokenStore(redis_client)
+    elif cache_mode == TOKEN_CACHE_FILE:
+        store = FileTokenStore(os.environ.get("BBG_TOKEN_CACHE_FILE", "./bbg_oauth_token.json"))
+    else:
+        logger.info(f"OAuth2 token not shared - token cache {cache_mode}")
+        return None
+
+    logger.info(f"OAuth2 token shared through {cache_mode} refresh margin {refresh_margin_sec}s")
+    return BloombergTokenBroker(store, refresh_margin_sec=refresh_margin_sec)
@@ -37,6 +37,19 @@ IF "%ENVIRONMENT%" == "DEV" (
 )
 
 set "SQL_USE_WINDOWS_AUTH=true"  
+REM row = 1 insert per row, batch = multi row inserts, executemany = pyodbc fast_executemany
+set "BBG_DB_LOAD_MODE=batch"
+REM odbc driver for the executemany connection, uses SQL_USE_WINDOWS_AUTH (or SQL_USERNAME / SQL_PASSWORD)
+set "BBG_SQL_ODBC_DRIVER=ODBC Driver 17 for SQL Server"
+REM columnar = parse each response once into typed columns, row = old row by row path
+set "BBG_TRANSFORM_MODE=columnar"
+REM database, csv and raw outputs of a response are written side by side, 1 = one after the other
+set "BBG_OUTPUT_WORKERS=3"
+REM run "bbg_outputter.py daemon" to stay up and output as responses complete, swept every BBG_OUTPUT_SWEEP_SEC
+set "BBG_OUTPUT_SWEEP_SEC=300"
+REM downloaded csv kept on disk by content hash (must be the same place for poller and outputter), blank = in bloomberg_data
+set "BBG_RESPONSE_STORE_DIR=response_store"
+set "BBG_RESPONSE_STORE_COMPRESS=true"
 
 REM echo "Environment is..."
 pushd \\aslfile01\aslcap\IT\Software\Development\Bloomberg\https_requests
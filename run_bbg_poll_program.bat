@@ -42,6 +42,50 @@ REM $env:SQL_USERNAME=your_username  REM optional if using Windows auth
 REM $env:SQL_PASSWORD=your_password REM optional if using Windows auth
 REM set to true for Windows authentication
 set "SQL_USE_WINDOWS_AUTH=true"  
+REM batch = 1 catalog listing per cycle for every pending request, single = 1 GET per request
+set "BBG_POLL_MODE=batch"
+REM poll = sleep between cycles, sse = wake on bloomberg notifications (polls while the stream is down)
+set "BBG_NOTIFY_MODE=poll"
+set "BBG_SSE_SWEEP_SEC=120"
+REM downloads are streamed to here before going into the db
+set "BBG_SPOOL_DIR=spool"
+set "BBG_KEEP_SPOOL=false"
+REM per request poll schedule - first poll at the usual turnaround, then response_poll_wait_sec backed off
+set "BBG_POLL_BACKOFF=1.5"
+set "BBG_POLL_MAX_INTERVAL_SEC=300"
+set "BBG_TURNAROUND_REFRESH_SEC=900"
+REM more than 1 poller can run - each leases its requests, lease must outlast BBG_SSE_SWEEP_SEC
+set "BBG_POLL_LEASE_SEC=300"
+REM a split request still missing chunk rows after this many seconds is failed
+set "BBG_CHUNK_ORPHAN_SEC=14400"
+set "BBG_POLL_CLAIM_BATCH=500"
+REM parallel listings / downloads per poller, db writes go through 1 writer thread.  1 = one at a time
+set "BBG_POLL_WORKERS=4"
+REM downloaded csv kept on disk by content hash (must be the same place for poller and outputter), blank = in bloomberg_data
+set "BBG_RESPONSE_STORE_DIR=response_store"
+set "BBG_RESPONSE_STORE_COMPRESS=true"
+REM OAuth2 token shared by the sender and poller - redis, file (BBG_TOKEN_CACHE_FILE) or none
+set "BBG_TOKEN_CACHE=redis"
+set "BBG_TOKEN_REFRESH_MARGIN_SEC=120"
+REM bloomberg http - keep alive pool (>= sender workers), connect/read timeouts, retries on 429/502/503
+set "BBG_HTTP_POOL_SIZE=10"
+set "BBG_HTTP_CONNECT_TIMEOUT=10"
+set "BBG_HTTP_READ_TIMEOUT=120"
+set "BBG_HTTP_MAX_RETRIES=4"
+set "BBG_HTTP_BACKOFF_SEC=1"
+REM ref = queue holds request ids with the json in its own key, inline = whole json in the queue
+set "BBG_QUEUE_ENTRY_MODE=ref"
+REM queued payload keys expire after this, payloads this big or more are zlib compressed (0 = never)
+set "BBG_QUEUE_PAYLOAD_TTL_SEC=604800"
+set "BBG_QUEUE_PAYLOAD_COMPRESS_BYTES=4096"
+REM zset = sorted set queue, stream = redis streams with a consumer group (acked, idle entries reclaimed after the lease)
+REM everything that queues requests or commands has to use the same transport
+set "BBG_QUEUE_TRANSPORT=zset"
+set "BBG_STREAM_GROUP=bbg_workers"
+REM read weight per priority stream, blank = 2^(10-priority)
+set "BBG_STREAM_WEIGHTS="
+REM pub/sub channel for EXIT PAUSE RESUME CLR_QUEUES RELOAD_DEFS STATUS (bbg_send_control.py), blank = off
+set "BBG_CONTROL_CHANNEL=BBG_API:control"
 
 REM these are in a db table now 
 REM Polling Configuration (optional)
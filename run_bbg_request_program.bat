@@ -35,6 +35,53 @@ IF "%ENVIRONMENT%" == "DEV" (
 )
 
 set "SQL_USE_WINDOWS_AUTH=true"
+REM seconds a sender holds a claimed request before another sender can take it back
+set "BBG_QUEUE_LEASE_SEC=300"
+REM a request whose lease runs out more than this many times (it kills whoever claims it) goes to <queue>:dead
+set "BBG_QUEUE_MAX_RECLAIMS=3"
+REM block = wake as soon as a request is queued, sleep = old backoff polling
+set "BBG_SENDER_WAIT_MODE=block"
+REM parallel submits, 1 = one at a time.  per request name caps e.g. TsyBondInfo=1,MBSBondInfo=2
+set "BBG_SENDER_MAX_WORKERS=4"
+set "BBG_SENDER_CONCURRENCY="
+REM split big universes e.g. MBSBondInfo=500, target sec shrinks chunks using past turnaround (0 = off)
+set "BBG_CHUNK_SIZE="
+set "BBG_CHUNK_TARGET_SEC=0"
+REM OAuth2 token shared by the sender and poller - redis, file (BBG_TOKEN_CACHE_FILE) or none
+set "BBG_TOKEN_CACHE=redis"
+set "BBG_TOKEN_REFRESH_MARGIN_SEC=120"
+REM bloomberg http - keep alive pool (>= sender workers), connect/read timeouts, retries on 429/502/503
+set "BBG_HTTP_POOL_SIZE=10"
+set "BBG_HTTP_CONNECT_TIMEOUT=10"
+set "BBG_HTTP_READ_TIMEOUT=120"
+set "BBG_HTTP_MAX_RETRIES=4"
+set "BBG_HTTP_BACKOFF_SEC=1"
+REM gzip big submit payloads (turned off automatically if bloomberg rejects them)
+set "BBG_GZIP_UPLOAD=true"
+set "BBG_GZIP_LEVEL=6"
+REM requests per redis round trip when queueing in bulk
+set "BBG_ENQUEUE_BATCH=500"
+REM ref = queue holds request ids with the json in its own key, inline = whole json in the queue
+set "BBG_QUEUE_ENTRY_MODE=ref"
+REM queued payload keys expire after this, payloads this big or more are zlib compressed (0 = never)
+set "BBG_QUEUE_PAYLOAD_TTL_SEC=604800"
+set "BBG_QUEUE_PAYLOAD_COMPRESS_BYTES=4096"
+REM zset = sorted set queue, stream = redis streams with a consumer group (acked, idle entries reclaimed after the lease)
+REM everything that queues requests or commands has to use the same transport
+set "BBG_QUEUE_TRANSPORT=zset"
+set "BBG_STREAM_GROUP=bbg_workers"
+REM read weight per priority stream, blank = 2^(10-priority)
+set "BBG_STREAM_WEIGHTS="
+REM pub/sub channel for EXIT PAUSE RESUME CLR_QUEUES RELOAD_DEFS STATUS (bbg_send_control.py), blank = off
+set "BBG_CONTROL_CHANNEL=BBG_API:control"
+REM zset transport: a lane per request_name shared by weight (name=weight, default = the command lane), caps come from BBG_SENDER_CONCURRENCY
+set "BBG_QUEUE_LANES=true"
+set "BBG_LANE_WEIGHTS="
+set "BBG_LANE_DEFAULT_WEIGHT=1"
+REM a waiting request moves up 1 priority per this many seconds, 0 = no aging
+set "BBG_LANE_AGING_SEC=300"
+REM log lane depth and waits this often, 0 = never
+set "BBG_LANE_STATS_SEC=300"
 
 REM pip install redis pyodbc oauthlib requests-oauthlib
 REM echo "Environment is..."
@@ -12,7 +12,10 @@ CREATE TABLE bloomberg_data (
     identifier NVARCHAR(100) NOT NULL,
     request_name NVARCHAR(64) NOT NULL,
     data_type NVARCHAR(50) DEFAULT 'csv',
-    data_content NTEXT,
+    data_content NVARCHAR(MAX), /* MAX not NTEXT so big files can be appended in chunks */
+    content_hash CHAR(64) NULL, /* sha256 of the csv when it is kept in the response store instead */
+    content_size BIGINT NULL,
+    content_path NVARCHAR(512) NULL, /* relative to BBG_RESPONSE_STORE_DIR */
     status NVARCHAR(12) DEFAULT 'pending' NOT NULL  CONSTRAINT bbg_data_status_check CHECK (status in ('pending', 'processing', 'completed')),
     ts DATETIME2 DEFAULT GETDATE(),
     PRIMARY key (request_id, data_type)
@@ -24,4 +27,7 @@ CREATE NONCLUSTERED INDEX bbg_data_identifier_indx on dbo.bloomberg_data(identif
 go
 
 CREATE NONCLUSTERED INDEX bbg_data_status_indx on dbo.bloomberg_data(status, ts)
-go
\ No newline at end of file
+go
+
+CREATE NONCLUSTERED INDEX bbg_data_content_hash_indx on dbo.bloomberg_data(content_hash)
+go
@@ -30,7 +30,17 @@ CREATE TABLE bloomberg_requests (
     submitted_at DATETIME2 NULL,
     completed_at DATETIME2 NULL,
     updated_at DATETIME2  NULL,
+    parent_request_id NVARCHAR(50) NULL, /* set on the chunks of a split universe */
+    chunk_index INT NULL,
+    chunk_count INT NULL, /* on the parent - how many chunks to wait for */
+    universe_size INT NULL,
+    poll_owner NVARCHAR(64) NULL, /* poller holding the lease on a submitted request */
+    poll_lease_until DATETIME2 NULL,
     ts DATETIME2 DEFAULT GETDATE()
 )
 go
 
+CREATE NONCLUSTERED INDEX bbg_requests_parent_indx on dbo.bloomberg_requests(parent_request_id, chunk_index)
+CREATE NONCLUSTERED INDEX bbg_requests_poll_owner_indx on dbo.bloomberg_requests(status, poll_owner, poll_lease_until)
+go
+
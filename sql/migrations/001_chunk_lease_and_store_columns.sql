@@ -0,0 +1,62 @@
+/*  Brings tables created before the chunking, poll lease and response store changes up to date.
+    Safe to run more than once - every step checks first.
+    .\load_files.ps1 -Files .\migrations\*.sql -Database <name>  */
+use <database>
+go
+
+/*  bloomberg_requests - split universe chunks */
+IF COL_LENGTH('dbo.bloomberg_requests', 'parent_request_id') IS NULL
+    ALTER TABLE dbo.bloomberg_requests ADD parent_request_id NVARCHAR(50) NULL
+go
+
+IF COL_LENGTH('dbo.bloomberg_requests', 'chunk_index') IS NULL
+    ALTER TABLE dbo.bloomberg_requests ADD chunk_index INT NULL
+go
+
+IF COL_LENGTH('dbo.bloomberg_requests', 'chunk_count') IS NULL
+    ALTER TABLE dbo.bloomberg_requests ADD chunk_count INT NULL
+go
+
+IF COL_LENGTH('dbo.bloomberg_requests', 'universe_size') IS NULL
+    ALTER TABLE dbo.bloomberg_requests ADD universe_size INT NULL
+go
+
+/*  bloomberg_requests - poller leases */
+IF COL_LENGTH('dbo.bloomberg_requests', 'poll_owner') IS NULL
+    ALTER TABLE dbo.bloomberg_requests ADD poll_owner NVARCHAR(64) NULL
+go
+
+IF COL_LENGTH('dbo.bloomberg_requests', 'poll_lease_until') IS NULL
+    ALTER TABLE dbo.bloomberg_requests ADD poll_lease_until DATETIME2 NULL
+go
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='bbg_requests_parent_indx' AND object_id = OBJECT_ID('dbo.bloomberg_requests'))
+    CREATE NONCLUSTERED INDEX bbg_requests_parent_indx on dbo.bloomberg_requests(parent_request_id, chunk_index)
+go
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='bbg_requests_poll_owner_indx' AND object_id = OBJECT_ID('dbo.bloomberg_requests'))
+    CREATE NONCLUSTERED INDEX bbg_requests_poll_owner_indx on dbo.bloomberg_requests(status, poll_owner, poll_lease_until)
+go
+
+/*  bloomberg_data - NTEXT can not be appended to in chunks, existing rows keep their data */
+IF EXISTS (SELECT * FROM INFORMATION_SCHEMA.COLUMNS
+           WHERE TABLE_NAME = 'bloomberg_data' AND COLUMN_NAME = 'data_content' AND DATA_TYPE = 'ntext')
+    ALTER TABLE dbo.bloomberg_data ALTER COLUMN data_content NVARCHAR(MAX)
+go
+
+/*  bloomberg_data - csv kept in the response store */
+IF COL_LENGTH('dbo.bloomberg_data', 'content_hash') IS NULL
+    ALTER TABLE dbo.bloomberg_data ADD content_hash CHAR(64) NULL
+go
+
+IF COL_LENGTH('dbo.bloomberg_data', 'content_size') IS NULL
+    ALTER TABLE dbo.bloomberg_data ADD content_size BIGINT NULL
+go
+
+IF COL_LENGTH('dbo.bloomberg_data', 'content_path') IS NULL
+    ALTER TABLE dbo.bloomberg_data ADD content_path NVARCHAR(512) NULL
+go
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='bbg_data_content_hash_indx' AND object_id = OBJECT_ID('dbo.bloomberg_data'))
+    CREATE NONCLUSTERED INDEX bbg_data_content_hash_indx on dbo.bloomberg_data(content_hash)
+go
@@ -0,0 +1,103 @@
+import orjson
+import pytest
+
+from bbg_control import BloombergControlListener, ROLE_POLLER, ROLE_SENDER, TARGET_ALL, send_control
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ops: list = []
+
+    def lpush(self, key, value):
+        self.ops.append((key, value))
+
+    def expire(self, key, sec):
+        pass
+
+    def execute(self):
+        for key, value in self.ops:
+            self.client.lists.setdefault(key, []).insert(0, value)
+
+
+class _FakeRedis:
+    """publish hands the message straight to the subscribed listeners, blpop never blocks"""
+
+    def __init__(self):
+        self.listeners: list[BloombergControlListener] = []
+        self.lists: dict[str, list] = {}
+        self.blpop_calls = 0
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+    def publish(self, channel, data):
+        for listener in self.listeners:
+            listener._handle(data)
+        return len(self.listeners)
+
+    def blpop(self, key, timeout=0):
+        self.blpop_calls += 1
+        items = self.lists.get(key)
+        return (key, items.pop()) if items else None
+
+
+def _listener(client, role: str, name: str, handled: list) -> BloombergControlListener:
+    handlers = {"STATUS": lambda message: handled.append(name) or {"state": "RUNNING"}}
+    listener = BloombergControlListener(client, role, handlers, name=name)
+    client.listeners.append(listener)
+    return listener
+
+
+@pytest.fixture
+def client():
+    return _FakeRedis()
+
+
+def test_targeted_command_returns_only_the_targets_replies(client):
+    handled: list = []
+    _listener(client, ROLE_SENDER, "s1", handled)
+    _listener(client, ROLE_SENDER, "s2", handled)
+    _listener(client, ROLE_POLLER, "p1", handled)
+    replies = send_control(client, "STATUS", target=ROLE_SENDER, reply_wait_sec=5)
+    assert sorted(reply["worker"] for reply in replies) == ["s1", "s2"]
+    assert sorted(handled) == ["s1", "s2"]
+    assert all(reply["result"] == {"state": "RUNNING"} for reply in replies)
+    # the poller's not handled answer ends the wait instead of the timeout
+    assert client.blpop_calls == 3
+
+
+def test_worker_without_a_handler_answers_not_handled(client):
+    handled: list = []
+    _listener(client, ROLE_SENDER, "s1", handled)
+    assert send_control(client, "RELOAD_DEFS", target=TARGET_ALL, reply_wait_sec=5) == []
+    assert client.blpop_calls == 1
+
+
+def test_no_reply_wanted_pushes_nothing(client):
+    handled: list = []
+    _listener(client, ROLE_SENDER, "s1", handled)
+    _listener(client, ROLE_POLLER, "p1", handled)
+    assert send_control(client, "STATUS", target=ROLE_POLLER) == []
+    assert handled == ["p1"]
+    assert not client.lists
+
+
+def test_missing_replies_stop_at_the_timeout(client):
+    handled: list = []
+    _listener(client, ROLE_SENDER, "s1", handled)
+    client.listeners.append(type("Mute", (), {"_handle": lambda self, data: None})())
+    replies = send_control(client, "STATUS", reply_wait_sec=5)
+    assert [reply["worker"] for reply in replies] == ["s1"]
+
+
+def test_nothing_listening_raises(client):
+    with pytest.raises(RuntimeError):
+        send_control(client, "EXIT")
+
+
+def test_handler_error_is_replied(client):
+    listener = BloombergControlListener(client, ROLE_SENDER, {"EXIT": lambda message: 1 / 0}, name="s1")
+    listener._handle(orjson.dumps({"cmd": "exit", "target": "s1", "reply_to": "r"}))
+    reply = orjson.loads(client.lists["r"][0])
+    assert reply["handled"] and "division" in reply["result"]["error"]
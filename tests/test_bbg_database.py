@@ -0,0 +1,319 @@
+import os
+import re
+import sys
+
+import pytest
+
+pytest.importorskip("ASL.utils.asql")
+
+from bbg_database import BloombergDatabase, BloombergStatusBatch  # noqa: E402
+
+
+class _FakeSQL:
+    """Records what BloombergDatabase sends to SQLObject, fails on a chosen execute_param_query call"""
+
+    def __init__(self, fail_on: int = None):
+        self.calls: list[tuple] = []
+        self.fail_on = fail_on
+
+    def execute_query(self, query, commit=False):
+        self.calls.append(("query", query, None, commit))
+
+    def execute_param_query(self, query, params, commit=False):
+        self.calls.append(("param", query, params, commit))
+        if self.fail_on is not None and len([c for c in self.calls if c[0] == "param"]) == self.fail_on:
+            raise RuntimeError("insert failed")
+
+    def fetch(self, query, fmt, params=None):
+        self.calls.append(("fetch", query, params, False))
+        return []
+
+
+class _FakeCursor:
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.closed = False
+
+    def execute(self, query):
+        pass
+
+    def executemany(self, query, rows):
+        if self.fail:
+            raise RuntimeError("executemany failed")
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeODBC:
+    def __init__(self, fail: bool = False):
+        self.cursor_obj = _FakeCursor(fail)
+        self.committed = self.rolled_back = self.closed = False
+
+    def cursor(self):
+        return self.cursor_obj
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+def _database(sql: _FakeSQL) -> BloombergDatabase:
+    database = BloombergDatabase.__new__(BloombergDatabase)
+    database.db_connection = sql
+    database.load_mode = BloombergDatabase.LOAD_MODE_BATCH
+    database.server = database.database = ""
+    database._odbc_connection = None
+    database.status_batch = None
+    return database
+
+
+def _inserts(sql: _FakeSQL) -> list[tuple]:
+    return [call for call in sql.calls if call[0] == "param"]
+
+
+def test_batch_splits_on_sql_param_limit():
+    col_names = ["a", "b", "c"]
+    rows = [(i, i, i) for i in range(1500)]
+    sql = _FakeSQL()
+    assert _database(sql).bulk_insert("t", col_names, rows, pre_query="delete from t") == 1500
+
+    batch_rows = BloombergDatabase.MAX_SQL_PARAMS // len(col_names)
+    inserts = _inserts(sql)
+    assert [len(params) // len(col_names) for _, _, params, _ in inserts] == [batch_rows, batch_rows, 1500 - 2 * batch_rows]
+    assert all(len(params) <= BloombergDatabase.MAX_SQL_PARAMS for _, _, params, _ in inserts)
+    # pre query and all but the last batch stay in the one transaction
+    assert sql.calls[0] == ("query", "delete from t", None, False)
+    assert [commit for *_, commit in inserts] == [False, False, True]
+    assert [val for _, _, params, _ in inserts for val in params[::3]] == list(range(1500))
+
+
+def test_batch_caps_rows_per_values_list():
+    rows = [(i,) for i in range(2500)]
+    sql = _FakeSQL()
+    _database(sql).bulk_insert("t", ["a"], rows)
+    assert [len(params) for _, _, params, _ in _inserts(sql)] == [BloombergDatabase.MAX_INSERT_ROWS,
+                                                                  BloombergDatabase.MAX_INSERT_ROWS, 500]
+
+
+def test_empty_rows_commits_the_pre_query():
+    sql = _FakeSQL()
+    assert _database(sql).bulk_insert("t", ["a"], [], pre_query="delete from t") == 0
+    assert sql.calls == [("query", "delete from t", None, False),
+                         ("query", "IF @@TRANCOUNT > 0 COMMIT", None, True)]
+
+
+def test_failed_batch_rolls_back_and_raises():
+    sql = _FakeSQL(fail_on=2)
+    with pytest.raises(RuntimeError):
+        _database(sql).bulk_insert("t", ["a"], [(i,) for i in range(2500)], pre_query="delete from t")
+    assert len(_inserts(sql)) == 2
+    assert sql.calls[-1] == ("query", "IF @@TRANCOUNT > 0 ROLLBACK", None, True)
+
+
+def test_executemany_falls_back_to_batch_when_pyodbc_unavailable(monkeypatch):
+    sql = _FakeSQL()
+    database = _database(sql)
+
+    def no_pyodbc():
+        raise ValueError("no pyodbc connection: No module named 'pyodbc'")
+
+    monkeypatch.setattr(database, "_get_odbc_connection", no_pyodbc)
+    assert database.bulk_insert("t", ["a"], [(1,), (2,)], load_mode=BloombergDatabase.LOAD_MODE_EXECUTEMANY) == 2
+    assert _inserts(sql) == [("param", "insert into t (a) VALUES (?),(?)", (1, 2), True)]
+
+
+def test_failed_executemany_drops_the_connection():
+    sql = _FakeSQL()
+    database = _database(sql)
+    conn = database._odbc_connection = _FakeODBC(fail=True)
+    with pytest.raises(RuntimeError):
+        database.bulk_insert("t", ["a"], [(1,)], load_mode=BloombergDatabase.LOAD_MODE_EXECUTEMANY)
+    assert conn.rolled_back and conn.closed and conn.cursor_obj.closed
+    assert database._odbc_connection is None
+    assert not _inserts(sql)  # a failure after statements ran is not retried in batch mode
+
+
+def test_executemany_commits_on_its_connection():
+    database = _database(_FakeSQL())
+    conn = database._odbc_connection = _FakeODBC()
+    database.bulk_insert("t", ["a"], [(1,)], load_mode=BloombergDatabase.LOAD_MODE_EXECUTEMANY)
+    assert conn.committed and conn.cursor_obj.closed and not conn.closed
+    assert database._odbc_connection is conn
+
+
+def test_missing_pyodbc_is_a_value_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyodbc", None)
+    database = _database(_FakeSQL())
+    monkeypatch.setattr(database, "_odbc_connection_string", lambda: "")
+    with pytest.raises(ValueError):
+        database._get_odbc_connection()
+    assert database._odbc_connection is None
+
+
+def test_claim_renews_own_leases_before_claiming_free_or_expired():
+    sql = _FakeSQL()
+    _database(sql).claim_poll_requests("poller-1", lease_sec=90, max_new=25)
+    (_, renew, renew_params, renew_commit), (_, claim, claim_params, claim_commit) = sql.calls
+    assert renew.startswith("UPDATE bloomberg_requests SET poll_lease_until = DATEADD(second, ?, GETDATE())")
+    assert "WHERE poll_owner = ?" in renew
+    assert renew_params == (90, "poller-1")
+    assert claim.startswith("UPDATE TOP (25) bloomberg_requests WITH (UPDLOCK, READPAST, ROWLOCK)")
+    assert "(poll_owner is null or poll_lease_until < GETDATE())" in claim
+    assert claim_params == ("poller-1", 90)
+    for query in (renew, claim):
+        assert "(status = 'submitted' or (status = 'processing' and chunk_count > 0))" in query
+    assert renew_commit and claim_commit
+
+
+def test_release_clears_only_this_pollers_leases():
+    sql = _FakeSQL()
+    _database(sql).release_poll_requests("poller-1")
+    assert sql.calls == [("param", "UPDATE bloomberg_requests SET poll_owner = null, poll_lease_until = null "
+                                   "WHERE poll_owner = ?", ("poller-1",), True)]
+
+
+@pytest.mark.parametrize("table, columns", [
+    ("bloomberg_requests", ["parent_request_id", "chunk_index", "chunk_count", "universe_size",
+                            "poll_owner", "poll_lease_until"]),
+    ("bloomberg_data", ["content_hash", "content_size", "content_path"]),
+])
+def test_migration_adds_the_create_table_columns(table, columns):
+    sql_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "sql")
+    with open(os.path.join(sql_dir, f"{table}.sql")) as f:
+        create_sql = f.read()
+    with open(os.path.join(sql_dir, "migrations", "001_chunk_lease_and_store_columns.sql")) as f:
+        migration_sql = f.read()
+    for column in columns:
+        assert re.search(rf"^\s+{column} ", create_sql, re.MULTILINE)
+        assert f"COL_LENGTH('dbo.{table}', '{column}') IS NULL" in migration_sql
+        assert re.search(rf"ALTER TABLE dbo\.{table} ADD {column} ", migration_sql)
+
+
+def test_open_data_content_passes_request_id_as_a_parameter():
+    class _OneRow(_FakeSQL):
+        def fetch(self, query, fmt, params=None):
+            super().fetch(query, fmt, params)
+            return [{"data_type": "csv", "data_content": "a,b\n1,2\n", "content_path": None}]
+
+    sql = _OneRow()
+    data_type, content = _database(sql).open_data_content("x' or '1'='1")
+    assert (data_type, content.read()) == ("csv", "a,b\n1,2\n")
+    (_, query, params, _), = sql.calls
+    assert query.endswith("where request_id = ?")
+    assert params == ("x' or '1'='1",)
+
+
+def test_status_batch_keeps_last_status_and_every_time_update():
+    batch = BloombergStatusBatch()
+    assert batch.is_empty()
+    batch.add_request_status("r1", "submitted", ",submitted_at = GETDATE()")
+    batch.add_request_status("r1", "completed", ",completed_at = GETDATE()")
+    batch.add_request_status("r1", "completed", "")
+    batch.add_polls(["r1", "r2", "r1"])
+    batch.add_process_status("r1", "N", "ReferenceData", "db", "pending", "")
+    batch.add_process_status("r1", "N", "ReferenceData", "db", "completed", "")
+    batch.add_data_status("r1", "processing")
+    batch.add_data_status("r1", "completed")
+    assert batch.write_count == 10
+    assert batch.request_status == {"r1": ("completed", {",submitted_at = GETDATE()", ",completed_at = GETDATE()"})}
+    assert batch.poll_counts == {"r1": 2, "r2": 1}
+    assert batch.process_status == {("r1", "db"): ("r1", "N", "ReferenceData", "db", "completed", "")}
+    assert batch.data_status == {"r1": "completed"}
+
+
+def test_writes_are_queued_until_flush():
+    sql = _FakeSQL()
+    database = _database(sql)
+    database.begin_status_batch()
+    database.set_request_submitted("r1")
+    database.set_request_completed("r1")
+    database.set_request_completed("r2")
+    database.update_response_polls(["r3", "r4"])
+    database.update_response_poll("r3")
+    database.update_process_status("r1", "N", "ReferenceData", "db", "completed")
+    database.update_data_status("r1", "completed")
+    assert not sql.calls
+
+    assert database.flush_status_batch() == 6
+    assert database.status_batch is None
+    inserts = _inserts(sql)
+    assert [commit for *_, commit in inserts] == [False] * 6
+    assert sql.calls[-1] == ("query", "IF @@TRANCOUNT > 0 COMMIT", None, True)
+
+    polls = {params: query for _, query, params, _ in inserts if "response_poll_count" in query}
+    assert set(polls) == {(2, "r3"), (1, "r4")}
+    # r1 keeps the submitted_at it picked up on the way so it is its own statement
+    status_updates = {params: query for _, query, params, _ in inserts if "SET status" in query}
+    assert set(status_updates) == {("completed", "r1"), ("completed", "r2")}
+    assert "submitted_at = GETDATE()" in status_updates[("completed", "r1")]
+    assert "completed_at = GETDATE()" in status_updates[("completed", "r1")]
+    assert "submitted_at" not in status_updates[("completed", "r2")]
+    (merge_params,) = [p for _, q, p, _ in inserts if q.startswith("MERGE bloomberg_process_status")]
+    assert merge_params == ("r1", "N", "ReferenceData", "db", "completed", "")
+    assert ("update bloomberg_data set status = ? where request_id in (?)", ("completed", "r1")) in \
+        [(q, p) for _, q, p, _ in inserts]
+
+    # straight through again after the flush
+    database.set_request_failed("r5")
+    assert sql.calls[-1][2:] == (("error", "r5"), True)
+
+
+def test_flush_splits_long_id_lists_and_rolls_back_on_error(monkeypatch):
+    monkeypatch.setattr(BloombergDatabase, "MAX_SQL_PARAMS", 10)
+    sql = _FakeSQL(fail_on=3)
+    database = _database(sql)
+    database.begin_status_batch()
+    database.update_response_polls([f"r{i}" for i in range(25)])
+    with pytest.raises(RuntimeError):
+        database.flush_status_batch()
+    assert [len(params) for _, _, params, _ in _inserts(sql)] == [11, 11, 6]
+    assert sql.calls[-1] == ("query", "IF @@TRANCOUNT > 0 ROLLBACK", None, True)
+    assert database.status_batch is None
+
+
+def test_flush_without_writes_runs_nothing():
+    sql = _FakeSQL()
+    database = _database(sql)
+    assert database.flush_status_batch() == 0
+    database.begin_status_batch()
+    assert database.flush_status_batch() == 0
+    assert not sql.calls
+
+
+def test_merge_chunk_data_keeps_one_header():
+    class _Chunks(_FakeSQL):
+        def fetch(self, query, fmt, params=None):
+            super().fetch(query, fmt, params)
+            return [{"data_content": "id,px\n1,99\n", "content_path": None},
+                    {"data_content": "id,px\n2,98", "content_path": None},
+                    {"data_content": "id,px\n3,97\n", "content_path": None}]
+
+    sql = _Chunks()
+    database = _database(sql)
+    stored = {}
+
+    def store_csv_file(request_id, identifier, request_name, csv_path):
+        with open(csv_path, encoding="utf-8") as f:
+            stored[request_id] = f.read()
+
+    database.store_csv_file = store_csv_file
+    assert database.merge_chunk_data("p1", "MBS1", "MBSBondInfo", 3)
+    assert stored == {"p1": "id,px\n1,99\n2,98\n3,97\n"}
+    assert sql.calls[-1][0] == "param" and sql.calls[-1][2] == ("p1",)
+    assert "set status = 'completed'" in sql.calls[-1][1]
+
+
+def test_merge_chunk_data_needs_every_chunk():
+    class _TwoChunks(_FakeSQL):
+        def fetch(self, query, fmt, params=None):
+            return [{"data_content": "id\n1\n", "content_path": None}] * 2
+
+    database = _database(_TwoChunks())
+    database.store_csv_file = lambda **kwargs: pytest.fail("stored a partial merge")
+    assert not database.merge_chunk_data("p1", "MBS1", "MBSBondInfo", 3)
@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("ASL.utils.asql")
+
+import bbg_db_writer  # noqa: E402
+from bbg_database import BloombergDatabase  # noqa: E402
+
+
+class _RecordingDatabase(BloombergDatabase):
+    """Real method names, no connection - records which thread ran each call"""
+
+    def __init__(self, server=None, port=None, database=None):
+        self.calls: list[tuple[str, str]] = []
+        self.closed = False
+
+    def store_json_data(self, request_id, identifier, request_name, json_data):
+        self.calls.append((threading.current_thread().name, request_id))
+        return request_id
+
+    def update_request_status(self, request_id, status, time_update=""):
+        raise RuntimeError(f"cannot update {request_id}")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(bbg_db_writer, "BloombergDatabase", _RecordingDatabase)
+    writer = bbg_db_writer.BloombergDBWriter(name="test_writer")
+    yield writer
+    if writer._thread.is_alive():
+        writer.close()
+
+
+def test_worker_calls_all_run_on_the_writer_thread(writer):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: writer.store_json_data(f"r{i}", "id", "name", {}), range(50)))
+
+    assert results == [f"r{i}" for i in range(50)]
+    assert {thread for thread, _ in writer.db_connection.calls} == {"test_writer"}
+    assert sorted(request_id for _, request_id in writer.db_connection.calls) == sorted(results)
+    assert writer.write_count == 50
+
+
+def test_calls_run_in_submit_order(writer):
+    futures = [writer.submit("store_json_data", f"r{i}", "id", "name", {}) for i in range(20)]
+    assert [future.result(5) for future in futures] == [f"r{i}" for i in range(20)]
+    assert [request_id for _, request_id in writer.db_connection.calls] == [f"r{i}" for i in range(20)]
+
+
+def test_errors_reach_the_caller_and_the_writer_keeps_going(writer):
+    with pytest.raises(RuntimeError, match="cannot update r1"):
+        writer.update_request_status("r1", "error")
+    assert writer.store_json_data("r2", "id", "name", {}) == "r2"
+
+
+def test_cancelled_call_is_skipped(writer):
+    started, gate = threading.Event(), threading.Event()
+
+    def slow_update(*args):
+        started.set()
+        gate.wait(5)
+
+    writer.db_connection.update_request_status = slow_update
+    blocker = writer.submit("update_request_status", "r1", "error")
+    assert started.wait(5)
+    cancelled = writer.submit("store_json_data", "cancelled", "id", "name", {})
+    assert cancelled.cancel()
+    gate.set()
+    blocker.result(5)
+    writer.close()
+
+    assert cancelled.cancelled()
+    assert writer.db_connection.calls == []
+
+
+def test_only_database_methods_are_proxied(writer):
+    with pytest.raises(AttributeError):
+        writer.not_a_database_method()
+
+
+def test_close_drains_the_queue_then_closes_the_connection(writer):
+    futures = [writer.submit("store_json_data", f"r{i}", "id", "name", {}) for i in range(5)]
+    writer.close()
+    assert all(future.done() for future in futures)
+    assert not writer._thread.is_alive()
+    assert writer.db_connection.closed
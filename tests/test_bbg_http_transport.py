@@ -0,0 +1,72 @@
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from bbg_http_transport import BloombergTransport  # noqa: E402
+
+
+class _StubResponse:
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _StubSession:
+    """Hands out the queued responses in order and counts the calls"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    monkeypatch.setattr("bbg_http_transport.time.sleep", lambda sec: None)
+    return BloombergTransport()
+
+
+@pytest.mark.parametrize("status", [429, 502, 503])
+def test_get_retries_retry_statuses(transport, status):
+    session = _StubSession(_StubResponse(status), _StubResponse(200))
+    assert transport.request(session, "get", "http://x", "poll").status_code == 200
+    assert session.calls == 2
+    assert transport.get_stats()["poll"]["retries"] == 1
+
+
+def test_post_retries_429(transport):
+    session = _StubSession(_StubResponse(429), _StubResponse(200))
+    assert transport.request(session, "POST", "http://x", "submit").status_code == 200
+    assert session.calls == 2
+
+
+def test_post_retries_503_only_with_retry_after(transport):
+    session = _StubSession(_StubResponse(503, {"Retry-After": "0"}), _StubResponse(200))
+    assert transport.request(session, "POST", "http://x", "submit").status_code == 200
+    assert session.calls == 2
+
+    session = _StubSession(_StubResponse(503), _StubResponse(200))
+    assert transport.request(session, "POST", "http://x", "submit").status_code == 503
+    assert session.calls == 1
+
+
+def test_post_502_is_returned_not_retried(transport):
+    session = _StubSession(_StubResponse(502), _StubResponse(200))
+    response = transport.request(session, "POST", "http://x", "submit")
+    assert response.status_code == 502 and not response.closed
+    assert session.calls == 1
+    assert transport.get_stats()["submit"]["errors"] == 1
+
+
+def test_retry_status_returned_once_retries_used_up(transport):
+    transport.max_retries = 2
+    session = _StubSession(*[_StubResponse(429) for _ in range(3)])
+    assert transport.request(session, "POST", "http://x", "submit").status_code == 429
+    assert session.calls == 3
@@ -0,0 +1,61 @@
+from bbg_lanes import BloombergLaneScheduler, lane_scheduler_from_env
+
+
+def _heads(count, priority=5.5, lanes=("a", "b")):
+    return {lane: [priority] * count for lane in lanes}
+
+
+def test_equal_weights_split_evenly():
+    scheduler = BloombergLaneScheduler()
+    assert scheduler.plan(_heads(50), {}, 20) == {"a": 10, "b": 10}
+
+
+def test_weights_split_by_share():
+    scheduler = BloombergLaneScheduler({"a": 3, "b": 1})
+    counts = {"a": 0, "b": 0}
+    for _ in range(10):
+        for lane, count in scheduler.plan(_heads(1000), {}, 4).items():
+            counts[lane] += count
+    assert counts == {"a": 30, "b": 10}
+
+
+def test_light_lane_is_not_starved_over_small_claims():
+    scheduler = BloombergLaneScheduler({"a": 10, "b": 1})
+    served_b = sum(scheduler.plan(_heads(1000), {}, 1).get("b", 0) for _ in range(110))
+    assert served_b == 10
+
+
+def test_better_priority_goes_first_regardless_of_weight():
+    scheduler = BloombergLaneScheduler({"a": 1, "b": 100})
+    heads = {"a": [3.1, 3.2, 6.1], "b": [6.2] * 10}
+    assert scheduler.plan(heads, {}, 2) == {"a": 2}
+
+
+def test_free_concurrency_caps_a_lane():
+    scheduler = BloombergLaneScheduler()
+    assert scheduler.plan(_heads(50), {"a": 2}, 10) == {"a": 2, "b": 8}
+    assert scheduler.plan(_heads(50), {"a": 0, "b": 0}, 10) == {}
+
+
+def test_plan_stops_when_lanes_run_dry():
+    scheduler = BloombergLaneScheduler()
+    assert scheduler.plan({"a": [5.1], "b": [5.2, 5.3]}, {}, 10) == {"a": 1, "b": 2}
+
+
+def test_stats_track_served_and_waits():
+    scheduler = BloombergLaneScheduler({"a": 2})
+    scheduler.record_waits("a", [1.0, 3.0])
+    stats = scheduler.stats({"a": 5, "b": 1}, {"a": 4.0})
+    assert stats["a"] == {"weight": 2.0, "depth": 5, "head_wait_sec": 4.0, "served": 2,
+                          "avg_wait_sec": 2.0, "max_wait_sec": 3.0}
+    assert stats["b"]["served"] == 0
+    assert stats["b"]["avg_wait_sec"] == 0.0
+
+
+def test_weights_from_env(monkeypatch):
+    monkeypatch.setenv("BBG_LANE_WEIGHTS", "TsyBondInfo=8, MBSBondInfo=x,junk")
+    monkeypatch.setenv("BBG_LANE_DEFAULT_WEIGHT", "2")
+    scheduler = lane_scheduler_from_env()
+    assert scheduler.weights == {"TsyBondInfo": 8.0}
+    assert scheduler.weight("TsyBondInfo") == 8.0
+    assert scheduler.weight("FuturesInfo") == 2.0
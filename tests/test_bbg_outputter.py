@@ -0,0 +1,209 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("ASL.utils.asl_redis")
+pytest.importorskip("ASL.utils.asql")
+
+from bbg_outputter import BloombergOutputter  # noqa: E402
+from bloomberg_data_def import BloombergDataDef  # noqa: E402
+
+TODAY = "2024-05-01"
+
+TSY_CSV = (
+    "ID,PX_LAST,MATURITY,IS_CALLABLE,NAME,SCHED.DATE,SCHED.AMT\n"
+    "912828XX1,99.5,2030-01-15,false,T 1 01/30,2030-01-15|2031-01-15,100|100\n"
+    "912828XX2,,2031-02-15,true,T 2 02/31,,\n"
+    "912828XX3,true,2032-03-15,,T 3 03/32,2032-03-15,50\n"
+    "912828XX4,n/a,,false,\"T, quoted\",,\n"
+)
+TSY_DEFS = [
+    ("ID", "STRING", "id", "ID"),
+    ("PX_LAST", "FLOAT", "px_last", "PX"),
+    ("MATURITY", "DATE", "maturity", "MATURITY"),
+    ("IS_CALLABLE", "BOOLEAN", "is_callable", ""),
+    ("NAME", "STRING", "", "NAME"),
+    ({"SCHED": ["DATE", "AMT"]}, "STRING", "schedule", "SCHEDULE"),
+]
+
+FUT_CSV = (
+    "ID,TICKER,PX_LAST,LAST_TRADE\n"
+    "ESH4 Index,ESH4 Comdty,5000.25,2024-03-15\n"
+    "TYH4 Comdty,TYH4 Comdty,,2024-03-19\n"
+    "USH4 Comdty,true,1.5 Comdty,\n"
+)
+FUT_DEFS = [
+    ("ID", "STRING", "id", "ID"),
+    ("TICKER", "STRING", "ticker", "TICKER"),
+    ("PX_LAST", "FLOAT", "px_last", "PX"),
+    ("LAST_TRADE", "DATE", "last_trade", "LAST_TRADE"),
+]
+
+
+def _data_defs(defs):
+    return [{BloombergDataDef.REPLY_COL_NAME: reply, BloombergDataDef.DATA_TYPE_COL: data_type,
+             BloombergDataDef.DATABASE_COL_NAME: db_col, BloombergDataDef.OUTPUT_COL_NAME: out_col}
+            for reply, data_type, db_col, out_col in defs]
+
+
+def _outputter(transform_mode):
+    outputter = BloombergOutputter.__new__(BloombergOutputter)
+    outputter.transform_mode = transform_mode
+    return outputter
+
+
+def _db_rows(transform_mode, request_name, csv_text, defs, frame=None):
+    return _outputter(transform_mode)._build_db_rows(request_name, io.StringIO(csv_text), TODAY,
+                                                      _data_defs(defs), frame)
+
+
+def _output_rows(transform_mode, request_name, csv_text, defs, today_str=None):
+    return _outputter(transform_mode)._build_output_rows(request_name, io.StringIO(csv_text), today_str,
+                                                          _data_defs(defs))
+
+
+CASES = [("TsyBondInfo", TSY_CSV, TSY_DEFS), ("FuturesInfo", FUT_CSV, FUT_DEFS)]
+
+
+@pytest.mark.parametrize("request_name,csv_text,defs", CASES)
+def test_columnar_db_rows_match_row_path(request_name, csv_text, defs):
+    row = _db_rows(BloombergOutputter.TRANSFORM_ROW, request_name, csv_text, defs)
+    columnar = _db_rows(BloombergOutputter.TRANSFORM_COLUMNAR, request_name, csv_text, defs)
+    assert columnar == row
+    assert [[type(val) for val in values] for values in columnar] == [[type(val) for val in values] for values in row]
+
+
+@pytest.mark.parametrize("request_name,csv_text,defs", CASES)
+@pytest.mark.parametrize("today_str", [None, TODAY])
+def test_columnar_output_rows_match_row_path(request_name, csv_text, defs, today_str):
+    row = _output_rows(BloombergOutputter.TRANSFORM_ROW, request_name, csv_text, defs, today_str)
+    columnar = _output_rows(BloombergOutputter.TRANSFORM_COLUMNAR, request_name, csv_text, defs, today_str)
+    assert columnar == row
+
+
+def test_shared_text_frame_gives_the_same_db_rows():
+    # output_request_types parses once and hands the frame to every sink
+    outputter = _outputter(BloombergOutputter.TRANSFORM_COLUMNAR)
+    frame = outputter._convert_csv_to_frame(io.StringIO(FUT_CSV))
+    assert _db_rows(BloombergOutputter.TRANSFORM_COLUMNAR, "FuturesInfo", FUT_CSV, FUT_DEFS, frame) == \
+        _db_rows(BloombergOutputter.TRANSFORM_ROW, "FuturesInfo", FUT_CSV, FUT_DEFS)
+
+
+def test_db_row_values():
+    rows = _db_rows(BloombergOutputter.TRANSFORM_COLUMNAR, "TsyBondInfo", TSY_CSV, TSY_DEFS)
+    assert rows[0] == (TODAY, "912828XX1", 99.5, "2030-01-15", 0, '"([2030-01-15,100],[2031-01-15,100])"')
+    assert rows[1][2] == 0.0      # blank FLOAT
+    assert rows[2][2] == 1        # true in a FLOAT column
+    assert rows[2][4] == 1        # blank BOOLEAN
+    assert rows[3][2] == "n/a"    # junk left as text
+
+    futures = _db_rows(BloombergOutputter.TRANSFORM_COLUMNAR, "FuturesInfo", FUT_CSV, FUT_DEFS)
+    assert [row[1:3] for row in futures] == [("ESH4 Index", "ESH4"), ("TYH4", "TYH4"), ("USH4", 1)]
+    assert futures[2][3] == "1.5"  # not a number until cleaned - stays text like the row path
+
+
+def test_missing_db_column_raises():
+    with pytest.raises(KeyError):
+        _db_rows(BloombergOutputter.TRANSFORM_COLUMNAR, "TsyBondInfo", TSY_CSV,
+                 TSY_DEFS + [("NOT_THERE", "FLOAT", "not_there", "")])
+
+
+class _FanOutDatabase:
+    """What output_request_types / output_ready_requests use of BloombergDatabase"""
+
+    def __init__(self, rows: list[dict] = (), ready: bool = True):
+        self.rows = list(rows)
+        self.ready = ready
+        self.opened: list[str] = []
+        self.events: list[tuple] = []
+        self.status_batch = None
+
+    def get_requests_ready_to_output(self, request_id=None):
+        return [row for row in self.rows if request_id is None or row["request_id"] == request_id]
+
+    def is_request_ready(self, request_id):
+        return self.ready, {"request_id": request_id, "identifier": f"{request_id}id", "name": "TsyBondInfo"}
+
+    def open_data_content(self, request_id):
+        self.opened.append(request_id)
+        return "csv", io.StringIO(TSY_CSV)
+
+    def begin_status_batch(self):
+        self.events.append(("begin",))
+
+    def flush_status_batch(self):
+        self.events.append(("flush",))
+
+    def complete_data_process(self, request_id):
+        self.events.append(("complete", request_id))
+
+    def error_data_process(self, request_id):
+        self.events.append(("error", request_id))
+
+
+def _fan_out_outputter(db, sink_workers: int = 1, fail_type: str = None):
+    outputter = _outputter(BloombergOutputter.TRANSFORM_COLUMNAR)
+    outputter.bbgdb = db
+    outputter.requestDefinitions = {"TsyBondInfo": {"request_name": "TsyBondInfo"}}
+    outputter.sink_pool = ThreadPoolExecutor(max_workers=sink_workers) if sink_workers > 1 else None
+    outputter._thread_local = threading.local()
+    outputter._sink_db_lock = threading.Lock()
+    outputter._sink_db_connections = []
+    outputter._get_sink_db = lambda: _FanOutDatabase()
+    outputter.written = []
+
+    def write_data(request_status, request_def, output_type, data_type=None, data_stream=None, frame=None, bbgdb=None):
+        if output_type == fail_type:
+            raise IOError(f"{output_type} sink failed")
+        outputter.written.append((request_status["request_id"], output_type, data_type, frame))
+
+    outputter.write_data = write_data
+    return outputter
+
+
+@pytest.mark.parametrize("sink_workers", [1, 3])
+def test_one_load_feeds_every_output_type(sink_workers):
+    db = _FanOutDatabase()
+    outputter = _fan_out_outputter(db, sink_workers)
+    try:
+        outputter.output_request_types("r1", ["database", "csv", "raw"])
+    finally:
+        if outputter.sink_pool is not None:
+            outputter.sink_pool.shutdown(wait=True)
+    assert db.opened == ["r1"]
+    assert sorted(output_type for _, output_type, _, _ in outputter.written) == ["csv", "database", "raw"]
+    frames = {id(frame) for _, _, _, frame in outputter.written}
+    assert len(frames) == 1 and outputter.written[0][3] is not None
+    assert db.events == [("begin",), ("complete", "r1"), ("flush",)]
+
+
+def test_a_failed_sink_errors_the_request_and_still_flushes():
+    db = _FanOutDatabase()
+    outputter = _fan_out_outputter(db, sink_workers=3, fail_type="csv")
+    try:
+        with pytest.raises(IOError):
+            outputter.output_request_types("r1", ["database", "csv"])
+    finally:
+        outputter.sink_pool.shutdown(wait=True)
+    assert db.events == [("begin",), ("error", "r1"), ("flush",)]
+
+
+def test_not_ready_request_is_left_alone():
+    db = _FanOutDatabase(ready=False)
+    outputter = _fan_out_outputter(db)
+    outputter.output_request_types("r1", ["database"])
+    assert not db.opened and not db.events and not outputter.written
+
+
+def test_ready_rows_are_grouped_by_request():
+    db = _FanOutDatabase(rows=[{"request_id": "r1", "output_type": "database"},
+                               {"request_id": "r2", "output_type": "csv"},
+                               {"request_id": "r1", "output_type": "csv"},
+                               {"request_id": "r1", "output_type": "raw"}])
+    outputter = _fan_out_outputter(db)
+    calls = []
+    outputter.output_request_types = lambda request_id, output_types: calls.append((request_id, output_types))
+    outputter.output_ready_requests()
+    assert calls == [("r1", ["database", "csv", "raw"]), ("r2", ["csv"])]
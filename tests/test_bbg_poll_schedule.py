@@ -0,0 +1,67 @@
+from bbg_poll_schedule import BloombergPollSchedule
+
+
+def _request(request_id, **fields):
+    request = {"request_id": request_id, "request_name": "TsyBondInfo", "response_poll_wait_sec": 10}
+    request.update(fields)
+    return request
+
+
+def test_first_poll_waits_poll_wait_sec():
+    schedule = BloombergPollSchedule()
+    schedule.sync([_request("a")], now=1000.0)
+    assert schedule.due(now=1009.0) == []
+    assert [request["request_id"] for request in schedule.due(now=1010.0)] == ["a"]
+
+
+def test_first_poll_uses_turnaround():
+    schedule = BloombergPollSchedule()
+    schedule.set_turnaround({"TsyBondInfo": 100.0})
+    schedule.sync([_request("a")], now=1000.0)
+    assert schedule.next_due_in(now=1000.0) == 100.0 * BloombergPollSchedule.FIRST_POLL_FRACTION
+
+
+def test_restart_counts_time_already_submitted():
+    schedule = BloombergPollSchedule()
+    schedule.sync([_request("a", submitted_sec=25)], now=1000.0)
+    assert schedule.next_due_in(now=1000.0) == 0.0
+
+
+def test_polled_backs_off_up_to_max_interval():
+    schedule = BloombergPollSchedule(backoff_factor=2.0, max_interval_sec=30)
+    schedule.sync([_request("a")], now=1000.0)
+    now = 1010.0
+    intervals = []
+    for _ in range(4):
+        (request,) = schedule.due(now=now)
+        schedule.polled(request, now=now)
+        interval = schedule.next_due_in(now=now)
+        intervals.append(interval)
+        now += interval
+    assert intervals == [10.0, 20.0, 30.0, 30.0]
+    assert request["response_poll_count"] == 4
+
+
+def test_due_only_once_until_polled():
+    schedule = BloombergPollSchedule()
+    schedule.sync([_request("a")], now=1000.0)
+    assert len(schedule.due(now=1010.0)) == 1
+    assert schedule.due(now=1010.0) == []
+    assert schedule.next_due_in(now=1010.0) is None
+
+
+def test_forgotten_request_is_not_due_or_rescheduled():
+    schedule = BloombergPollSchedule()
+    schedule.sync([_request("a"), _request("b")], now=1000.0)
+    schedule.sync([_request("b")], now=1000.0)
+    assert [request["request_id"] for request in schedule.due(now=1010.0)] == ["b"]
+
+    schedule.polled(_request("a"), now=1010.0)
+    assert "a" not in schedule.next_poll
+
+
+def test_expired_after_max_response_polls():
+    schedule = BloombergPollSchedule()
+    schedule.sync([_request("a", max_response_polls=2, response_poll_count=2),
+                   _request("b", max_response_polls=2, response_poll_count=1)], now=1000.0)
+    assert [request["request_id"] for request in schedule.expired()] == ["a"]
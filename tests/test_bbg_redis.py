@@ -0,0 +1,298 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("ASL.utils.asl_redis")
+
+from bbg_redis import BloombergRedis  # noqa: E402
+from bbg_request import BloombergRequest  # noqa: E402
+
+
+def _request(request_id: str, request_name: str = "ReferenceData", priority: int = 5) -> BloombergRequest:
+    return BloombergRequest(request_type="BBG", request_cmd="", request_id=request_id, identifier="N",
+                            request_name=request_name, request_payload={"u": request_id}, priority=priority)
+
+
+@pytest.fixture
+def fake_redis():
+    # the queue scripts are lua - fakeredis runs them when lupa is there
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis()
+
+
+def _queue(client, monkeypatch, entry_mode: str = BloombergRedis.ENTRY_MODE_REF, lanes: bool = True,
+           lease_sec: int = 0, max_reclaims: int = 2) -> BloombergRedis:
+    monkeypatch.setenv("BBG_QUEUE_ENTRY_MODE", entry_mode)
+    monkeypatch.setenv("BBG_QUEUE_LANES", "true" if lanes else "false")
+    monkeypatch.setenv("BBG_QUEUE_MAX_RECLAIMS", str(max_reclaims))
+    queue = BloombergRedis(lease_sec=lease_sec)
+    queue.redis_client = client
+    return queue
+
+
+def _expire_leases(queue: BloombergRedis) -> None:
+    processing_set, _ = queue._processing_keys()
+    queue.redis_client.zadd(processing_set, {member: 0 for member in queue.redis_client.zrange(processing_set, 0, -1)})
+
+
+@pytest.mark.parametrize("lanes", [True, False])
+def test_expired_lease_goes_back_with_its_score(fake_redis, monkeypatch, lanes):
+    queue = _queue(fake_redis, monkeypatch, lanes=lanes)
+    queue.queue_requests([_request("r1")])
+    (member, score), = queue.claim_request(1)
+    assert not queue.claim_request(1)
+
+    _expire_leases(queue)
+    assert queue.reclaim_expired_requests() == 1
+    assert queue.pop_dead_letters() == []
+    (again, again_score), = queue.claim_request(1)
+    assert (again, again_score) == (member, score)
+    assert queue.load_requests([again])[0]["request_id"] == "r1"
+
+
+def test_renewed_lease_is_not_reclaimed(fake_redis, monkeypatch):
+    queue = _queue(fake_redis, monkeypatch, lease_sec=60)
+    queue.queue_requests([_request("r1")])
+    (member, _), = queue.claim_request(1)
+    processing_set, _ = queue._processing_keys()
+    fake_redis.zadd(processing_set, {member: time.time() - 1})
+
+    queue.renew_leases([member])
+    assert fake_redis.zscore(processing_set, member) > time.time() + 30
+    assert queue.reclaim_expired_requests() == 0
+
+    # only members still held are renewed - a removed one is not put back
+    queue.remove_request(member)
+    queue.renew_leases([member])
+    assert fake_redis.zscore(processing_set, member) is None
+
+
+@pytest.mark.parametrize("entry_mode", [BloombergRedis.ENTRY_MODE_REF, BloombergRedis.ENTRY_MODE_INLINE])
+def test_lease_running_out_too_often_dead_letters(fake_redis, monkeypatch, entry_mode):
+    queue = _queue(fake_redis, monkeypatch, entry_mode=entry_mode, max_reclaims=2)
+    queue.queue_requests([_request("poison")])
+    for _ in range(2):
+        queue.claim_request(1)
+        _expire_leases(queue)
+        assert queue.reclaim_expired_requests() == 1
+
+    (member, _), = queue.claim_request(1)
+    _expire_leases(queue)
+    assert queue.reclaim_expired_requests() == 0
+    assert queue.pop_dead_letters() == ["poison"]
+    assert queue.pop_dead_letters() == []
+
+    reclaims_hash, dead_set = queue._reclaim_keys()
+    assert fake_redis.zrange(dead_set, 0, -1) == [member]
+    assert not fake_redis.hexists(reclaims_hash, member)
+    assert not queue.claim_request(1)
+
+
+class _PayloadRedis:
+    """Just GET / MGET over a dict, for the payload tests that need no scripts"""
+
+    def __init__(self, kv: dict):
+        self.kv = kv
+
+    def mget(self, keys):
+        return [self.kv.get(key) for key in keys]
+
+
+def _plain_queue(monkeypatch, entry_mode: str = BloombergRedis.ENTRY_MODE_REF,
+                 compress_bytes: int = BloombergRedis.DEFAULT_PAYLOAD_COMPRESS_BYTES) -> BloombergRedis:
+    monkeypatch.setenv("BBG_QUEUE_ENTRY_MODE", entry_mode)
+    monkeypatch.setenv("BBG_QUEUE_PAYLOAD_COMPRESS_BYTES", str(compress_bytes))
+    return BloombergRedis()
+
+
+def test_ref_entry_is_the_request_id_with_the_json_in_its_payload(monkeypatch):
+    queue = _plain_queue(monkeypatch)
+    member, payload, score = queue._request_entry(_request("r1", priority=5))
+    assert member == b"r1"
+    assert 5 <= score < 6
+    request_dict = BloombergRedis._decode_payload(payload)
+    assert (request_dict["request_id"], request_dict["request_payload"], request_dict["priority"]) == ("r1", {"u": "r1"}, 5)
+    assert queue._payload_key(member) == queue._payload_key("r1") == f"{queue.queue}:payload:r1"
+
+
+def test_inline_entry_is_the_whole_json(monkeypatch):
+    member, payload, _ = _plain_queue(monkeypatch, BloombergRedis.ENTRY_MODE_INLINE)._request_entry(_request("r1"))
+    assert payload is None
+    assert BloombergRedis._is_inline(member) and BloombergRedis._is_inline(member.decode("utf-8"))
+    assert BloombergRedis._member_request_id(member) == "r1"
+    assert BloombergRedis._member_request_id(b"r1") == "r1"
+
+
+def test_big_payloads_are_compressed(monkeypatch):
+    queue = _plain_queue(monkeypatch, compress_bytes=100)
+    small = b'{"request_id": "r1"}'
+    big = b'{"request_id": "r1", "u": "' + b"912828XX1," * 100 + b'"}'
+    assert queue._encode_payload(small) == small
+    encoded = queue._encode_payload(big)
+    assert encoded.startswith(BloombergRedis.COMPRESSED_PREFIX) and len(encoded) < len(big)
+    assert BloombergRedis._decode_payload(encoded) == BloombergRedis._decode_payload(big)
+    assert BloombergRedis._decode_payload(small.decode("utf-8")) == {"request_id": "r1"}
+    assert _plain_queue(monkeypatch, compress_bytes=0)._encode_payload(big) == big
+
+
+def test_load_requests_reads_ref_and_inline_members_together(monkeypatch):
+    ref_queue = _plain_queue(monkeypatch, compress_bytes=1)
+    inline_member, _, _ = _plain_queue(monkeypatch, BloombergRedis.ENTRY_MODE_INLINE)._request_entry(_request("old"))
+    ref_member, payload, _ = ref_queue._request_entry(_request("new"))
+    gone_member, _, _ = ref_queue._request_entry(_request("expired"))
+    ref_queue.redis_client = _PayloadRedis({ref_queue._payload_key(ref_member): payload})
+
+    loaded = ref_queue.load_requests([inline_member, ref_member, gone_member])
+    assert [request_dict and request_dict["request_id"] for request_dict in loaded] == ["old", "new", None]
+
+
+def test_ref_payload_key_has_a_ttl_and_goes_with_the_request(fake_redis, monkeypatch):
+    monkeypatch.setenv("BBG_QUEUE_PAYLOAD_TTL_SEC", "600")
+    queue = _queue(fake_redis, monkeypatch, lease_sec=60)
+    queue.queue_requests([_request("r1")])
+    payload_key = queue._payload_key("r1")
+    assert 0 < fake_redis.ttl(payload_key) <= 600
+
+    (member, _), = queue.claim_request(1)
+    queue.remove_request(member)
+    assert not fake_redis.exists(payload_key)
+
+
+def test_inline_members_still_claim_and_remove(fake_redis, monkeypatch):
+    queue = _queue(fake_redis, monkeypatch, entry_mode=BloombergRedis.ENTRY_MODE_INLINE, lease_sec=60)
+    queue.queue_requests([_request("r1")])
+    assert not fake_redis.keys(queue._payload_key("*"))
+    (member, _), = queue.claim_request(1)
+    assert queue.load_requests([member])[0]["request_id"] == "r1"
+    queue.remove_request(member)
+    processing_set, _ = queue._processing_keys()
+    assert not fake_redis.zcard(processing_set)
+
+
+def test_enqueue_wakes_a_blocked_worker(fake_redis, monkeypatch):
+    queue = _queue(fake_redis, monkeypatch, lease_sec=60)
+    woken: list = []
+    waiter = threading.Thread(target=lambda: woken.append((queue.wait_for_request(10), time.monotonic())))
+    waiter.start()
+    time.sleep(0.1)
+    queued_at = time.monotonic()
+    queue.queue_requests([_request("r1")])
+    waiter.join(5)
+    assert woken and woken[0][0]
+    assert woken[0][1] - queued_at < 1.0
+
+
+def test_wait_times_out_without_work(fake_redis, monkeypatch):
+    queue = _queue(fake_redis, monkeypatch)
+    queue.wake_workers("control")
+    assert queue.wait_for_request(1)
+    assert not queue.wait_for_request(1)
+
+
+def test_wake_ups_are_capped(fake_redis, monkeypatch):
+    monkeypatch.setattr(BloombergRedis, "MAX_SIGNALS", 5)
+    queue = _queue(fake_redis, monkeypatch)
+    queue.queue_requests([_request(f"r{i}") for i in range(12)], batch_size=4)
+    queue.wake_workers()
+    assert fake_redis.llen(queue._signal_key()) == 5
+
+
+def test_retry_waits_in_its_own_zset_until_due(fake_redis, monkeypatch):
+    queue = _queue(fake_redis, monkeypatch, lease_sec=60)
+    request = _request("r1", request_name="TsyBondInfo", priority=6)
+    queue.queue_requests([request])
+    (member, _), = queue.claim_request(1)
+
+    request.retry_count = 1
+    queue.schedule_retry(request, 30)
+    queue.remove_request(member)
+    assert queue.promote_due_retries() == 0
+    assert not queue.claim_request(1)
+    assert 25 < queue.next_retry_due() <= 30
+    # the payload outlives remove_request while the retry needs it
+    assert fake_redis.exists(queue._payload_key("r1"))
+
+    retry_set, _ = queue._retry_keys()
+    fake_redis.zadd(retry_set, {member: time.time() - 1})
+    assert queue.promote_due_retries() == 1
+    assert queue.next_retry_due() is None
+    (again, score), = queue.claim_request(1)
+    assert again == member and 6 <= score < 7
+    assert queue.load_requests([again])[0]["retry_count"] == 1
+
+
+class _CountingPipelines:
+    """Wraps the client so each pipeline execute counts as 1 round trip"""
+
+    def __init__(self, client, fail_on: int = None):
+        self.client = client
+        self.fail_on = fail_on
+        self.round_trips = 0
+        self.transactions: list[bool] = []
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def pipeline(self, transaction=True):
+        self.transactions.append(transaction)
+        pipe = self.client.pipeline(transaction=transaction)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            self.round_trips += 1
+            if self.round_trips == self.fail_on:
+                raise ConnectionError("redis went away")
+            return execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+def test_bulk_queue_is_one_round_trip_per_batch(fake_redis, monkeypatch):
+    monkeypatch.setenv("BBG_ENQUEUE_BATCH", "4")
+    client = _CountingPipelines(fake_redis)
+    queue = _queue(client, monkeypatch, lanes=False)
+
+    queued = queue.queue_requests(_request(f"r{i}") for i in range(10))
+    assert client.round_trips == 3
+    assert client.transactions == [False] * 3
+    assert [request_id for request_id, _ in queued] == [f"r{i}" for i in range(10)]
+    # same priority keeps insertion order
+    scores = [score for _, score in queued]
+    assert scores == sorted(scores) and all(5 <= score < 6 for score in scores)
+    assert dict(fake_redis.zrange(queue.queue, 0, -1, withscores=True)) == {
+        request_id.encode(): score for request_id, score in queued}
+    assert [request["request_id"] for request in queue.load_requests([f"r{i}".encode() for i in range(10)])] == \
+        [f"r{i}" for i in range(10)]
+
+    assert len(queue.queue_requests([_request("x1"), _request("x2")], batch_size=1, transaction=True)) == 2
+    assert client.round_trips == 5 and client.transactions[-2:] == [True, True]
+
+
+def test_bulk_queue_spans_lanes_in_one_round_trip(fake_redis, monkeypatch):
+    client = _CountingPipelines(fake_redis)
+    queue = _queue(client, monkeypatch)
+    queue.queue_requests([_request("t1", "TsyBondInfo"), _request("m1", "MBSBondInfo"), _request("t2", "TsyBondInfo")])
+    assert client.round_trips == 1
+    assert fake_redis.zcard(queue._lane_prefix() + "TsyBondInfo") == 2
+    assert fake_redis.zcard(queue._lane_prefix() + "MBSBondInfo") == 1
+    assert {member for member, _ in queue.claim_request(3)} == {b"t1", b"m1", b"t2"}
+
+
+def test_ref_mode_requeue_rescores_instead_of_duplicating(fake_redis, monkeypatch):
+    queue = _queue(fake_redis, monkeypatch, lanes=False)
+    queue.queue_requests([_request("r1", priority=5)])
+    (_, score), = queue.queue_requests([_request("r1", priority=2)])
+    assert fake_redis.zcard(queue.queue) == 1
+    assert fake_redis.zscore(queue.queue, b"r1") == score and 2 <= score < 3
+    assert queue.load_requests([b"r1"])[0]["priority"] == 2
+
+
+def test_failed_batch_raises_and_keeps_the_earlier_batches(fake_redis, monkeypatch):
+    client = _CountingPipelines(fake_redis, fail_on=2)
+    queue = _queue(client, monkeypatch, lanes=False)
+    with pytest.raises(ConnectionError):
+        queue.queue_requests([_request(f"r{i}") for i in range(6)], batch_size=3)
+    assert sorted(fake_redis.zrange(queue.queue, 0, -1)) == [b"r0", b"r1", b"r2"]
@@ -0,0 +1,247 @@
+import itertools
+import time
+
+import pytest
+
+pytest.importorskip("ASL.utils.asl_redis")
+
+from bbg_redis import BloombergRedis  # noqa: E402
+from bbg_redis_streams import BloombergStreamRedis  # noqa: E402
+from bbg_request import BloombergRequest, HIGH_CMD_PRIORITY, LAST_CMD_PRIORITY  # noqa: E402
+
+
+def test_default_weights_double_per_priority():
+    weights = BloombergStreamRedis._parse_weights("")
+    assert sorted(weights) == list(range(HIGH_CMD_PRIORITY, LAST_CMD_PRIORITY + 1))
+    assert weights[LAST_CMD_PRIORITY] == 1
+    assert weights[LAST_CMD_PRIORITY - 1] == 2
+    assert weights[HIGH_CMD_PRIORITY] == 2 ** (LAST_CMD_PRIORITY - HIGH_CMD_PRIORITY)
+
+
+def test_given_weights_override_defaults():
+    weights = BloombergStreamRedis._parse_weights("2=100, 4=20")
+    assert weights[2] == 100
+    assert weights[4] == 20
+    assert weights[3] == 2 ** (LAST_CMD_PRIORITY - 3)
+
+
+def test_bad_and_out_of_range_entries_are_ignored():
+    default = BloombergStreamRedis._parse_weights("")
+    assert BloombergStreamRedis._parse_weights("x=3,5=y,99=4,junk") == default
+
+
+def test_weight_is_at_least_one():
+    assert BloombergStreamRedis._parse_weights("5=0")[5] == 1
+    assert BloombergStreamRedis._parse_weights("5=-3")[5] == 1
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ops: list = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.ops.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.ops]
+
+
+class _FakeStreamClient:
+    """Just enough of redis streams / consumer groups for BloombergStreamRedis, entry ids are <n>-0"""
+
+    def __init__(self):
+        self.seq = itertools.count(1)
+        self.kv: dict = {}
+        self.zsets: dict = {}
+        self.hashes: dict = {}
+        self.streams: dict[str, list] = {}
+        self.groups: dict[tuple, dict] = {}  # (stream, group) -> last delivered and pending {id: (consumer, at)}
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+    def xgroup_create(self, stream_key, group, id="0", mkstream=False):
+        self.streams.setdefault(stream_key, [])
+        if (stream_key, group) in self.groups:
+            raise Exception("BUSYGROUP Consumer Group name already exists")
+        self.groups[(stream_key, group)] = {"last": 0, "pending": {}}
+
+    def xadd(self, stream_key, fields):
+        entry_id = f"{next(self.seq)}-0"
+        self.streams.setdefault(stream_key, []).append(
+            (entry_id, {k.encode(): v.encode() if isinstance(v, str) else v for k, v in fields.items()}))
+        return entry_id
+
+    def xreadgroup(self, group, consumer, streams, count=None):
+        response = []
+        for stream_key in streams:
+            state = self.groups[(stream_key, group)]
+            new = [(i, f) for i, f in self.streams[stream_key] if int(i.split("-")[0]) > state["last"]][:count]
+            for entry_id, _ in new:
+                state["last"] = int(entry_id.split("-")[0])
+                state["pending"][entry_id] = (consumer, time.time())
+            if new:
+                response.append([stream_key.encode(), new])
+        return response
+
+    def xack(self, stream_key, group, *entry_ids):
+        for entry_id in entry_ids:
+            self.groups[(stream_key, group)]["pending"].pop(entry_id, None)
+
+    def xdel(self, stream_key, *entry_ids):
+        self.streams[stream_key] = [(i, f) for i, f in self.streams[stream_key] if i not in entry_ids]
+
+    def xclaim(self, stream_key, group, consumer, min_idle_ms, entry_ids, justid=False):
+        for entry_id in entry_ids:
+            self.groups[(stream_key, group)]["pending"][entry_id] = (consumer, time.time())
+        return entry_ids
+
+    def xautoclaim(self, stream_key, group, consumer, min_idle_ms, start_id="0-0", count=None):
+        pending = self.groups[(stream_key, group)]["pending"]
+        start = int(start_id.split("-")[0])
+        entry_ids = sorted((i for i in pending if int(i.split("-")[0]) >= start), key=lambda i: int(i.split("-")[0]))
+        claimed, next_id = [], "0-0"
+        for entry_id in entry_ids:
+            if len(claimed) >= count:
+                next_id = entry_id
+                break
+            if (time.time() - pending[entry_id][1]) * 1000 >= min_idle_ms:
+                pending[entry_id] = (consumer, time.time())
+                claimed.append((entry_id, dict(self.streams[stream_key]).get(entry_id)))
+        return [next_id, claimed, []]
+
+    def eval(self, script, num_keys, *args):
+        # the stream PROMOTE_SCRIPT done in python
+        assert script == BloombergStreamRedis.PROMOTE_SCRIPT
+        (retry_set, score_hash, _), argv = args[:num_keys], args[num_keys:]
+        now, _, stream_prefix, payload_prefix, high, last = argv
+        due = [m for m, due_at in self.zsets.get(retry_set, {}).items() if due_at <= now]
+        for request_id in due:
+            priority = min(max(int(float(self.hashes[score_hash].pop(request_id, last))), high), last)
+            payload = self.kv.pop(payload_prefix + request_id, None)
+            if payload is not None:
+                self.xadd(f"{stream_prefix}{priority}", {"id": request_id, "r": payload})
+            del self.zsets[retry_set][request_id]
+        return len(due)
+
+    def set(self, key, value, ex=None):
+        self.kv[key] = value
+
+    @staticmethod
+    def _str(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update({self._str(member): score for member, score in mapping.items()})
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[self._str(field)] = value
+
+    def lpush(self, *args):
+        pass
+
+    def ltrim(self, *args):
+        pass
+
+
+def _request(request_id: str, priority: int) -> BloombergRequest:
+    return BloombergRequest(request_type="BBG", request_cmd="", request_id=request_id, identifier="N",
+                            request_name="ReferenceData", request_payload={"u": request_id}, priority=priority)
+
+
+@pytest.fixture
+def client():
+    return _FakeStreamClient()
+
+
+def _queue(client, consumer: str, lease_sec: int = 60) -> BloombergStreamRedis:
+    queue = BloombergStreamRedis(consumer=consumer, lease_sec=lease_sec)
+    queue.redis_client = client
+    return queue
+
+
+def _request_ids(queue, claimed) -> list[str]:
+    return [request["request_id"] for request in queue.load_requests([member for member, _ in claimed])]
+
+
+def test_claim_hands_each_entry_to_one_consumer(client):
+    a, b = _queue(client, "a"), _queue(client, "b")
+    a.queue_requests([_request(f"r{i}", 5) for i in range(6)])
+    claimed_a = a.claim_request(4)
+    claimed_b = b.claim_request(4)
+    assert _request_ids(a, claimed_a) == ["r0", "r1", "r2", "r3"]
+    assert _request_ids(b, claimed_b) == ["r4", "r5"]
+    assert all(priority == 5.0 for _, priority in claimed_a + claimed_b)
+    assert not a.claim_request(4)
+
+
+def test_remove_acks_and_release_requeues(client):
+    a = _queue(client, "a")
+    a.queue_requests([_request("done", 5), _request("back", 5)])
+    (done, _), (back, score) = a.claim_request(2)
+    a.remove_request(done)
+    a.release_request(back, score)
+    stream_key = a._stream_key(5)
+    assert not client.groups[(stream_key, a.group)]["pending"]
+    assert [fields[b"id"] for _, fields in client.streams[stream_key]] == [b"back"]
+    assert _request_ids(a, a.claim_request(2)) == ["back"]
+
+
+def test_xautoclaim_takes_over_idle_entries_across_passes(client, monkeypatch):
+    monkeypatch.setattr(BloombergStreamRedis, "RECLAIM_COUNT", 2)
+    dead, alive = _queue(client, "dead", lease_sec=0), _queue(client, "alive", lease_sec=0)
+    dead.queue_requests([_request(f"r{i}", 5) for i in range(3)])
+    dead.claim_request(3)
+
+    assert alive.reclaim_expired_requests() == 2
+    assert alive._reclaim_cursor[alive._stream_key(5)] == "3-0"
+    assert alive.reclaim_expired_requests() == 1
+    assert alive._reclaim_cursor[alive._stream_key(5)] == "0-0"  # walked the whole pending list
+    reclaimed = alive.claim_request(10)
+    assert sorted(_request_ids(alive, reclaimed)) == ["r0", "r1", "r2"]
+    pending = client.groups[(alive._stream_key(5), alive.group)]["pending"]
+    assert {consumer for consumer, _ in pending.values()} == {"alive"}
+
+
+def test_in_flight_entries_are_not_reclaimed(client):
+    worker, other = _queue(client, "worker", lease_sec=1), _queue(client, "other", lease_sec=1)
+    worker.queue_requests([_request("r0", 5)])
+    (member, _), = worker.claim_request(1)
+    entry_id = BloombergStreamRedis._split_member(member)[1]
+    pending = client.groups[(worker._stream_key(5), worker.group)]["pending"]
+    pending[entry_id] = ("worker", time.time() - 5)  # idle past the lease
+    worker.renew_leases([member])
+    assert other.reclaim_expired_requests() == 0
+    assert pending[entry_id][0] == "worker"
+
+
+def test_promote_due_retries_adds_to_its_priority_stream(client):
+    a = _queue(client, "a")
+    a.schedule_retry(_request("retry", 3), 0)
+    a.schedule_retry(_request("later", 3), 3600)
+    assert a.promote_due_retries() == 1
+    assert _request_ids(a, a.claim_request(5)) == ["retry"]
+    retry_set, _ = a._retry_keys()
+    assert list(client.zsets[retry_set]) == ["later"]
+    assert a._payload_key("retry") not in client.kv
+    assert a.entry_mode == BloombergRedis.ENTRY_MODE_REF
+
+
+def test_promote_script_on_redis():
+    # the real lua, where fakeredis can run it
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeRedis()
+    a = _queue(client, "a")
+    a.schedule_retry(_request("retry", 3), 0)
+    a.schedule_retry(_request("low", LAST_CMD_PRIORITY + 5), 0)
+    a.schedule_retry(_request("later", 3), 3600)
+    assert a.promote_due_retries() == 2
+    assert client.xlen(a._stream_key(3)) == 1
+    assert client.xlen(a._stream_key(LAST_CMD_PRIORITY)) == 1
+    retry_set, score_hash = a._retry_keys()
+    assert client.zrange(retry_set, 0, -1) == [b"later"]
+    assert client.hkeys(score_hash) == [b"later"]
+    assert not client.exists(a._payload_key("retry"), a._payload_key("low"))
+    assert sorted(_request_ids(a, a.claim_request(5))) == ["low", "retry"]
@@ -0,0 +1,289 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("ASL.utils.asl_logging")
+pytest.importorskip("requests_oauthlib")
+pytest.importorskip("pyodbc")
+
+from bbg_request import BloombergRequest, LOWEST_REQUEST_PRIORITY  # noqa: E402
+from bbg_request_sender import BloombergRequestSender  # noqa: E402
+
+
+class _FakeDatabase:
+    def __init__(self, fail_ids: tuple = ()):
+        self.fail_ids = fail_ids
+        self.failed: list[str] = []
+        self.errors: dict[str, str] = {}
+        self.retries: list[tuple[str, int]] = []
+
+    def set_request_retry(self, request_id, retry_count):
+        self.retries.append((request_id, retry_count))
+
+    def set_request_failed(self, request_id):
+        if request_id in self.fail_ids:
+            raise RuntimeError("db down")
+        self.failed.append(request_id)
+
+    def store_error_response(self, request_id, error_message):
+        self.errors[request_id] = error_message
+
+
+class _FakeQueue:
+    max_reclaims = 3
+    lease_sec = 30
+
+    def __init__(self, dead_letters: list[str] = None, retry_due: float = None):
+        self.dead_letters = dead_letters or []
+        self.retry_due = retry_due
+        self.removed: list = []
+        self.renewed: list = []
+        self.wakes: list = []
+        self.scheduled: list[tuple[str, int, int, float]] = []
+
+    def schedule_retry(self, request, delay_sec):
+        self.scheduled.append((request.request_id, request.retry_count, request.priority, delay_sec))
+
+    def remove_request(self, member):
+        self.removed.append(member)
+
+    def renew_leases(self, members):
+        self.renewed.append(sorted(members))
+
+    def wake_workers(self, reason="wake"):
+        self.wakes.append(reason)
+
+    def next_retry_due(self):
+        return self.retry_due
+
+    def pop_dead_letters(self):
+        dead_letters, self.dead_letters = self.dead_letters, []
+        return dead_letters
+
+
+def _sender(db, queue) -> BloombergRequestSender:
+    sender = BloombergRequestSender.__new__(BloombergRequestSender)
+    sender.db_connection = db
+    sender.redis_connection = queue
+    return sender
+
+
+def test_dead_letters_are_errored_out_in_the_db():
+    db = _FakeDatabase()
+    sender = _sender(db, _FakeQueue(["r1", "r2"]))
+    sender._fail_dead_letters()
+    assert db.failed == ["r1", "r2"]
+    assert all("dead lettered" in db.errors[request_id] for request_id in ("r1", "r2"))
+    sender._fail_dead_letters()
+    assert db.failed == ["r1", "r2"]
+
+
+def test_one_db_failure_does_not_stop_the_rest():
+    db = _FakeDatabase(fail_ids=("r1",))
+    _sender(db, _FakeQueue(["r1", "r2"]))._fail_dead_letters()
+    assert db.failed == ["r2"]
+
+
+@pytest.mark.parametrize("retry_due, wait_sec", [
+    (None, BloombergRequestSender.MAX_WAIT_TIME),
+    (BloombergRequestSender.MAX_WAIT_TIME + 50, BloombergRequestSender.MAX_WAIT_TIME),
+    (7.2, 8),
+    (0.0, 1),
+])
+def test_idle_wait_ends_when_the_next_retry_is_due(retry_due, wait_sec):
+    assert _sender(_FakeDatabase(), _FakeQueue(retry_due=retry_due))._idle_wait_time() == wait_sec
+
+
+def _request(request_id: str, request_name: str) -> BloombergRequest:
+    return BloombergRequest(request_type="BBG", request_cmd="", request_id=request_id, identifier=request_id,
+                            request_name=request_name, request_payload={"title": request_id})
+
+
+def _pool_sender(queue, max_workers: int, name_limits: dict[str, int]) -> BloombergRequestSender:
+    sender = _sender(_FakeDatabase(), queue)
+    sender.max_workers = max_workers
+    sender.name_limits = name_limits
+    sender.name_semaphores = {}
+    sender.name_semaphore_lock = threading.Lock()
+    sender.name_in_flight = Counter()
+    sender.submit_pool = ThreadPoolExecutor(max_workers=max_workers)
+    sender.pending_submits = set()
+    sender.leased_members = set()
+    sender.leases_renewed_at = 0.0
+    sender.chunk_sizes = {}
+    sender._get_thread_db = lambda: sender.db_connection
+    return sender
+
+
+class _SubmitTracker:
+    """Stands in for _process_single_request - counts how many of each name run at once"""
+
+    def __init__(self, hold_sec: float = 0.05):
+        self.hold_sec = hold_sec
+        self.lock = threading.Lock()
+        self.running: Counter = Counter()
+        self.most_running: Counter = Counter()
+        self.most_total = 0
+        self.done: list[str] = []
+
+    def __call__(self, request: BloombergRequest, db_connection=None):
+        with self.lock:
+            self.running[request.request_name] += 1
+            self.most_running[request.request_name] = max(self.most_running[request.request_name],
+                                                          self.running[request.request_name])
+            self.most_total = max(self.most_total, sum(self.running.values()))
+        time.sleep(self.hold_sec)
+        with self.lock:
+            self.running[request.request_name] -= 1
+            self.done.append(request.request_id)
+
+
+def test_parse_name_limits(monkeypatch):
+    monkeypatch.setenv("BBG_SENDER_CONCURRENCY", "TsyBondInfo=2, MBSBondInfo=4,bad=x,junk,Neg=-1")
+    assert BloombergRequestSender._parse_name_limits("BBG_SENDER_CONCURRENCY") == \
+        {"TsyBondInfo": 2, "MBSBondInfo": 4, "Neg": 0}
+    assert BloombergRequestSender._parse_name_limits("BBG_NOT_SET") == {}
+
+
+def test_pool_submits_in_parallel_within_name_limits():
+    queue = _FakeQueue()
+    sender = _pool_sender(queue, max_workers=4, name_limits={"TsyBondInfo": 1})
+    tracker = _SubmitTracker()
+    sender._process_single_request = tracker
+    try:
+        for i in range(4):
+            sender._dispatch_request(_request(f"tsy{i}", "TsyBondInfo"), f"m-tsy{i}")
+            sender._dispatch_request(_request(f"mbs{i}", "MBSBondInfo"), f"m-mbs{i}")
+        assert sender._lane_caps()["TsyBondInfo"] == 0
+    finally:
+        sender.submit_pool.shutdown(wait=True)
+
+    assert len(tracker.done) == 8
+    assert tracker.most_running["TsyBondInfo"] == 1
+    assert tracker.most_running["MBSBondInfo"] > 1
+    assert tracker.most_total <= 4
+    assert sorted(queue.removed) == sorted([f"m-tsy{i}" for i in range(4)] + [f"m-mbs{i}" for i in range(4)])
+    assert not sender.leased_members
+    assert sender._lane_caps() == {"TsyBondInfo": 1}
+    assert queue.wakes.count("lane") == 4  # only the capped name wakes its lane
+
+
+def test_free_slots_waits_for_a_submit_and_renews_leases():
+    queue = _FakeQueue()
+    queue.lease_sec = 3  # renew every second
+    sender = _pool_sender(queue, max_workers=2, name_limits={})
+    sender._process_single_request = _SubmitTracker(hold_sec=1.5)
+    try:
+        sender._dispatch_request(_request("r1", "TsyBondInfo"), "m1")
+        sender._dispatch_request(_request("r2", "TsyBondInfo"), "m2")
+        sender.leases_renewed_at = time.time()
+        assert sender._free_submit_slots() >= 1
+    finally:
+        sender.submit_pool.shutdown(wait=True)
+    assert ["m1", "m2"] in queue.renewed
+
+
+def test_one_worker_submits_inline():
+    queue = _FakeQueue()
+    sender = _sender(_FakeDatabase(), queue)
+    sender.submit_pool = None
+    sender.chunk_sizes = {}
+    tracker = _SubmitTracker(hold_sec=0)
+    sender._process_single_request = tracker
+    sender._dispatch_request(_request("r1", "TsyBondInfo"), "m1")
+    assert tracker.done == ["r1"] and queue.removed == ["m1"]
+    assert sender._free_submit_slots() == 1
+
+
+def test_failed_submit_is_scheduled_with_growing_delay_then_failed():
+    db, queue = _FakeDatabase(), _FakeQueue()
+    sender = _sender(db, queue)
+    sender.request_definitions = {"TsyBondInfo": {"max_request_retries": 2, "retry_wait_sec": 30}}
+    request = _request("r1", "TsyBondInfo")
+    request.priority = LOWEST_REQUEST_PRIORITY - 1
+
+    sender._handle_request_failure(request, "HTTP 500")
+    sender._handle_request_failure(request, "HTTP 500")
+    assert queue.scheduled == [("r1", 1, LOWEST_REQUEST_PRIORITY, 30), ("r1", 2, LOWEST_REQUEST_PRIORITY, 60)]
+    assert db.retries == [("r1", 1), ("r1", 2)]
+    assert not db.failed
+
+    sender._handle_request_failure(request, "HTTP 500")
+    assert len(queue.scheduled) == 2
+    assert db.failed == ["r1"] and db.errors["r1"] == "HTTP 500"
+
+
+def test_retry_defaults_without_a_request_definition():
+    queue = _FakeQueue()
+    sender = _sender(_FakeDatabase(), queue)
+    sender.request_definitions = {}
+    request = _request("r1", "Adhoc")
+    request.max_retries = 1
+    sender._handle_request_failure(request, "timeout")
+    assert queue.scheduled[0][3] == BloombergRequestSender.DEFAULT_RETRY_WAIT_SEC
+
+
+def _universe_request(request_id: str, size: int) -> BloombergRequest:
+    request = _request(request_id, "MBSBondInfo")
+    request.request_payload = {"title": "MBS", "identifier": "MBS1",
+                               "universe": {"@type": "Universe", "contains": [f"c{i}" for i in range(size)]}}
+    return request
+
+
+def _chunking_sender(queue, chunk_sizes: dict[str, int], target_sec: int = 0) -> BloombergRequestSender:
+    sender = _sender(_FakeDatabase(), queue)
+    sender.chunk_sizes = chunk_sizes
+    sender.chunk_target_sec = target_sec
+    return sender
+
+
+def test_universe_is_split_into_chunks_tied_to_the_parent():
+    parent = _universe_request("p1", 25)
+    chunks = _chunking_sender(_FakeQueue(), {"MBSBondInfo": 10})._chunk_request(parent)
+    assert [len(chunk.request_payload["universe"]["contains"]) for chunk in chunks] == [10, 10, 5]
+    assert [c for chunk in chunks for c in chunk.request_payload["universe"]["contains"]] == [f"c{i}" for i in range(25)]
+    assert {(chunk.parent_request_id, chunk.chunk_count) for chunk in chunks} == {("p1", 3)}
+    assert [chunk.chunk_index for chunk in chunks] == [0, 1, 2]
+    assert [chunk.request_payload["title"] for chunk in chunks] == ["MBS 1/3", "MBS 2/3", "MBS 3/3"]
+    assert len({chunk.request_id for chunk in chunks} | {chunk.identifier for chunk in chunks}) == 6
+    assert all(chunk.request_payload["identifier"] == chunk.identifier for chunk in chunks)
+    assert parent.chunk_count == 3
+    assert len(parent.request_payload["universe"]["contains"]) == 25
+
+
+@pytest.mark.parametrize("chunk_sizes, size", [({}, 25), ({"MBSBondInfo": 30}, 25), ({"MBSBondInfo": 0}, 25)])
+def test_small_or_unconfigured_universe_is_not_split(chunk_sizes, size):
+    parent = _universe_request("p1", size)
+    assert _chunking_sender(_FakeQueue(), chunk_sizes)._chunk_request(parent) == [parent]
+
+
+def test_a_chunk_being_retried_is_not_split_again():
+    chunk = _universe_request("c1", 25)
+    chunk.parent_request_id = "p1"
+    assert _chunking_sender(_FakeQueue(), {"MBSBondInfo": 10})._chunk_request(chunk) == [chunk]
+
+
+def test_chunk_size_shrinks_to_the_turnaround_target():
+    sender = _chunking_sender(_FakeQueue(), {"MBSBondInfo": 5000}, target_sec=600)
+    sender.db_connection.get_seconds_per_security = lambda request_name: 0.5
+    assert sender._get_chunk_size("MBSBondInfo") == 1200
+    sender.db_connection.get_seconds_per_security = lambda request_name: 1000.0
+    assert sender._get_chunk_size("MBSBondInfo") == BloombergRequestSender.MIN_CHUNK_SIZE
+    sender.db_connection.get_seconds_per_security = lambda request_name: None
+    assert sender._get_chunk_size("MBSBondInfo") == 5000
+
+
+def test_split_request_queues_its_chunks_and_saves_the_parent_processing():
+    queue = _FakeQueue()
+    queue.queued = []
+    queue.queue_requests = queue.queued.extend
+    sender = _chunking_sender(queue, {"MBSBondInfo": 10})
+    saved = []
+    sender.db_connection.save_bbg_request = lambda request, title, status: saved.append((request.request_id, status))
+    sender._dispatch_request(_universe_request("p1", 25), "m-p1")
+    assert saved == [("p1", "processing")]
+    assert [chunk.chunk_index for chunk in queue.queued] == [0, 1, 2]
+    assert queue.removed == ["m-p1"]
@@ -0,0 +1,164 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("ASL.utils.asl_logging")
+pytest.importorskip("requests_oauthlib")
+
+from bbg_response_poller import BloombergResponsePoller  # noqa: E402
+
+
+class _FakeDatabase:
+    def __init__(self, parents: list[dict] = (), merge_ok: bool = True):
+        self.parents = list(parents)
+        self.merge_ok = merge_ok
+        self.failed: list[str] = []
+        self.completed: list[str] = []
+        self.merged: list[str] = []
+
+    def get_chunked_parents(self, poll_owner=None):
+        return self.parents
+
+    def merge_chunk_data(self, request_id, identifier, request_name, chunk_count):
+        self.merged.append(request_id)
+        return self.merge_ok
+
+    def set_request_failed(self, request_id):
+        self.failed.append(request_id)
+
+    def set_request_completed(self, request_id):
+        self.completed.append(request_id)
+
+
+class _FakeQueue:
+    def __init__(self):
+        self.completions: list[str] = []
+
+    def publish_completion(self, request_id):
+        self.completions.append(request_id)
+
+
+def _poller(db, **attrs) -> BloombergResponsePoller:
+    poller = BloombergResponsePoller.__new__(BloombergResponsePoller)
+    poller.db_connection = db
+    poller.redis_connection = _FakeQueue()
+    poller.poll_owner = "poller-1"
+    for name, value in attrs.items():
+        setattr(poller, name, value)
+    return poller
+
+
+def _parent(request_id: str, saved: int, completed: int, failed: int = 0, idle_sec: int = 0) -> dict:
+    return {"request_id": request_id, "identifier": f"{request_id}id", "request_name": "MBSBondInfo",
+            "chunk_count": 3, "saved_count": saved, "completed_count": completed, "failed_count": failed,
+            "idle_sec": idle_sec}
+
+
+def test_parent_completes_once_every_chunk_is_in():
+    db = _FakeDatabase([_parent("done", 3, 3), _parent("waiting", 3, 2), _parent("young", 1, 1, idle_sec=10)])
+    poller = _poller(db, chunk_orphan_sec=600)
+    poller._complete_chunked_requests()
+    assert db.merged == ["done"] and db.completed == ["done"]
+    assert poller.redis_connection.completions == ["done"]
+    assert not db.failed
+
+
+def test_parent_fails_on_a_failed_chunk_orphaned_chunks_or_a_bad_merge():
+    db = _FakeDatabase([_parent("bad_chunk", 3, 2, failed=1), _parent("orphaned", 1, 1, idle_sec=601)],
+                       merge_ok=False)
+    db.parents.append(_parent("bad_merge", 3, 3))
+    poller = _poller(db, chunk_orphan_sec=600)
+    poller._complete_chunked_requests()
+    assert db.failed == ["bad_chunk", "orphaned", "bad_merge"]
+    assert not db.completed and not poller.redis_connection.completions
+
+
+def test_chunks_do_not_wake_the_outputter():
+    poller = _poller(_FakeDatabase())
+    poller._publish_completion({"request_id": "c1", "parent_request_id": "p1"})
+    poller._publish_completion({"request_id": "p1"})
+    assert poller.redis_connection.completions == ["p1"]
+
+
+class _FakeSchedule:
+    def __init__(self, requests: list[dict]):
+        self.requests = {request["request_id"]: request for request in requests}
+        self.polled_ids: list[str] = []
+
+    def polled(self, request):
+        self.polled_ids.append(request["request_id"])
+
+
+class _FakeConnection:
+    def __init__(self, listing_ok: bool):
+        self.listing_ok = listing_ok
+        self.batches: list[tuple[list[str], list[str]]] = []
+        self.single: list[str] = []
+
+    def poll_requests_batch(self, requests, polled_ids=None, executor=None):
+        self.batches.append(([request["request_id"] for request in requests], polled_ids))
+        return self.listing_ok
+
+    def poll_single_request(self, request):
+        self.single.append(request["request_id"])
+
+
+@pytest.mark.parametrize("listing_ok", [True, False])
+def test_batch_mode_lists_once_and_falls_back_to_single_polls(listing_ok):
+    requests = [{"request_id": f"r{i}"} for i in range(3)]
+    connection = _FakeConnection(listing_ok)
+    poller = _poller(_FakeDatabase(), bbg_connection=connection, poll_schedule=_FakeSchedule(requests),
+                     poll_mode=BloombergResponsePoller.POLL_MODE_BATCH, poll_pool=None)
+    poller._poll_due_requests(requests[:2])
+    # the listing is matched against everything held, only the due ones count as polled
+    assert connection.batches == [(["r0", "r1", "r2"], ["r0", "r1"])]
+    assert connection.single == ([] if listing_ok else ["r0", "r1"])
+    assert poller.poll_schedule.polled_ids == ["r0", "r1"]
+
+
+def test_nothing_due_polls_nothing():
+    connection = _FakeConnection(True)
+    poller = _poller(_FakeDatabase(), bbg_connection=connection, poll_schedule=_FakeSchedule([]),
+                     poll_mode=BloombergResponsePoller.POLL_MODE_BATCH, poll_pool=None)
+    poller._poll_due_requests([])
+    assert not connection.batches and not connection.single
+
+
+class _OverlapConnection:
+    """Single polls only get past the barrier when they all run at the same time"""
+
+    def __init__(self, parties: int):
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.threads: set[str] = set()
+
+    def poll_single_request(self, request):
+        self.threads.add(threading.current_thread().name)
+        self.barrier.wait()
+
+
+def test_single_polls_run_concurrently_on_the_pool():
+    requests = [{"request_id": f"r{i}"} for i in range(3)]
+    connection = _OverlapConnection(len(requests))
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="bbg_poll") as pool:
+        poller = _poller(_FakeDatabase(), bbg_connection=connection, poll_schedule=_FakeSchedule(requests),
+                         poll_mode=BloombergResponsePoller.POLL_MODE_SINGLE, poll_pool=pool)
+        poller._poll_due_requests(requests)
+    assert not connection.barrier.broken
+    assert len(connection.threads) == 3
+    assert poller.poll_schedule.polled_ids == ["r0", "r1", "r2"]
+
+
+class _WriteDatabase:
+    def __init__(self):
+        self.stored: list[str] = []
+
+    def store_json_data(self, request_id, identifier, json_data):
+        self.stored.append(request_id)
+
+
+def test_handlers_store_through_the_write_db():
+    read_db, write_db = _FakeDatabase(), _WriteDatabase()
+    poller = _poller(read_db, write_db=write_db)
+    poller._handle_json_response({"request_id": "r1", "identifier": "id1", "response_data": {"a": 1}})
+    assert write_db.stored == ["r1"]
@@ -0,0 +1,243 @@
+import gzip
+import hashlib
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("ASL.utils.secrets")
+pytest.importorskip("requests_oauthlib")
+
+from bbg_rest_connection import BloombergRestConnection  # noqa: E402
+from bbg_token_broker import BloombergTokenBroker, FileTokenStore  # noqa: E402
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _gunzip(chunks) -> bytes:
+    return b"".join(BloombergRestConnection._gunzip_chunks(iter(chunks)))
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 4096])
+def test_gunzip_any_chunk_size(size):
+    data = b"id,px\n" + b"912828XX1,99.5\n" * 1000
+    assert _gunzip(_chunks(gzip.compress(data), size)) == data
+
+
+def test_gunzip_multi_member():
+    data = gzip.compress(b"a,b\n") + gzip.compress(b"1,2\n")
+    assert _gunzip(_chunks(data, 5)) == b"a,b\n1,2\n"
+    assert _gunzip([gzip.compress(b"a,b\n"), gzip.compress(b"1,2\n")]) == b"a,b\n1,2\n"
+
+
+def test_plain_data_passes_through():
+    assert _gunzip([b"a", b",b\n", b"1,2\n"]) == b"a,b\n1,2\n"
+    assert _gunzip([b"a"]) == b"a"
+    assert _gunzip([]) == b""
+
+
+def test_truncated_gzip_raises():
+    data = gzip.compress(b"a,b\n" * 1000)
+    with pytest.raises(IOError):
+        _gunzip(_chunks(data[:-10], 64))
+
+
+def test_truncated_second_member_raises():
+    data = gzip.compress(b"a,b\n") + gzip.compress(b"1,2\n" * 100)
+    with pytest.raises(IOError):
+        _gunzip([data[:-4]])
+
+
+class _StubDownload:
+    """Streaming response as download_response_to_file uses it"""
+
+    def __init__(self, body: bytes, status_code: int = 200, content_type: str = "text/csv"):
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type}
+        self.raw = io.BytesIO(body)
+
+    def iter_content(self, chunk_size):
+        while True:
+            chunk = self.raw.read(min(chunk_size, 5))  # small reads so the file is written in pieces
+            if not chunk:
+                break
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def _connection(tmp_path, response: _StubDownload) -> BloombergRestConnection:
+    connection = BloombergRestConnection.__new__(BloombergRestConnection)
+    connection.bbg_host = "https://api.test"
+    connection.catalog = "123"
+    connection.spool_dir = str(tmp_path)
+    connection.token_broker = None
+    connection._http = lambda method, url, endpoint, **kwargs: response
+    return connection
+
+
+def test_download_writes_spool_file_with_size_and_sha256(tmp_path):
+    data = b"id,px\n" + b"912828XX1,99.5\n" * 50
+    info = _connection(tmp_path, _StubDownload(data)).download_response_to_file("resp.csv", "req/1_resp.csv")
+    assert info == {"path": str(tmp_path / "req_1_resp.csv"), "size": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest()}
+    assert (tmp_path / "req_1_resp.csv").read_bytes() == data
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_download_gunzips_and_hashes_the_unzipped_bytes(tmp_path):
+    data = b"a,b\n" + b"1,2\n" * 100
+    response = _StubDownload(gzip.compress(data), content_type="application/gzip")
+    info = _connection(tmp_path, response).download_response_to_file("resp.csv.gz")
+    assert info["path"] == str(tmp_path / "resp.csv")
+    assert (info["size"], info["sha256"]) == (len(data), hashlib.sha256(data).hexdigest())
+
+
+def test_failed_download_returns_none_and_leaves_no_file(tmp_path):
+    assert _connection(tmp_path, _StubDownload(b"", status_code=404)).download_response_to_file("resp.csv") is None
+    truncated = _StubDownload(gzip.compress(b"a,b\n" * 1000)[:-10], content_type="application/gzip")
+    assert _connection(tmp_path, truncated).download_response_to_file("resp.csv.gz") is None
+    assert not list(tmp_path.iterdir())
+
+
+class _StubListing:
+    def __init__(self, body: dict, status_code: int = 200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+
+class _ListingDatabase:
+    def __init__(self):
+        self.polled: list = []
+
+    def update_response_polls(self, request_ids):
+        self.polled.append(list(request_ids))
+
+
+def _listing_connection(pages: dict) -> BloombergRestConnection:
+    connection = BloombergRestConnection.__new__(BloombergRestConnection)
+    connection.bbg_host = "https://api.test"
+    connection.list_response_base = "/eap/catalogs/123/content/responses/"
+    connection.token_broker = None
+    connection.db_connection = _ListingDatabase()
+    connection.listed: list[str] = []
+
+    def http(method, url, endpoint, **kwargs):
+        connection.listed.append(url)
+        return pages[url]
+
+    connection._http = http
+    return connection
+
+
+def test_match_response_identifier():
+    identifiers = {"TsyBondInfo1a2b3c", "MBSBondInfo9f8e7d"}
+    match = BloombergRestConnection._match_response_identifier
+    assert match({"requestIdentifier": "TsyBondInfo1a2b3c"}, identifiers) == "TsyBondInfo1a2b3c"
+    assert match({"metadata": {"DL_REQUEST_ID": "MBSBondInfo9f8e7d"}}, identifiers) == "MBSBondInfo9f8e7d"
+    assert match({"key": "MBSBondInfo9f8e7d_20261018.csv.gz", "metadata": None}, identifiers) == "MBSBondInfo9f8e7d"
+    assert match({"key": "Other_20261018.csv", "requestIdentifier": "Other"}, identifiers) is None
+
+
+def test_listing_follows_next_pages():
+    base = "https://api.test/eap/catalogs/123/content/responses/"
+    connection = _listing_connection({
+        base: _StubListing({"contains": [{"key": "a"}], "next": "/eap/catalogs/123/content/responses/?page=2"}),
+        base + "?page=2": _StubListing({"contains": [{"key": "b"}]}),
+    })
+    assert connection.list_catalog_responses() == [{"key": "a"}, {"key": "b"}]
+    assert connection.listed == [base, base + "?page=2"]
+
+    connection = _listing_connection({base: _StubListing({}, status_code=500)})
+    assert connection.list_catalog_responses() is None
+
+
+def test_batch_poll_lists_once_and_handles_only_the_ready_requests():
+    base = "https://api.test/eap/catalogs/123/content/responses/"
+    connection = _listing_connection({base: _StubListing({"contains": [
+        {"key": "Tsy1_a.csv", "requestIdentifier": "Tsy1"},
+        {"key": "Tsy1_b.csv", "requestIdentifier": "Tsy1"},
+        {"key": "Someone_else.csv"},
+    ]})})
+    ready = []
+    connection._process_ready_request = lambda request, responses: ready.append(
+        (request["request_id"], [response["key"] for response in responses]))
+    requests = [{"request_id": f"r{i}", "identifier": f"Tsy{i}", "request_name": "TsyBondInfo"} for i in range(1, 4)]
+
+    assert connection.poll_requests_batch(requests, polled_ids=["r1", "r2"])
+    assert connection.listed == [base]
+    assert ready == [("r1", ["Tsy1_a.csv", "Tsy1_b.csv"])]
+    assert connection.db_connection.polled == [["r1", "r2"]]
+
+
+def test_batch_poll_reports_a_failed_listing():
+    base = "https://api.test/eap/catalogs/123/content/responses/"
+    connection = _listing_connection({base: _StubListing({}, status_code=503)})
+    assert not connection.poll_requests_batch([{"request_id": "r1", "identifier": "Tsy1", "request_name": "X"}])
+    assert connection.db_connection.polled == []
+    assert connection.poll_requests_batch([])
+
+
+def test_batch_poll_processes_ready_requests_concurrently_on_the_executor():
+    base = "https://api.test/eap/catalogs/123/content/responses/"
+    connection = _listing_connection({base: _StubListing({"contains": [
+        {"key": f"Tsy{i}.csv", "requestIdentifier": f"Tsy{i}"} for i in range(1, 4)]})})
+    barrier = threading.Barrier(3, timeout=5)
+    ready = []
+
+    def process(request, responses):
+        barrier.wait()  # only passes when all 3 downloads are in flight together
+        ready.append(request["request_id"])
+
+    connection._process_ready_request = process
+    requests = [{"request_id": f"r{i}", "identifier": f"Tsy{i}", "request_name": "TsyBondInfo"} for i in range(1, 4)]
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        assert connection.poll_requests_batch(requests, executor=pool)
+    assert not barrier.broken
+    assert sorted(ready) == ["r1", "r2", "r3"]
+
+
+class _StubSession:
+    def __init__(self, token):
+        self.token = token
+        self.fetches = 0
+
+    def fetch_token(self, token_url, client_secret):
+        self.fetches += 1
+        return {"access_token": f"fresh-{self.fetches}", "expires_in": 3600}
+
+
+def test_rejected_shared_token_is_swapped_for_a_new_one(tmp_path):
+    store = FileTokenStore(str(tmp_path / "token.json"))
+    rejected = {"access_token": "rejected", "expires_at": time.time() + 3600}
+    store.put(rejected)
+
+    connection = BloombergRestConnection.__new__(BloombergRestConnection)
+    connection.OAUTH2_ENDPOINT = "https://bsso.test/token"
+    connection.client_secret = "secret"
+    connection.token_lock = threading.Lock()
+    connection.token_broker = BloombergTokenBroker(store)
+    connection.session = _StubSession(rejected)
+
+    connection._ensure_token()
+    assert connection.session.token == rejected
+    assert connection.session.fetches == 0
+
+    connection._refresh_oauth_token()
+    assert connection.session.token["access_token"] == "fresh-1"
+    assert store.get()["access_token"] == "fresh-1"
+
+    # the next process reads the new token instead of going to BSSO
+    assert BloombergTokenBroker(store).get_token(connection._fetch_new_token)["access_token"] == "fresh-1"
+    assert connection.session.fetches == 1
@@ -0,0 +1,123 @@
+import http.client
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bbg_sse_client import BloombergSSEClient, SSEEvent, parse_sse_lines
+
+
+def _events(text: str) -> list[SSEEvent]:
+    return list(parse_sse_lines(text.split("\n")))
+
+
+def test_data_lines_join_and_blank_line_ends_event():
+    events = _events("event: ready\nid: 7\ndata: a\ndata: b\n\ndata: c\n\n")
+    assert events == [SSEEvent(event="ready", data="a\nb", id="7"), SSEEvent(data="c")]
+
+
+def test_comments_and_crlf():
+    events = list(parse_sse_lines([": heartbeat\r", "data:x\r", "\r", ":\r", "\r"]))
+    assert events == [SSEEvent(data="x")]
+
+
+def test_bytes_lines():
+    assert list(parse_sse_lines([b"data: x", b""])) == [SSEEvent(data="x")]
+
+
+def test_retry_only_event_is_yielded():
+    assert _events("retry: 2500\n\n") == [SSEEvent(retry=2500)]
+
+
+def test_bad_retry_is_ignored():
+    assert _events("retry: soon\n\ndata: x\nretry: x\n\n") == [SSEEvent(data="x")]
+
+
+def test_event_without_trailing_blank_line_is_not_yielded():
+    assert _events("data: half") == []
+
+
+class _StubResponse:
+    """Just what BloombergSSEClient uses of a streaming requests response"""
+
+    def __init__(self, connection: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        self.connection = connection
+        self.response = response
+        self.status_code = response.status
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self.response:
+            yield line.decode("utf-8").rstrip("\n") if decode_unicode else line.rstrip(b"\n")
+
+    def close(self):
+        self.connection.close()
+
+
+class _StubSSEServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubSSEHandler)
+        self.last_event_ids: list = []
+
+
+class _StubSSEHandler(BaseHTTPRequestHandler):
+    # first connection gets a retry and event 1 then drops, the reconnect gets event 2
+    def do_GET(self):
+        self.server.last_event_ids.append(self.headers.get("Last-Event-ID"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        if len(self.server.last_event_ids) == 1:
+            body = ": hello\n\nretry: 10\n\nid: 1\nevent: response\ndata: first\n\n"
+        else:
+            body = "id: 2\nevent: response\ndata: second\n\n"
+        self.wfile.write(body.encode("utf-8"))
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = _StubSSEServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_reconnects_and_resumes_from_last_event_id(stub_server, monkeypatch):
+    monkeypatch.setattr(BloombergSSEClient, "MIN_RECONNECT_SEC", 0.01)
+    host, port = stub_server.server_address
+
+    def connect(last_event_id):
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id is not None:
+            headers["Last-Event-ID"] = last_event_id
+        connection.request("GET", "/notifications", headers=headers)
+        return _StubResponse(connection, connection.getresponse())
+
+    events: list[SSEEvent] = []
+    got_both = threading.Event()
+
+    def on_event(event):
+        events.append(event)
+        if len(events) == 2:
+            got_both.set()
+
+    client = BloombergSSEClient(connect, on_event)
+    client.start()
+    try:
+        assert got_both.wait(5)
+    finally:
+        client.stop()
+
+    assert [(event.id, event.event, event.data) for event in events] == [("1", "response", "first"),
+                                                                        ("2", "response", "second")]
+    assert stub_server.last_event_ids[:2] == [None, "1"]
+    assert client.retry_sec == 0.01
+    assert client.last_event_id == "2"
@@ -0,0 +1,196 @@
+import threading
+import time
+
+import pytest
+
+import bbg_token_broker
+from bbg_token_broker import (
+    BloombergTokenBroker,
+    FileTokenStore,
+    RedisTokenStore,
+    token_broker_from_env,
+)
+
+
+class _Fetcher:
+    """Stands in for BSSO - hands out numbered tokens and counts the calls"""
+
+    def __init__(self, expires_in: int = 3600, delay_sec: float = 0.0):
+        self.expires_in = expires_in
+        self.delay_sec = delay_sec
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            number = self.calls
+        time.sleep(self.delay_sec)
+        return {"access_token": f"token-{number}", "expires_in": self.expires_in}
+
+
+@pytest.fixture
+def file_store(tmp_path):
+    return FileTokenStore(str(tmp_path / "token.json"))
+
+
+def test_second_process_picks_up_shared_token(file_store):
+    fetch = _Fetcher()
+    first = BloombergTokenBroker(file_store).get_token(fetch)
+    second = BloombergTokenBroker(file_store).get_token(fetch)
+
+    assert fetch.calls == 1
+    assert second["access_token"] == first["access_token"] == "token-1"
+    assert first["expires_at"] > time.time() + 3000
+
+
+def test_cached_token_is_reused_without_reading_store(file_store):
+    broker = BloombergTokenBroker(file_store)
+    fetch = _Fetcher()
+    token = broker.get_token(fetch)
+    file_store.delete()
+
+    assert broker.get_token(fetch) is token
+    assert fetch.calls == 1
+
+
+def test_token_inside_refresh_margin_is_replaced(file_store):
+    file_store.put({"access_token": "old", "expires_at": time.time() + 60})
+    fetch = _Fetcher()
+    token = BloombergTokenBroker(file_store, refresh_margin_sec=120).get_token(fetch)
+
+    assert token["access_token"] == "token-1"
+    assert file_store.get()["access_token"] == "token-1"
+
+
+def test_concurrent_brokers_fetch_once(file_store):
+    fetch = _Fetcher(delay_sec=0.2)
+    brokers = [BloombergTokenBroker(file_store) for _ in range(5)]
+    tokens = [None] * len(brokers)
+
+    def run(index):
+        tokens[index] = brokers[index].get_token(fetch)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(brokers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert fetch.calls == 1
+    assert {token["access_token"] for token in tokens} == {"token-1"}
+
+
+def test_invalidate_drops_only_the_failed_token(file_store):
+    fetch = _Fetcher()
+    broker = BloombergTokenBroker(file_store)
+    failed = broker.get_token(fetch)
+
+    # another process already replaced it - leave the new one alone
+    file_store.put({"access_token": "newer", "expires_at": time.time() + 3600})
+    broker.invalidate(failed)
+    assert file_store.get()["access_token"] == "newer"
+    assert broker.get_token(fetch)["access_token"] == "newer"
+
+    broker.invalidate()
+    assert file_store.get() is None
+    assert broker.get_token(fetch)["access_token"] == "token-2"
+
+
+class _HeldLockStore(FileTokenStore):
+    """Another process holds the lock and never lets go"""
+
+    def acquire_lock(self, owner, ttl_sec):
+        return False
+
+
+def test_lock_timeout_falls_back_to_own_fetch(tmp_path, monkeypatch):
+    monkeypatch.setattr(BloombergTokenBroker, "LOCK_TTL_SEC", 0.2)
+    monkeypatch.setattr(BloombergTokenBroker, "LOCK_POLL_SEC", 0.01)
+    store = _HeldLockStore(str(tmp_path / "token.json"))
+
+    fetch = _Fetcher()
+    token = BloombergTokenBroker(store).get_token(fetch)
+
+    assert token["access_token"] == "token-1"
+    assert fetch.calls == 1
+    # only the lock holder writes the shared token
+    assert store.get() is None
+
+
+def test_file_lock_is_owner_only_and_stale_lock_is_taken(file_store):
+    assert file_store.acquire_lock("a", 30)
+    assert not file_store.acquire_lock("b", 30)
+
+    file_store.release_lock("b")
+    assert not file_store.acquire_lock("b", 30)
+
+    # a lock older than the ttl was left by a dead process
+    assert file_store.acquire_lock("b", 0)
+    file_store.release_lock("b")
+    assert file_store.acquire_lock("c", 30)
+
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis()
+
+
+def test_redis_store_round_trip_and_lock(redis_client):
+    store = RedisTokenStore(redis_client)
+    fetch = _Fetcher(expires_in=600)
+    token = BloombergTokenBroker(store).get_token(fetch)
+
+    assert store.get() == token
+    assert 0 < redis_client.ttl(RedisTokenStore.TOKEN_KEY) <= 600
+    assert BloombergTokenBroker(store).get_token(fetch) == token
+    assert fetch.calls == 1
+
+    assert store.acquire_lock("a", 30)
+    assert not store.acquire_lock("b", 30)
+    store.release_lock("b")
+    assert redis_client.get(RedisTokenStore.LOCK_KEY) == b"a"
+    store.release_lock("a")
+    assert redis_client.get(RedisTokenStore.LOCK_KEY) is None
+
+
+class _BrokenStore(FileTokenStore):
+    def get(self):
+        raise ConnectionError("store down")
+
+    def put(self, token):
+        raise ConnectionError("store down")
+
+    def acquire_lock(self, owner, ttl_sec):
+        raise ConnectionError("store down")
+
+
+def test_store_errors_do_not_block_getting_a_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(BloombergTokenBroker, "LOCK_TTL_SEC", 0.05)
+    monkeypatch.setattr(BloombergTokenBroker, "LOCK_POLL_SEC", 0.01)
+    fetch = _Fetcher()
+
+    token = BloombergTokenBroker(_BrokenStore(str(tmp_path / "token.json"))).get_token(fetch)
+    assert token["access_token"] == "token-1"
+
+
+def test_token_broker_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv("BBG_TOKEN_CACHE", raising=False)
+    monkeypatch.setenv("BBG_TOKEN_REFRESH_MARGIN_SEC", "30")
+    broker = token_broker_from_env(object())
+    assert isinstance(broker.store, RedisTokenStore)
+    assert broker.refresh_margin_sec == 30
+
+    # redis mode without a client keeps a private token
+    assert token_broker_from_env(None) is None
+
+    monkeypatch.setenv("BBG_TOKEN_CACHE", "FILE")
+    monkeypatch.setenv("BBG_TOKEN_CACHE_FILE", str(tmp_path / "shared.json"))
+    broker = token_broker_from_env()
+    assert isinstance(broker.store, FileTokenStore)
+    assert broker.store.path == str(tmp_path / "shared.json")
+
+    monkeypatch.setenv("BBG_TOKEN_CACHE", bbg_token_broker.TOKEN_CACHE_NONE)
+    assert token_broker_from_env(object()) is None